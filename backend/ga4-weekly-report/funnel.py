@@ -0,0 +1,139 @@
+"""
+Funnel engine over GA4 event counts: an ordered list of steps, any group-by
+dimensions, CR and drop-off per group
+Rows are not kept: the groupings a report needs are declared up front and
+each page of rows is folded into their totals as it arrives, so memory grows
+with the number of groups, not rows. A narrower grouping is rolled up from
+a declared wider one without touching the rows again. The price is that an
+undeclared grouping cannot be asked for after ingest, and folding every
+row into each grouping is somewhat slower than one hard-coded loop
+(scripts/bench_ga4_funnel.py)
+"""
+
+from operator import itemgetter
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+DIMENSIONS = ('source', 'medium', 'campaign')
+
+GroupKey = Tuple[str, ...]
+# (group_by, events): events=None collects every event
+Grouping = Tuple[Sequence[str], Optional[Iterable[str]]]
+
+
+class EventTable:
+    """
+    Totals by (period, event, *group_by) for each declared grouping.
+    aggregate() answers any grouping covered by a declared one: its
+    dimensions and events are a subset of the declared ones
+    """
+
+    def __init__(self, groupings: Sequence[Grouping], dimensions: Sequence[str] = DIMENSIONS):
+        self.dimensions = tuple(dimensions)
+        self.groupings: List[Tuple[Tuple[str, ...], Optional[FrozenSet[str]]]] = [
+            (tuple(group_by), None if events is None else frozenset(events))
+            for group_by, events in groupings
+        ]
+        self.totals: List[Dict[GroupKey, int]] = [{} for _ in self.groupings]
+        self.rows = 0
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def extend(self, rows: Sequence[Sequence]) -> None:
+        """
+        Folds a batch of (period, event, *dimensions, count) rows into the
+        totals; the batch itself is not kept
+        """
+        for (group_by, events), totals in zip(self.groupings, self.totals):
+            key_of = itemgetter(0, 1, *(2 + self.dimensions.index(name) for name in group_by))
+            for row in rows:
+                if events is None or row[1] in events:
+                    key = key_of(row)
+                    totals[key] = totals.get(key, 0) + row[-1]
+        self.rows += len(rows)
+
+    def _covering(self, group_by: Tuple[str, ...], events: Optional[FrozenSet[str]]) -> int:
+        """
+        Index of the narrowest declared grouping that covers group_by and events
+        """
+        candidates = [
+            index for index, (declared, declared_events) in enumerate(self.groupings)
+            if set(group_by) <= set(declared)
+            and (declared_events is None or (events is not None and events <= declared_events))
+        ]
+        if not candidates:
+            wanted = 'all events' if events is None else f'events {sorted(events)}'
+            raise ValueError(f'EventTable does not collect {group_by} for {wanted}')
+        return min(candidates, key=lambda index: len(self.groupings[index][0]))
+
+    def aggregate(self, group_by: Sequence[str] = (), events: Optional[Iterable[str]] = None) -> Dict[GroupKey, Dict[str, int]]:
+        """
+        Sums counts by (period, *group_by) -> {event: count}. Groups keep the
+        order in which they first appear among rows of the selected events
+        """
+        group_by = tuple(group_by)
+        events = None if events is None else frozenset(events)
+        index = self._covering(group_by, events)
+        declared = self.groupings[index][0]
+        group_of = itemgetter(0, *(2 + declared.index(name) for name in group_by))
+
+        result: Dict[GroupKey, Dict[str, int]] = {}
+        for key, count in self.totals[index].items():
+            if events is not None and key[1] not in events:
+                continue
+            group = group_of(key)
+            group_events = result.setdefault(group if group_by else (group,), {})
+            group_events[key[1]] = group_events.get(key[1], 0) + count
+        return result
+
+
+class FunnelStep:
+    def __init__(self, name: str, events: Sequence[str]):
+        self.name = name
+        self.events = tuple(events)
+
+
+class FunnelResult:
+    """
+    Step and event counts of one group, with CR and drop-off between steps
+    """
+
+    def __init__(self, steps: Sequence[FunnelStep], events: Dict[str, int]):
+        self.steps = steps
+        self.events = events
+        self.counts = {step.name: sum(events.get(event, 0) for event in step.events) for step in steps}
+
+    def count(self, name: str) -> int:
+        return self.counts[name] if name in self.counts else self.events.get(name, 0)
+
+    def rate(self, numerator: str, denominator: str) -> float:
+        base = self.count(denominator)
+        return self.count(numerator) / base * 100 if base > 0 else 0
+
+    def dropoffs(self) -> List[float]:
+        """
+        Share lost between each pair of consecutive steps, in percent
+        """
+        result = []
+        for previous, step in zip(self.steps, self.steps[1:]):
+            base = self.counts[previous.name]
+            result.append((base - self.counts[step.name]) / base * 100 if base > 0 else 0)
+        return result
+
+
+class Funnel:
+    def __init__(self, steps: Sequence[FunnelStep]):
+        self.steps = list(steps)
+        self.events = [event for step in self.steps for event in step.events]
+
+    def evaluate(self, table: EventTable, group_by: Sequence[str] = ()) -> Dict[str, Dict[GroupKey, FunnelResult]]:
+        """
+        {period: {group: FunnelResult}}; group is () without group_by
+        """
+        results: Dict[str, Dict[GroupKey, FunnelResult]] = {}
+        for key, events in table.aggregate(group_by, self.events).items():
+            results.setdefault(key[0], {})[key[1:]] = FunnelResult(self.steps, events)
+        return results
+
+    def empty(self) -> FunnelResult:
+        return FunnelResult(self.steps, {})
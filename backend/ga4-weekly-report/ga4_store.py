@@ -0,0 +1,120 @@
+"""
+Local Postgres snapshot of GA4 daily event counts (ga4_daily_events)
+A day is fetched again only while missing or still inside GA4's processing lag
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable, List, Sequence, Tuple
+
+from psycopg2.extras import execute_values
+
+# GA4 keeps revising a day for up to 48 hours after it ends
+SETTLE_HOURS = int(os.environ.get('GA4_SETTLE_HOURS', '48'))
+
+EventRow = Tuple[date, str, str, str, str, int]
+
+# First key of the two-key advisory lock; the second is hashtext(property_id)
+SYNC_LOCK_CLASS = 0x6a4
+
+
+def days_between(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def lock_property(conn: Any, property_id: str) -> None:
+    """
+    Serializes refreshes of one property until the transaction ends, so two
+    concurrent runs do not clear and insert the same days at once
+    """
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', (SYNC_LOCK_CLASS, property_id))
+
+
+def stale_days(conn: Any, property_id: str, days: Sequence[date]) -> List[date]:
+    """
+    Days never fetched, or last fetched before they had settled
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            'SELECT day, fetched_at FROM ga4_fetched_days WHERE property_id = %s AND day = ANY(%s)',
+            (property_id, list(days))
+        )
+        fetched = dict(cur.fetchall())
+    
+    settle = timedelta(hours=SETTLE_HOURS)
+    stale = []
+    for day in days:
+        settled_at = datetime.combine(day + timedelta(days=1), datetime.min.time()) + settle
+        fetched_at = fetched.get(day)
+        if fetched_at is None or fetched_at < settled_at:
+            stale.append(day)
+    return sorted(stale)
+
+
+def group_spans(days: Sequence[date]) -> List[Tuple[date, date]]:
+    spans: List[Tuple[date, date]] = []
+    for day in sorted(days):
+        if spans and day - spans[-1][1] == timedelta(days=1):
+            spans[-1] = (spans[-1][0], day)
+        else:
+            spans.append((day, day))
+    return spans
+
+
+def clear_days(conn: Any, property_id: str, days: Sequence[date]) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            'DELETE FROM ga4_daily_events WHERE property_id = %s AND day = ANY(%s)',
+            (property_id, list(days))
+        )
+
+
+def store_rows(conn: Any, property_id: str, rows: Iterable[EventRow]) -> None:
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            '''
+            INSERT INTO ga4_daily_events (property_id, day, event_name, source, medium, campaign, event_count)
+            VALUES %s
+            ON CONFLICT (property_id, day, event_name, source, medium, campaign)
+            DO UPDATE SET event_count = EXCLUDED.event_count
+            ''',
+            [(property_id,) + row for row in rows],
+            page_size=1000
+        )
+
+
+def mark_fetched(conn: Any, property_id: str, days: Sequence[date], fetched_at: datetime) -> None:
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            '''
+            INSERT INTO ga4_fetched_days (property_id, day, fetched_at) VALUES %s
+            ON CONFLICT (property_id, day) DO UPDATE SET fetched_at = EXCLUDED.fetched_at
+            ''',
+            [(property_id, day, fetched_at) for day in days]
+        )
+
+
+def load_periods(conn: Any, property_id: str, periods: Sequence[Tuple[str, date, date]]) -> List[Tuple[str, str, str, str, str, int]]:
+    """
+    Event counts per (period, event, source, medium, campaign) for the named date ranges
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            '''
+            SELECT p.name, e.event_name, e.source, e.medium, e.campaign, SUM(e.event_count)
+            FROM unnest(%s::text[], %s::date[], %s::date[]) AS p (name, start_day, end_day)
+            JOIN ga4_daily_events AS e
+                ON e.property_id = %s AND e.day BETWEEN p.start_day AND p.end_day
+            GROUP BY 1, 2, 3, 4, 5
+            ''',
+            (
+                [name for name, _, _ in periods],
+                [start for _, start, _ in periods],
+                [end for _, _, end in periods],
+                property_id
+            )
+        )
+        return [row[:5] + (int(row[5]),) for row in cur.fetchall()]
@@ -6,12 +6,67 @@ Updated: Redeploy with new GA4_PROPERTY_ID
 """
 
 import os
+import html
 import json
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
-import urllib.request
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple
 import urllib.parse
 
+# urllib.request, psycopg2 (db_pool, ga4_store) and the Telegram client are
+# imported where they are used, so preflights and config errors skip them
+import tracing
+from funnel import EventTable, Funnel, FunnelStep, Grouping
+from tracing import annotate, debug, in_context, span, traced
+
+GOOGLE_TOKEN_URL = os.environ.get('GOOGLE_TOKEN_URL', 'https://oauth2.googleapis.com/token')
+GA4_API_URL = os.environ.get('GA4_API_URL', 'https://analyticsdata.googleapis.com')
+GA4_SCOPE = 'https://www.googleapis.com/auth/analytics.readonly'
+# Refresh the token this many seconds before Google says it expires
+TOKEN_REFRESH_MARGIN = 300
+
+CONVERSION_EVENTS = ['begin_checkout', 'generate_lead']
+REPORT_FUNNEL = Funnel([
+    FunnelStep('page_view', ['page_view']),
+    FunnelStep('engaged_scroll', ['engaged_scroll']),
+    FunnelStep('view_item', ['view_item']),
+    FunnelStep('conversion', CONVERSION_EVENTS)
+])
+FUNNEL_EVENTS = REPORT_FUNNEL.events
+# Named GA4 date ranges fetched in a single runReport; 364 days keeps weekdays aligned.
+# Each range is the 7 full days before the run, shifted back, so the ranges never overlap
+REPORT_DAYS = 7
+REPORT_PERIODS = [('current', 0), ('previous_week', 7), ('previous_year', 364)]
+REPORT_DIMENSIONS = ['eventName', 'sessionSource', 'sessionMedium', 'sessionCampaignName']
+# Campaign rows shown in the GA4 vs leads table reconciliation
+RECONCILE_TOP = int(os.environ.get('REPORT_RECONCILE_TOP', '5'))
+RECONCILE_EVENTS = ['page_view', 'generate_lead']
+# What the report reads from EventTable; GA4 rows are folded into these
+# totals page by page, and campaign-level counts only when reconciling
+REPORT_GROUPINGS = [((), FUNNEL_EVENTS), (('source', 'medium'), CONVERSION_EVENTS)]
+RECONCILE_GROUPING = (('source', 'medium', 'campaign'), RECONCILE_EVENTS)
+# Rows per runReport page; GA4 caps a single response at 250000
+GA4_PAGE_SIZE = min(int(os.environ.get('GA4_PAGE_SIZE', '10000')), 250000)
+# runReport accepts at most four dateRanges per request
+GA4_MAX_DATE_RANGES = 4
+
+# Properties fetched at once; with DATABASE_URL also capped by the DB pool size
+REPORT_WORKERS = max(int(os.environ.get('GA4_REPORT_WORKERS', '4')), 1)
+# Used when the platform does not report the remaining function time
+REPORT_TIME_BUDGET = float(os.environ.get('REPORT_TIME_BUDGET', '50'))
+# Left for the response when the batch is bounded by the function timeout
+REPORT_TIMEOUT_MARGIN = 5
+# Per-request timeout for Google token and GA4 Data API calls
+GA4_HTTP_TIMEOUT = float(os.environ.get('GA4_HTTP_TIMEOUT', '30'))
+
+# Survive between warm invocations of the same container
+_credentials_cache: Dict[str, Dict[str, str]] = {}
+_signing_keys: Dict[str, Any] = {}
+_access_tokens: Dict[str, Dict[str, Any]] = {}
+_token_lock = threading.Lock()
+
+@traced('ga4-weekly-report')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     is_scheduled = event.get('messages') is not None or event.get('trigger') is not None
     method: str = event.get('httpMethod', 'GET')
@@ -29,17 +84,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        ga4_property_id = os.environ.get('GA4_PROPERTY_ID')
         ga4_credentials = os.environ.get('GA4_CREDENTIALS_JSON')
         telegram_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+        ga4_reports = os.environ.get('GA4_REPORTS')
+        ga4_property_id = os.environ.get('GA4_PROPERTY_ID')
         telegram_chat_id = os.environ.get('TELEGRAM_CHAT_ID')
         
-        if not all([ga4_property_id, ga4_credentials, telegram_token, telegram_chat_id]):
+        if not all([ga4_credentials, telegram_token]) or not (ga4_reports or (ga4_property_id and telegram_chat_id)):
             missing = []
-            if not ga4_property_id: missing.append('GA4_PROPERTY_ID')
+            if not ga4_reports and not ga4_property_id: missing.append('GA4_PROPERTY_ID')
             if not ga4_credentials: missing.append('GA4_CREDENTIALS_JSON')
             if not telegram_token: missing.append('TELEGRAM_BOT_TOKEN')
-            if not telegram_chat_id: missing.append('TELEGRAM_CHAT_ID')
+            if not ga4_reports and not telegram_chat_id: missing.append('TELEGRAM_CHAT_ID')
             
             return {
                 'statusCode': 400,
@@ -55,8 +111,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         try:
-            credentials = json.loads(ga4_credentials)
-            print(f"DEBUG Service Account Email: {credentials.get('client_email', 'NOT FOUND')}")
+            credentials = load_credentials(ga4_credentials)
+            debug(f"DEBUG Service Account Email: {credentials.get('client_email', 'NOT FOUND')}")
         except json.JSONDecodeError:
             return {
                 'statusCode': 400,
@@ -70,34 +126,49 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 })
             }
         
-        access_token = get_ga4_access_token(credentials)
-        
-        print(f'Using GA4 Property ID: {ga4_property_id}')
-        
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=7)
+        try:
+            targets = load_report_targets(ga4_reports, ga4_property_id, telegram_chat_id)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Invalid GA4_REPORTS format',
+                    'message': str(e)
+                })
+            }
         
-        metrics_data = fetch_ga4_metrics(
-            access_token, 
-            ga4_property_id,
-            start_date.strftime('%Y-%m-%d'),
-            end_date.strftime('%Y-%m-%d')
-        )
+        annotate(properties=[target['property_id'] for target in targets])
         
-        report = generate_report(metrics_data, start_date, end_date)
+        # Today is still partial: the week ends yesterday
+        end_date = datetime.now() - timedelta(days=1)
+        start_date = end_date - timedelta(days=REPORT_DAYS - 1)
         
-        send_telegram_message(telegram_token, telegram_chat_id, report)
+        results = run_reports(targets, credentials, telegram_token, start_date, end_date,
+                              os.environ.get('DATABASE_URL'), report_time_budget(context))
+        sent = [result for result in results if result['status'] == 'sent']
+        # partial already reached some chats: a 500 would make cron re-run and resend to them
+        delivered = [result for result in results if result['status'] in ('sent', 'partial')]
+        from telegram_client import get_client
+        annotate(sent=len(sent), delivered=len(delivered), reports=len(results), telegram=get_client().stats())
         
         return {
-            'statusCode': 200,
+            'statusCode': 200 if delivered else 500,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
             'body': json.dumps({
-                'success': True,
-                'message': 'Weekly report sent to Telegram',
-                'report_preview': report[:200] + '...'
+                'success': len(sent) == len(results),
+                'message': f'Weekly report sent to Telegram for {len(delivered)} of {len(results)} properties',
+                'report_preview': delivered[0]['preview'] if delivered else '',
+                'reports': [
+                    {key: value for key, value in result.items() if key != 'preview'}
+                    for result in results
+                ]
             })
         }
         
@@ -115,85 +186,297 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
 
 
-def get_ga4_access_token(credentials: Dict[str, str]) -> str:
-    import jwt
-    import time
-    
-    now = int(time.time())
-    payload = {
-        'iss': credentials['client_email'],
-        'scope': 'https://www.googleapis.com/auth/analytics.readonly',
-        'aud': 'https://oauth2.googleapis.com/token',
-        'iat': now,
-        'exp': now + 3600
+def load_report_targets(raw_reports: Optional[str], property_id: Optional[str],
+                        chat_id: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    GA4_REPORTS is a JSON list of {"property_id", "chat_ids" (or "chat_id"),
+    optional "name" and "reconcile"}; entries for the same property are merged.
+    Without it the single GA4_PROPERTY_ID goes to every chat in the
+    comma-separated TELEGRAM_CHAT_ID and is reconciled with the leads table.
+    """
+    if not raw_reports:
+        chat_ids = [item.strip() for item in (chat_id or '').split(',') if item.strip()]
+        return [{'property_id': property_id.strip(), 'chat_ids': chat_ids, 'name': '', 'reconcile': True}]
+    
+    try:
+        entries = json.loads(raw_reports)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'GA4_REPORTS is not valid JSON: {e}')
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('GA4_REPORTS must be a non-empty JSON list')
+    
+    targets: Dict[str, Dict[str, Any]] = {}
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get('property_id'):
+            raise ValueError(f'GA4_REPORTS[{i}] has no property_id')
+        chat_ids = entry.get('chat_ids', entry.get('chat_id'))
+        chat_ids = [chat_ids] if isinstance(chat_ids, (str, int)) else chat_ids
+        if not chat_ids or not isinstance(chat_ids, list):
+            raise ValueError(f'GA4_REPORTS[{i}] has no chat_ids')
+        
+        target = targets.setdefault(str(entry['property_id']).strip(), {
+            'property_id': str(entry['property_id']).strip(),
+            'chat_ids': [],
+            'name': str(entry.get('name') or ''),
+            'reconcile': bool(entry.get('reconcile', False))
+        })
+        target['chat_ids'] += [str(item).strip() for item in chat_ids if str(item).strip() not in target['chat_ids']]
+    return list(targets.values())
+
+
+def report_time_budget(context: Any) -> float:
+    """
+    Seconds the batch may take: what the platform says is left of the
+    function timeout minus REPORT_TIMEOUT_MARGIN, else REPORT_TIME_BUDGET
+    """
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if callable(get_remaining):
+        return max(get_remaining() / 1000 - REPORT_TIMEOUT_MARGIN, 1)
+    return REPORT_TIME_BUDGET
+
+
+def run_reports(targets: List[Dict[str, Any]], credentials: Dict[str, str], telegram_token: str,
+                start_date: datetime, end_date: datetime, database_url: Optional[str],
+                time_budget: float) -> List[Dict[str, Any]]:
+    """
+    Fetches, builds and sends the report of every property on a bounded pool.
+    Workers share the cached OAuth token (the first one exchanges it, the rest
+    wait on _token_lock and reuse it), the DB pool and the Telegram connection.
+    A property that fails or does not finish within time_budget is reported
+    in its result and does not affect the others.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait
+    from db_pool import get_pool
+    
+    date_ranges = build_date_ranges(start_date, end_date)
+    pool = get_pool(database_url) if database_url else None
+    workers = min(REPORT_WORKERS, len(targets))
+    if pool is not None:
+        # Each worker holds one DB connection while it syncs its property
+        workers = min(workers, pool.max_size)
+    
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ga4-report')
+    futures = {
+        executor.submit(in_context(run_property_report), target, credentials, telegram_token,
+                        start_date, end_date, date_ranges, pool, len(targets) > 1): target
+        for target in targets
     }
+    done, _ = wait(futures, timeout=time_budget)
+    # Threads cannot be interrupted: unfinished ones are left to the container
+    executor.shutdown(wait=False, cancel_futures=True)
     
-    signed_jwt = jwt.encode(payload, credentials['private_key'], algorithm='RS256')
+    results = []
+    for future, target in futures.items():
+        if future in done:
+            results.append(future.result())
+        else:
+            print(f"GA4 report for {target['property_id']} did not finish in {time_budget:.0f}s")
+            results.append({
+                'property_id': target['property_id'],
+                'status': 'timeout',
+                'sent': [],
+                'errors': {'report': f'Not finished in {time_budget:.0f}s'}
+            })
+    return results
+
+
+def run_property_report(target: Dict[str, Any], credentials: Dict[str, str], telegram_token: str,
+                        start_date: datetime, end_date: datetime, date_ranges: List[Dict[str, str]],
+                        pool: Any, labelled: bool) -> Dict[str, Any]:
+    property_id = target['property_id']
+    result: Dict[str, Any] = {'property_id': property_id, 'status': 'failed', 'sent': [], 'errors': {}}
+    started = time.perf_counter()
+    
+    try:
+        lead_counts = None
+        if pool is not None:
+            reconcile = target['reconcile']
+            groupings = REPORT_GROUPINGS + ([RECONCILE_GROUPING] if reconcile else [])
+            
+            def load(conn: Any):
+                table = load_report_from_store(conn, credentials, property_id, date_ranges, groupings)
+                return table, load_lead_counts(conn, date_ranges[0]) if reconcile else None
+            
+            table, lead_counts = pool.run(load)
+        else:
+            table = fetch_ga4_metrics(credentials, property_id, date_ranges, REPORT_GROUPINGS)
+        
+        title = target['name'] or (f'GA4 {property_id}' if labelled else None)
+        with span('serialize'):
+            report = generate_report(table, start_date, end_date, lead_counts, title)
+    except Exception as e:
+        print(f"GA4 report for {property_id} failed: {type(e).__name__}: {e}")
+        result['errors']['report'] = f'{type(e).__name__}: {e}'
+        return result
     
-    data = urllib.parse.urlencode({
-        'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
-        'assertion': signed_jwt
-    }).encode('utf-8')
+    for chat_id in target['chat_ids']:
+        try:
+            send_telegram_message(telegram_token, chat_id, report)
+            result['sent'].append(chat_id)
+        except Exception as e:
+            result['errors'][chat_id] = str(e)
     
-    req = urllib.request.Request(
-        'https://oauth2.googleapis.com/token',
-        data=data,
-        headers={'Content-Type': 'application/x-www-form-urlencoded'}
-    )
+    if result['sent']:
+        result['status'] = 'sent' if not result['errors'] else 'partial'
+    result['preview'] = report[:200] + '...'
+    result['seconds'] = round(time.perf_counter() - started, 2)
+    return result
+
+
+def load_credentials(raw: str) -> Dict[str, str]:
+    credentials = _credentials_cache.get(raw)
+    if credentials is None:
+        credentials = json.loads(raw)
+        _credentials_cache.clear()
+        _credentials_cache[raw] = credentials
+    return credentials
+
+
+def get_signing_key(credentials: Dict[str, str]) -> Any:
+    """Parse the service account RSA key once per container instead of on every run."""
+    pem = credentials['private_key']
+    key = _signing_keys.get(pem)
+    if key is None:
+        from cryptography.hazmat.primitives import serialization
+        key = serialization.load_pem_private_key(pem.encode('utf-8'), password=None)
+        _signing_keys.clear()
+        _signing_keys[pem] = key
+    return key
+
+
+def get_ga4_access_token(credentials: Dict[str, str], force_refresh: bool = False) -> str:
+    """
+    Return a cached OAuth access token, exchanging a freshly signed JWT only when
+    there is none yet, it expires within TOKEN_REFRESH_MARGIN, or force_refresh is set.
+    """
+    import jwt
+    import urllib.request
     
-    with urllib.request.urlopen(req) as response:
-        result = json.loads(response.read().decode('utf-8'))
+    client_email = credentials['client_email']
+    with _token_lock:
+        cached = _access_tokens.get(client_email)
+        if cached and not force_refresh and cached['expires_at'] - TOKEN_REFRESH_MARGIN > time.time():
+            return cached['token']
+        
+        now = int(time.time())
+        payload = {
+            'iss': client_email,
+            'scope': GA4_SCOPE,
+            'aud': 'https://oauth2.googleapis.com/token',
+            'iat': now,
+            'exp': now + 3600
+        }
+        
+        signed_jwt = jwt.encode(payload, get_signing_key(credentials), algorithm='RS256')
+        
+        data = urllib.parse.urlencode({
+            'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+            'assertion': signed_jwt
+        }).encode('utf-8')
+        
+        req = urllib.request.Request(
+            GOOGLE_TOKEN_URL,
+            data=data,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'}
+        )
+        
+        with span('http'), urllib.request.urlopen(req, timeout=GA4_HTTP_TIMEOUT) as response:
+            result = json.loads(response.read().decode('utf-8'))
+        
+        _access_tokens[client_email] = {
+            'token': result['access_token'],
+            'expires_at': now + int(result.get('expires_in', 3600))
+        }
+        debug(f"Fetched new GA4 access token, expires in {result.get('expires_in', 3600)}s")
         return result['access_token']
 
 
-def fetch_ga4_metrics(access_token: str, property_id: str, start_date: str, end_date: str) -> Dict[str, Any]:
-    print("DEBUG GA4 PROPERTY ID:", property_id)
-    url = f'https://analyticsdata.googleapis.com/v1beta/properties/{property_id}:runReport'
-    print("DEBUG GA4 URL:", url)
-    print(f"DEBUG Access Token (first 20 chars): {access_token[:20]}...")
-    print(f"DEBUG Date Range: {start_date} to {end_date}")
-    
-    request_body = {
-        'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
-        'dimensions': [
-            {'name': 'eventName'},
-            {'name': 'sessionSource'},
-            {'name': 'sessionMedium'},
-            {'name': 'sessionCampaignName'}
-        ],
+def ga4_post(credentials: Dict[str, str], url: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """POST to the GA4 Data API; on 401 refresh the token once and retry."""
+    import urllib.error
+    import urllib.request
+    
+    for attempt in (1, 2):
+        access_token = get_ga4_access_token(credentials, force_refresh=attempt == 2)
+        req = urllib.request.Request(
+            url,
+            data=json.dumps(body).encode('utf-8'),
+            headers={
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+        )
+        try:
+            with span('http'), urllib.request.urlopen(req, timeout=GA4_HTTP_TIMEOUT) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            if e.code != 401 or attempt == 2:
+                raise
+            print('GA4 returned 401, refreshing access token')
+    raise AssertionError('unreachable')
+
+
+def format_period(start_date: datetime, end_date: datetime, shift: int = 0) -> str:
+    return (f"{(start_date - timedelta(days=shift)).strftime('%d.%m.%Y')}"
+            f" - {(end_date - timedelta(days=shift)).strftime('%d.%m.%Y')}")
+
+
+def build_date_ranges(start_date: datetime, end_date: datetime) -> List[Dict[str, str]]:
+    return [
+        {
+            'name': name,
+            'startDate': (start_date - timedelta(days=shift)).strftime('%Y-%m-%d'),
+            'endDate': (end_date - timedelta(days=shift)).strftime('%Y-%m-%d')
+        }
+        for name, shift in REPORT_PERIODS
+    ]
+
+
+def report_request(date_ranges: List[Dict[str, str]], dimensions: List[str]) -> Dict[str, Any]:
+    return {
+        'dateRanges': date_ranges,
+        'dimensions': [{'name': name} for name in dimensions],
         'metrics': [{'name': 'eventCount'}],
         'dimensionFilter': {
             'filter': {
                 'fieldName': 'eventName',
                 'inListFilter': {
-                    'values': [
-                        'page_view',
-                        'engaged_scroll',
-                        'view_item',
-                        'begin_checkout',
-                        'generate_lead'
-                    ]
+                    'values': FUNNEL_EVENTS
                 }
             }
-        }
+        },
+        'limit': GA4_PAGE_SIZE
     }
+
+
+def iter_report_pages(credentials: Dict[str, str], property_id: str, request_body: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Pages through rowCount with limit/offset, so memory is bounded by
+    GA4_PAGE_SIZE at any cardinality
+    """
+    import urllib.error
     
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(request_body).encode('utf-8'),
-        headers={
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-    )
+    url = f'{GA4_API_URL}/v1beta/properties/{property_id}:runReport'
+    date_ranges = request_body['dateRanges']
+    if tracing.DEBUG:
+        print("DEBUG GA4 PROPERTY ID:", property_id)
+        print("DEBUG GA4 URL:", url)
+        print(f"DEBUG Date Ranges: {date_ranges}")
+        print(f"DEBUG Request Body: {json.dumps(request_body, indent=2)}")
     
-    print(f"DEBUG Request Body: {json.dumps(request_body, indent=2)}")
+    offset = 0
+    pages = 0
     
     try:
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            print(f"DEBUG GA4 Response (first 500 chars): {str(result)[:500]}")
-            return result
+        while True:
+            page = ga4_post(credentials, url, dict(request_body, offset=offset))
+            rows = page.get('rows', [])
+            pages += 1
+            offset += len(rows)
+            row_count = int(page.get('rowCount', 0))
+            yield page
+            if not rows or offset >= row_count:
+                break
     except urllib.error.HTTPError as e:
         error_body = e.read().decode('utf-8')
         print(f'=== GA4 API ERROR DETAILS ===')
@@ -201,7 +484,8 @@ def fetch_ga4_metrics(access_token: str, property_id: str, start_date: str, end_
         print(f'Error Response: {error_body}')
         print(f'Request URL: {url}')
         print(f'Property ID: {property_id}')
-        print(f'Date Range: {start_date} to {end_date}')
+        print(f'Date Ranges: {date_ranges}')
+        print(f'Offset: {offset}')
         
         try:
             error_json = json.loads(error_body)
@@ -222,26 +506,276 @@ def fetch_ga4_metrics(access_token: str, property_id: str, start_date: str, end_
             raise Exception(f'GA4 Access denied (403). Service account email needs "Viewer" or "Administrator" role in GA4 property {property_id}. Check: 1) Correct property selected, 2) Permissions applied (may take 5-10 min). Full error: {error_body}')
         else:
             raise Exception(f'GA4 API Error {e.code}: {error_body}')
+    
+    debug(f"DEBUG GA4 rows: {offset} of {row_count} in {pages} page(s)")
+    if offset != row_count:
+        raise Exception(f'GA4 returned {offset} rows, expected rowCount={row_count}')
+
+
+def fetch_ga4_metrics(credentials: Dict[str, str], property_id: str, date_ranges: List[Dict[str, str]],
+                      groupings: Sequence[Grouping]) -> EventTable:
+    """
+    One runReport for all periods: with several named dateRanges GA4 adds a
+    dateRange dimension to each row, so the comparison costs no extra round trip.
+    Each page is folded into the groupings' totals and dropped.
+    """
+    table = EventTable(groupings)
+    for page in iter_report_pages(credentials, property_id, report_request(date_ranges, REPORT_DIMENSIONS)):
+        add_report_page(table, page.get('dimensionHeaders', []), page.get('rows', []))
+    return table
+
+
+def add_report_page(table: EventTable, dimension_headers: List[Dict[str, str]], rows: List[Dict[str, Any]]) -> None:
+    """
+    GA4 appends the dateRange dimension after the requested ones; rows
+    without it (single-range responses) count as current.
+    """
+    headers = [header['name'] for header in dimension_headers]
+    range_index = headers.index('dateRange') if 'dateRange' in headers else None
+    if range_index is None and rows and len(rows[0]['dimensionValues']) > len(REPORT_DIMENSIONS):
+        range_index = len(REPORT_DIMENSIONS)
+    
+    if range_index is None:
+        table.extend([
+            ('current', d[0]['value'], d[1]['value'], d[2]['value'], d[3]['value'], int(row['metricValues'][0]['value']))
+            for row in rows for d in (row['dimensionValues'],)
+        ])
+    else:
+        table.extend([
+            (d[range_index]['value'], d[0]['value'], d[1]['value'], d[2]['value'], d[3]['value'],
+             int(row['metricValues'][0]['value']))
+            for row in rows for d in (row['dimensionValues'],)
+        ])
+
+
+def sync_ga4_store(conn: Any, credentials: Dict[str, str], property_id: str, date_ranges: List[Dict[str, str]]) -> int:
+    """
+    Fetches from GA4 only the days of date_ranges that the local store is
+    missing or that were stored before they settled. Returns the number of
+    refreshed days.
+    """
+    import ga4_store
+    
+    days = sorted({
+        day
+        for date_range in date_ranges
+        for day in ga4_store.days_between(
+            datetime.strptime(date_range['startDate'], '%Y-%m-%d').date(),
+            datetime.strptime(date_range['endDate'], '%Y-%m-%d').date()
+        )
+    })
+    ga4_store.lock_property(conn, property_id)
+    stale = ga4_store.stale_days(conn, property_id, days)
+    debug(f"GA4 store: {len(days) - len(stale)} of {len(days)} day(s) cached, fetching {len(stale)}")
+    if not stale:
+        return 0
+    
+    fetched_at = datetime.now()
+    ga4_store.clear_days(conn, property_id, stale)
+    
+    spans = ga4_store.group_spans(stale)
+    for i in range(0, len(spans), GA4_MAX_DATE_RANGES):
+        # Spans never overlap, so (date, dimensions) is unique across them
+        # and the appended dateRange dimension can be ignored
+        span_ranges = [
+            {'startDate': start.strftime('%Y-%m-%d'), 'endDate': end.strftime('%Y-%m-%d')}
+            for start, end in spans[i:i + GA4_MAX_DATE_RANGES]
+        ]
+        request_body = report_request(span_ranges, ['date'] + REPORT_DIMENSIONS)
+        for page in iter_report_pages(credentials, property_id, request_body):
+            ga4_store.store_rows(conn, property_id, [
+                (
+                    datetime.strptime(row['dimensionValues'][0]['value'], '%Y%m%d').date(),
+                    row['dimensionValues'][1]['value'],
+                    row['dimensionValues'][2]['value'],
+                    row['dimensionValues'][3]['value'],
+                    row['dimensionValues'][4]['value'],
+                    int(row['metricValues'][0]['value'])
+                )
+                for row in page.get('rows', [])
+            ])
+    
+    ga4_store.mark_fetched(conn, property_id, stale, fetched_at)
+    conn.commit()
+    return len(stale)
+
+
+def load_report_from_store(conn: Any, credentials: Dict[str, str], property_id: str, date_ranges: List[Dict[str, str]],
+                           groupings: Sequence[Grouping]) -> EventTable:
+    import ga4_store
+    
+    sync_ga4_store(conn, credentials, property_id, date_ranges)
+    
+    periods = [
+        (
+            date_range['name'],
+            datetime.strptime(date_range['startDate'], '%Y-%m-%d').date(),
+            datetime.strptime(date_range['endDate'], '%Y-%m-%d').date()
+        )
+        for date_range in date_ranges
+    ]
+    rows = ga4_store.load_periods(conn, property_id, periods)
+    conn.rollback()
+    
+    table = EventTable(groupings)
+    table.extend(rows)
+    return table
 
 
-def generate_report(metrics_data: Dict[str, Any], start_date: datetime, end_date: datetime) -> str:
-    events_count = {
-        'page_view': 0,
-        'engaged_scroll': 0,
-        'view_item': 0,
-        'begin_checkout': 0,
-        'generate_lead': 0
+def format_delta(current: int, baseline: int) -> str:
+    if baseline == 0:
+        return 'новое' if current > 0 else '—'
+    return f"{(current - baseline) / baseline * 100:+.1f}%"
+
+
+def load_lead_counts(conn: Any, date_range: Dict[str, str]) -> Dict[Tuple[str, str, str], int]:
+    """
+    Leads saved by save-lead per (utm_source, utm_medium, utm_campaign) for the
+    report window: one GROUP BY over the lead_daily_stats rollup, O(days)
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            '''
+            SELECT utm_source, utm_medium, utm_campaign, SUM(leads_count)
+            FROM lead_daily_stats
+            WHERE day BETWEEN %s AND %s
+            GROUP BY 1, 2, 3
+            ''',
+            (date_range['startDate'], date_range['endDate'])
+        )
+        rows = cur.fetchall()
+    conn.rollback()
+    return {(source, medium, campaign): int(count) for source, medium, campaign, count in rows}
+
+
+def campaign_key(source: str, medium: str, campaign: str) -> Tuple[str, str, str]:
+    """
+    GA4 fills missing UTM values with placeholders like (direct), (none),
+    (not set); the leads table stores them as empty strings
+    """
+    def normalize(value: str) -> str:
+        value = (value or '').strip().lower()
+        return '' if value.startswith('(') and value.endswith(')') else value
+    
+    return normalize(source), normalize(medium), normalize(campaign)
+
+
+def reconcile_leads(table: EventTable, lead_counts: Dict[Tuple[str, str, str], int]) -> Dict[str, Any]:
+    """
+    Hash join of current-period GA4 page_view / generate_lead per campaign
+    with the leads table counts on normalized source / medium / campaign
+    """
+    ga4: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+    for (period, source, medium, campaign), events in table.aggregate(*RECONCILE_GROUPING).items():
+        if period != 'current':
+            continue
+        counts = ga4.setdefault(campaign_key(source, medium, campaign), {'page_view': 0, 'generate_lead': 0})
+        for event_name, count in events.items():
+            counts[event_name] += count
+    
+    db: Dict[Tuple[str, str, str], int] = {}
+    for key, count in lead_counts.items():
+        key = campaign_key(*key)
+        db[key] = db.get(key, 0) + count
+    
+    rows = []
+    for key in set(ga4) | set(db):
+        events = ga4.get(key, {'page_view': 0, 'generate_lead': 0})
+        leads = db.get(key, 0)
+        rows.append({
+            'source': key[0],
+            'medium': key[1],
+            'campaign': key[2],
+            'leads': leads,
+            'ga4_leads': events['generate_lead'],
+            'difference': events['generate_lead'] - leads,
+            'page_views': events['page_view'],
+            'cr': (leads / events['page_view'] * 100) if events['page_view'] > 0 else 0
+        })
+    rows.sort(key=lambda row: (-row['leads'], -row['ga4_leads'], row['source'], row['medium'], row['campaign']))
+    
+    total_leads = sum(db.values())
+    total_ga4 = sum(events['generate_lead'] for events in ga4.values())
+    total_page_views = sum(events['page_view'] for events in ga4.values())
+    return {
+        'rows': rows,
+        'leads': total_leads,
+        'ga4_leads': total_ga4,
+        'difference': total_ga4 - total_leads,
+        'cr': (total_leads / total_page_views * 100) if total_page_views > 0 else 0
     }
+
+
+def format_reconciliation(reconciliation: Dict[str, Any]) -> str:
+    lines = [
+        "<b>🧾 Сверка с базой лидов:</b>",
+        f"• Лидов в базе: {reconciliation['leads']:,}, generate_lead в GA4: {reconciliation['ga4_leads']:,}"
+        f" (расхождение {reconciliation['difference']:+,})",
+        f"• Реальный CR (лиды / page_view): {reconciliation['cr']:.2f}%"
+    ]
+    for row in reconciliation['rows'][:RECONCILE_TOP]:
+        label = ' / '.join(value or '—' for value in (row['source'], row['medium'], row['campaign']))
+        lines.append(
+            f"• {html.escape(label)}: {row['leads']:,} в базе, {row['ga4_leads']:,} в GA4"
+            f" ({row['difference']:+,}), CR {row['cr']:.2f}%"
+        )
+    return '\n'.join(lines)
+
+
+def report_numbers(table: EventTable) -> Dict[str, Any]:
+    """
+    Every figure shown in the report, computed by the funnel engine
+    """
+    sources: Dict[str, Dict[str, int]] = {name: {} for name, _ in REPORT_PERIODS}
+    for (period, source, medium), events in table.aggregate(('source', 'medium'), CONVERSION_EVENTS).items():
+        if period in sources:
+            utm_key = f"{source} / {medium}"
+            sources[period][utm_key] = sources[period].get(utm_key, 0) + sum(events.values())
+    
+    totals = REPORT_FUNNEL.evaluate(table)
+    funnels = {name: totals.get(name, {}).get((), REPORT_FUNNEL.empty()) for name, _ in REPORT_PERIODS}
     
-    utm_sources = {}
+    current = funnels['current']
+    utm_sources = sources['current']
+    page_views = current.count('page_view')
+    total_conversions = current.count('conversion')
+    dropoffs = current.dropoffs()
     
-    rows = metrics_data.get('rows', [])
+    return {
+        'events': {event: current.count(event) for event in FUNNEL_EVENTS},
+        'previous_week_events': {event: funnels['previous_week'].count(event) for event in FUNNEL_EVENTS},
+        'previous_year_events': {event: funnels['previous_year'].count(event) for event in FUNNEL_EVENTS},
+        'total_conversions': total_conversions,
+        'cr_overall': round(current.rate('conversion', 'page_view'), 2),
+        'cr_form': round(current.rate('generate_lead', 'view_item'), 2),
+        'cr_bot': round(current.rate('begin_checkout', 'page_view'), 2),
+        'dropoff_engagement': round(dropoffs[0], 2),
+        'dropoff_form_view': round(dropoffs[1], 2),
+        'dropoff_conversion': round(dropoffs[2], 2),
+        'engaged_pct': current.rate('engaged_scroll', 'page_view'),
+        'viewed_form_pct': current.rate('view_item', 'page_view'),
+        'form_submits_pct': (current.count('generate_lead') / total_conversions * 100) if total_conversions > 0 else 0,
+        'bot_opens_pct': (current.count('begin_checkout') / total_conversions * 100) if total_conversions > 0 else 0,
+        'best_source': max(utm_sources.items(), key=lambda x: x[1]) if utm_sources else ('N/A', 0),
+        'top_sources': [
+            (source, count, sources['previous_week'].get(source, 0))
+            for source, count in sorted(utm_sources.items(), key=lambda x: x[1], reverse=True)[:3]
+        ]
+    }
+
+
+def generate_report(table: EventTable, start_date: datetime, end_date: datetime,
+                    lead_counts: Optional[Dict[Tuple[str, str, str], int]] = None,
+                    title: Optional[str] = None) -> str:
+    numbers = report_numbers(table)
+    heading = 'Еженедельный отчёт GA4' + (f' — {html.escape(title)}' if title else '')
+    events_count = numbers['events']
     
     # Check if no data available
-    if not rows:
+    if not any(events_count.values()):
         print("WARNING: No GA4 data found for the specified period")
-        return f"""📊 Еженедельный отчёт GA4
-Период: {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}
+        return f"""📊 {heading}
+Период: {format_period(start_date, end_date)}
 
 ⚠️ Нет данных за выбранный период.
 
@@ -252,47 +786,37 @@ def generate_report(metrics_data: Dict[str, Any], start_date: datetime, end_date
 
 Проверьте установку кода отслеживания GA4 на сайте."""
     
-    for row in rows:
-        event_name = row['dimensionValues'][0]['value']
-        source = row['dimensionValues'][1]['value']
-        medium = row['dimensionValues'][2]['value']
-        campaign = row['dimensionValues'][3]['value']
-        count = int(row['metricValues'][0]['value'])
-        
-        if event_name in events_count:
-            events_count[event_name] += count
-        
-        if event_name in ['begin_checkout', 'generate_lead']:
-            utm_key = f"{source} / {medium}"
-            if utm_key not in utm_sources:
-                utm_sources[utm_key] = 0
-            utm_sources[utm_key] += count
-    
     page_views = events_count['page_view']
     engaged = events_count['engaged_scroll']
     viewed_form = events_count['view_item']
     bot_opens = events_count['begin_checkout']
     form_submits = events_count['generate_lead']
+    total_conversions = numbers['total_conversions']
     
-    total_conversions = bot_opens + form_submits
+    cr_overall = numbers['cr_overall']
+    cr_form = numbers['cr_form']
+    cr_bot = numbers['cr_bot']
     
-    cr_overall = round((total_conversions / page_views * 100), 2) if page_views > 0 else 0
-    cr_form = round((form_submits / viewed_form * 100), 2) if viewed_form > 0 else 0
-    cr_bot = round((bot_opens / page_views * 100), 2) if page_views > 0 else 0
+    dropoff_engagement = numbers['dropoff_engagement']
+    dropoff_form_view = numbers['dropoff_form_view']
+    dropoff_conversion = numbers['dropoff_conversion']
     
-    dropoff_engagement = round(((page_views - engaged) / page_views * 100), 2) if page_views > 0 else 0
-    dropoff_form_view = round(((engaged - viewed_form) / engaged * 100), 2) if engaged > 0 else 0
-    dropoff_conversion = round(((viewed_form - total_conversions) / viewed_form * 100), 2) if viewed_form > 0 else 0
+    best_source = numbers['best_source']
     
-    best_source = max(utm_sources.items(), key=lambda x: x[1]) if utm_sources else ('N/A', 0)
+    engaged_pct = numbers['engaged_pct']
+    viewed_form_pct = numbers['viewed_form_pct']
+    form_submits_pct = numbers['form_submits_pct']
+    bot_opens_pct = numbers['bot_opens_pct']
     
-    engaged_pct = (engaged/page_views*100) if page_views > 0 else 0
-    viewed_form_pct = (viewed_form/page_views*100) if page_views > 0 else 0
-    form_submits_pct = (form_submits/total_conversions*100) if total_conversions > 0 else 0
-    bot_opens_pct = (bot_opens/total_conversions*100) if total_conversions > 0 else 0
+    shifts = dict(REPORT_PERIODS)
+    dynamics = '\n'.join(
+        f"• {event}: {format_delta(events_count[event], numbers['previous_week_events'][event])}"
+        f" / {format_delta(events_count[event], numbers['previous_year_events'][event])}"
+        for event in FUNNEL_EVENTS
+    )
     
-    report = f"""📊 <b>Еженедельный отчёт GA4</b>
-📅 {start_date.strftime('%d.%m.%Y')} - {end_date.strftime('%d.%m.%Y')}
+    report = f"""📊 <b>{heading}</b>
+📅 {format_period(start_date, end_date)}
 
 <b>📈 Воронка:</b>
 1️⃣ page_view: {page_views:,}
@@ -313,6 +837,10 @@ def generate_report(metrics_data: Dict[str, Any], start_date: datetime, end_date
 • Шаг 2→3: {dropoff_form_view:.1f}% (не дошли до формы)
 • Шаг 3→4: {dropoff_conversion:.1f}% (не конвертировали)
 
+<b>📊 Динамика (к прошлой неделе / к той же неделе год назад):</b>
+<i>{format_period(start_date, end_date, shifts['previous_week'])} / {format_period(start_date, end_date, shifts['previous_year'])}</i>
+{dynamics}
+
 <b>🏆 Лучший источник:</b>
 {best_source[0]}: {best_source[1]:,} конверсий
 
@@ -322,9 +850,11 @@ def generate_report(metrics_data: Dict[str, Any], start_date: datetime, end_date
 
 <b>🔝 ТОП-3 источника трафика:</b>"""
     
-    sorted_sources = sorted(utm_sources.items(), key=lambda x: x[1], reverse=True)[:3]
-    for i, (source, count) in enumerate(sorted_sources, 1):
-        report += f"\n{i}. {source}: {count:,}"
+    for i, (source, count, previous_count) in enumerate(numbers['top_sources'], 1):
+        report += f"\n{i}. {source}: {count:,} ({format_delta(count, previous_count)} к прошлой неделе)"
+    
+    if lead_counts is not None:
+        report += f"\n\n{format_reconciliation(reconcile_leads(table, lead_counts))}"
     
     report += f"\n\n✅ Отчёт сгенерирован автоматически"
     
@@ -332,30 +862,20 @@ def generate_report(metrics_data: Dict[str, Any], start_date: datetime, end_date
 
 
 def send_telegram_message(bot_token: str, chat_id: str, message: str) -> None:
-    url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-    print(f"DEBUG Telegram: Sending to chat_id={chat_id}, token length={len(bot_token)}")
-    print(f"DEBUG Telegram URL (masked): https://api.telegram.org/bot{'*'*20}/sendMessage")
+    from telegram_client import TelegramError, get_client
     
-    data = urllib.parse.urlencode({
-        'chat_id': chat_id,
-        'text': message,
-        'parse_mode': 'HTML'
-    }).encode('utf-8')
-    
-    req = urllib.request.Request(url, data=data)
+    debug(f"DEBUG Telegram: Sending to chat_id={chat_id}, token length={len(bot_token)}")
+    client = get_client()
     
     try:
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            print(f"DEBUG Telegram response: {result}")
-            if not result.get('ok'):
-                raise Exception(f"Telegram API error: {result}")
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode('utf-8')
+        result = client.send_message(bot_token, chat_id, message, parse_mode='HTML')
+        debug(f"DEBUG Telegram response: message_id={result.get('message_id') if isinstance(result, dict) else result}")
+    except TelegramError as e:
         print(f"=== TELEGRAM API ERROR ===")
-        print(f"Status Code: {e.code}")
-        print(f"Error: {error_body}")
+        print(f"Status Code: {e.status}")
+        print(f"Error: {e}")
         print(f"Chat ID: {chat_id}")
         print(f"Token valid format: {bot_token.count(':') == 1 and len(bot_token) > 40}")
+        print(f"Client stats: {client.stats()}")
         print(f"=== END TELEGRAM ERROR ===")
-        raise Exception(f"Telegram API Error {e.code}: {error_body}. Check TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID secrets.")
\ No newline at end of file
+        raise Exception(f"Telegram API Error {e.status}: {e}. Check TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID secrets.")
@@ -0,0 +1,219 @@
+'''
+Клиент Telegram Bot API с постоянными HTTPS-соединениями, общими для тёплых вызовов
+Копия живёт в каждой функции, которая пишет в Telegram: telegram-lead, ga4-weekly-report
+'''
+
+import http.client
+import json
+import os
+import select
+import threading
+import time
+import urllib.parse
+from typing import Dict, Any, List, Optional
+
+from tracing import debug, span
+
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_TIMEOUT = float(os.environ.get('TELEGRAM_TIMEOUT', '10'))
+TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', '4'))
+# Дольше этого клиент сам не ждёт: на 429 с большим retry_after
+# решение откладывает вызывающий (диспетчер переносит очередь)
+TELEGRAM_MAX_WAIT = float(os.environ.get('TELEGRAM_MAX_WAIT', '10'))
+BACKOFF_BASE = 0.5
+
+# Обрыв keep-alive соединения сервером проявляется по-разному
+CONNECTION_ERRORS = (http.client.HTTPException, ConnectionError, TimeoutError, OSError)
+
+# Методы, которые нельзя повторять, если запрос уже ушёл: обрыв до ответа
+# не значит, что Telegram его не выполнил, и повтор продублирует сообщение
+NON_IDEMPOTENT_PREFIXES = ('send', 'forward', 'copy')
+
+
+class TelegramError(Exception):
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+class TelegramRateLimited(TelegramError):
+    def __init__(self, retry_after: int):
+        super().__init__(f'Telegram rate limit, retry after {retry_after}s', 429)
+        self.retry_after = retry_after
+
+
+class TelegramDeliveryUnknown(TelegramError):
+    '''
+    Соединение оборвалось после отправки неидемпотентного запроса: Telegram
+    мог его выполнить, поэтому повторять его нельзя
+    '''
+
+
+class TelegramClient:
+    '''
+    Пул keep-alive соединений на контейнер: TLS-рукопожатие только для нового
+    соединения. Блокировка держится лишь на выдачу и возврат соединения,
+    так что параллельные вызовы (отчёты ga4 из потоков) друг друга не ждут.
+    429 ждёт retry_after, 5xx и обрывы - экспоненциальная пауза, всё
+    в пределах max_retries и max_wait. Обрыв после отправки запроса
+    повторяется только для идемпотентных методов.
+    '''
+
+    def __init__(self, base_url: str = TELEGRAM_API_URL, timeout: float = TELEGRAM_TIMEOUT,
+                 max_retries: int = TELEGRAM_MAX_RETRIES, max_wait: float = TELEGRAM_MAX_WAIT):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path_prefix = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'retries': 0, 'reconnects': 0, 'rate_limited': 0, 'errors': 0,
+                       'connections': 0, 'latency_ms': 0.0}
+        self.last_call: Dict[str, Any] = {}
+
+    def _count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._stats[name] += value
+
+    @staticmethod
+    def _dropped(conn: http.client.HTTPConnection) -> bool:
+        '''
+        Простаивающее соединение, закрытое сервером: сокет читается (EOF),
+        хотя запроса не было
+        '''
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def _checkout(self) -> http.client.HTTPConnection:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    self._stats['connections'] += 1
+            if conn is None:
+                connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+                return connection_class(self.host, self.port, timeout=self.timeout)
+            if conn.sock is not None and not self._dropped(conn):
+                return conn
+            self._discard(conn)
+
+    def _checkin(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.append(conn)
+
+    def _discard(self, conn: http.client.HTTPConnection) -> None:
+        conn.close()
+        self._count('reconnects')
+
+    def call(self, token: str, method: str, payload: Dict[str, Any]) -> Any:
+        '''
+        Вызов метода Bot API; возвращает result из ответа
+        '''
+        path = f'{self.path_prefix}/bot{token}/{method}'
+        body = json.dumps(payload).encode('utf-8')
+        idempotent = not method.startswith(NON_IDEMPOTENT_PREFIXES)
+        started = time.perf_counter()
+        retries = 0
+
+        self._count('calls')
+        try:
+            while True:
+                delay = BACKOFF_BASE * 2 ** retries
+                conn = self._checkout()
+                sent = False
+                try:
+                    with span('http'):
+                        conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+                        sent = True
+                        response = conn.getresponse()
+                        data = response.read()
+                except CONNECTION_ERRORS as e:
+                    self._discard(conn)
+                    if sent and not idempotent:
+                        raise TelegramDeliveryUnknown(f'Telegram connection lost after {method} was sent, not retrying: {e}') from e
+                    if retries >= self.max_retries:
+                        raise TelegramError(f'Telegram connection failed: {e}') from e
+                else:
+                    if response.getheader('Connection', '').lower() == 'close':
+                        self._discard(conn)
+                    else:
+                        self._checkin(conn)
+                    response_data = self._decode(data)
+                    if response.status == 200 and response_data.get('ok'):
+                        return response_data.get('result')
+
+                    if response.status == 429:
+                        self._count('rate_limited')
+                        retry_header = response.getheader('Retry-After')
+                        retry_after = int(response_data.get('parameters', {}).get('retry_after') or retry_header or 1)
+                        if retries >= self.max_retries or retry_after > self.max_wait:
+                            raise TelegramRateLimited(retry_after)
+                        delay = max(delay, retry_after)
+                    elif response.status < 500 or retries >= self.max_retries:
+                        raise TelegramError(
+                            f"Telegram API error {response.status}: {response_data.get('description', 'Unknown error')}",
+                            response.status
+                        )
+
+                retries += 1
+                self._count('retries')
+                with span('wait'):
+                    time.sleep(min(delay, self.max_wait))
+        except TelegramError:
+            self._count('errors')
+            raise
+        finally:
+            latency_ms = (time.perf_counter() - started) * 1000
+            self._count('latency_ms', latency_ms)
+            self.last_call = {'method': method, 'latency_ms': round(latency_ms, 1), 'retries': retries}
+            debug(f'Telegram {method}: {self.last_call}')
+
+    @staticmethod
+    def _decode(data: bytes) -> Dict[str, Any]:
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            return {'ok': False, 'description': data[:200].decode('utf-8', 'replace')}
+
+    def send_message(self, token: str, chat_id: str, text: str, parse_mode: Optional[str] = None) -> Any:
+        payload = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        return self.call(token, 'sendMessage', payload)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self._stats)
+        result['latency_ms'] = round(result['latency_ms'], 1)
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_client: Optional[TelegramClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client(base_url: Optional[str] = None) -> TelegramClient:
+    '''
+    Клиент создаётся один раз на контейнер и переживает тёплые вызовы
+    '''
+    global _client
+    base_url = base_url or TELEGRAM_API_URL
+    with _client_lock:
+        if _client is None or _client.base_url != base_url:
+            if _client is not None:
+                _client.close()
+            _client = TelegramClient(base_url)
+        return _client
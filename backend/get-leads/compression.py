@@ -0,0 +1,139 @@
+'''
+Сжатие ответов get-leads по Accept-Encoding: br (если установлен brotli) или gzip.
+Сжатое тело уходит в base64 с isBase64Encoded=True и заголовком Content-Encoding
+'''
+
+import base64
+import gzip
+import io
+import os
+from typing import Any, BinaryIO, Dict, Optional
+
+from tracing import span
+
+# Меньше этого размера сжатие не окупает base64 и заголовки
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+# Уровни выбраны по scripts/bench_compression.py: дальше размер почти не
+# уменьшается, а время сжатия растёт в разы
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+_brotli: Any = None
+
+
+def get_brotli() -> Any:
+    '''
+    Модуль brotli или None, если пакет не установлен: тогда остаётся gzip
+    '''
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    '''
+    Выбор кодировки по Accept-Encoding с учётом q: из допустимых берётся
+    с наибольшим q, при равенстве br предпочтительнее gzip
+    Returns: 'br', 'gzip' или None, если клиент не принимает ни одну
+    '''
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+
+    candidates = ['br', 'gzip'] if get_brotli() else ['gzip']
+    best = None
+    best_weight = 0.0
+    for name in candidates:
+        weight = weights.get(name, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return get_brotli().compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response: Dict[str, Any], encoding: Optional[str],
+                      encoded: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Сжимает body готового ответа, если кодировка выбрана и тело не меньше
+    COMPRESS_MIN_BYTES. encoded - кэш уже сжатых вариантов этого тела
+    (кодировка -> base64), чтобы попадание в кэш ответов не сжимало заново
+    '''
+    response['headers']['Vary'] = 'Accept-Encoding'
+    if not encoding or response.get('isBase64Encoded'):
+        return response
+
+    body = response['body']
+    if encoded is not None and encoding in encoded:
+        response['body'] = encoded[encoding]
+    else:
+        data = body.encode('utf-8')
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        with span('compress'):
+            response['body'] = base64.b64encode(compress(data, encoding)).decode('ascii')
+        if encoded is not None:
+            encoded[encoding] = response['body']
+
+    response['headers']['Content-Encoding'] = encoding
+    response['isBase64Encoded'] = True
+    return response
+
+
+class BrotliWriter(io.RawIOBase):
+    '''
+    Потоковый brotli поверх out: close() дописывает конец потока, не закрывая out
+    '''
+
+    def __init__(self, out: BinaryIO):
+        self._out = out
+        self._compressor = get_brotli().Compressor(quality=BROTLI_QUALITY)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        with span('compress'):
+            self._out.write(self._compressor.process(bytes(data)))
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._out.write(self._compressor.finish())
+        super().close()
+
+
+class GzipWriter(gzip.GzipFile):
+    def write(self, data: Any) -> int:
+        with span('compress'):
+            return super().write(data)
+
+
+def open_compressed(out: BinaryIO, encoding: str) -> BinaryIO:
+    '''
+    Сжимающая обёртка для выгрузок: строки сжимаются по мере записи,
+    и несжатое тело целиком в памяти не собирается
+    '''
+    if encoding == 'br':
+        return BrotliWriter(out)
+    return GzipWriter(fileobj=out, mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
@@ -1,14 +1,202 @@
+import base64
+import binascii
+import csv
+import hashlib
+import io
 import json
 import os
-import psycopg2
-from typing import Dict, Any, List
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Any, Callable, List, Optional, TextIO, Tuple
+from zoneinfo import ZoneInfo
 
+from tracing import annotate, span, traced
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+EQUALITY_FILTERS = ('device', 'utm_source', 'utm_medium', 'utm_campaign', 'niche')
+
+EXPORT_BATCH_SIZE = 2000
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8'
+}
+
+STATS_ZONE = ZoneInfo('Europe/Moscow')
+# измерение -> (ключ в ответе, выражение по leads, выражение по lead_daily_stats)
+STATS_DIMENSIONS = {
+    'utm_source': ('utmSource', "COALESCE(utm_source, '')", 'utm_source'),
+    'utm_medium': ('utmMedium', "COALESCE(utm_medium, '')", 'utm_medium'),
+    'utm_campaign': ('utmCampaign', "COALESCE(utm_campaign, '')", 'utm_campaign'),
+    'device': ('device', "COALESCE(device, '')", 'device'),
+    'day': ('day', "to_char(lead_day(timestamp), 'YYYY-MM-DD')", "to_char(day, 'YYYY-MM-DD')")
+}
+ROLLUP_FILTERS = ('utm_source', 'utm_medium', 'utm_campaign', 'device')
+
+RESPONSE_CACHE_SIZE = 32
+
+CacheKey = Tuple[Tuple[str, str], ...]
+# ключ -> (версия таблицы, тело, сжатые варианты тела: кодировка -> base64)
+_response_cache: 'OrderedDict[CacheKey, Tuple[str, str, Dict[str, str]]]' = OrderedDict()
+
+LEAD_SELECT = '''
+    SELECT 
+        id, timestamp, date, name, contact, niche, goal,
+        utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+        page_depth, time_on_page, device, referrer
+    FROM leads
+'''
+LEAD_FIELDS = (
+    'id', 'timestamp', 'date', 'name', 'contact', 'niche', 'goal',
+    'utmSource', 'utmMedium', 'utmCampaign', 'utmContent', 'utmTerm',
+    'pageDepth', 'timeOnPage', 'device', 'referrer'
+)
+# Тот же лид, что и row_to_lead, но собранный в Postgres: порядок ключей
+# и замена NULL на '' совпадают, поэтому ответы разбираются в одинаковый JSON
+LEAD_JSON = '''
+    json_build_object(
+        'id', id, 'timestamp', timestamp, 'date', date, 'name', name,
+        'contact', contact, 'niche', niche, 'goal', goal,
+        'utmSource', COALESCE(utm_source, ''), 'utmMedium', COALESCE(utm_medium, ''),
+        'utmCampaign', COALESCE(utm_campaign, ''), 'utmContent', COALESCE(utm_content, ''),
+        'utmTerm', COALESCE(utm_term, ''), 'pageDepth', page_depth,
+        'timeOnPage', time_on_page, 'device', device, 'referrer', COALESCE(referrer, '')
+    )
+'''
+# Страницы и NDJSON-выгрузка собираются в Postgres; LEADS_JSON_IN_DB=0
+# возвращает построчную сборку в Python (row_to_lead + json.dumps)
+JSON_IN_DB = os.environ.get('LEADS_JSON_IN_DB', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def encode_cursor(timestamp: int, lead_id: str) -> str:
+    raw = json.dumps([timestamp, lead_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, lead_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise BadRequest('Invalid cursor')
+    if not isinstance(timestamp, int) or not isinstance(lead_id, str):
+        raise BadRequest('Invalid cursor')
+    return timestamp, lead_id
+
+
+def parse_limit(value: Optional[str]) -> int:
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise BadRequest('limit must be an integer')
+    if limit < 1:
+        raise BadRequest('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_filters(params: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    dateFrom/dateTo - границы по timestamp в миллисекундах (включительно),
+    остальные фильтры - точное совпадение значения колонки
+    '''
+    filters: Dict[str, Any] = {}
+    for name in ('dateFrom', 'dateTo'):
+        if params.get(name):
+            try:
+                filters[name] = int(params[name])
+            except ValueError:
+                raise BadRequest(f'{name} must be a timestamp in milliseconds')
+    for name in EQUALITY_FILTERS:
+        if params.get(name):
+            filters[name] = params[name]
+    return filters
+
+
+def build_where(filters: Dict[str, Any], cursor: Optional[Tuple[int, str]]) -> Tuple[str, Dict[str, Any]]:
+    '''
+    Собирает параметризованный WHERE из фильтров и курсора
+    Returns: текст условия (пустой, если условий нет) и параметры запроса
+    '''
+    clauses: List[str] = []
+    query_params: Dict[str, Any] = {}
+    
+    if 'dateFrom' in filters:
+        clauses.append('timestamp >= %(date_from)s')
+        query_params['date_from'] = filters['dateFrom']
+    if 'dateTo' in filters:
+        clauses.append('timestamp <= %(date_to)s')
+        query_params['date_to'] = filters['dateTo']
+    for name in EQUALITY_FILTERS:
+        if name in filters:
+            clauses.append(f'{name} = %({name})s')
+            query_params[name] = filters[name]
+    if cursor:
+        clauses.append('timestamp <= %(cursor_ts)s AND (timestamp < %(cursor_ts)s OR id < %(cursor_id)s)')
+        query_params.update(cursor_ts=cursor[0], cursor_id=cursor[1])
+    
+    where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+    return where, query_params
+
+
+def parse_group_by(value: Optional[str]) -> List[str]:
+    if not value:
+        return ['day']
+    dimensions = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in dimensions if name not in STATS_DIMENSIONS]
+    if unknown:
+        raise BadRequest(f"Unknown groupBy dimension: {', '.join(unknown)}")
+    return list(dict.fromkeys(dimensions))
+
+
+def get_header(event: Dict[str, Any], name: str) -> str:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value or ''
+    return ''
+
+
+def make_etag(version: str, cache_key: CacheKey) -> str:
+    params_hash = hashlib.sha1(json.dumps(cache_key).encode('utf-8')).hexdigest()[:12]
+    return f'W/"{version}-{params_hash}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+def read_leads_version(conn: Any) -> str:
+    '''
+    Версия - (max(id), count(*)) журнала leads_changes, куда триггер пишет
+    строку на каждую запись в leads (см. V0010)
+    '''
+    with conn.cursor() as cur:
+        cur.execute('SELECT COALESCE(max(id), 0), count(*) FROM leads_changes')
+        newest, changes = cur.fetchone()
+    conn.rollback()
+    return f'{newest}.{changes}'
+
+
+@traced('get-leads')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Бизнес: Получение списка лидов из базы данных
-    Args: event - dict с httpMethod, queryStringParameters
+    Бизнес: Получение списка лидов из базы данных, постранично от новых к старым
+    Args: event - dict с httpMethod, queryStringParameters (limit, cursor,
+                  dateFrom, dateTo, device, utm_source, utm_medium, utm_campaign, niche,
+                  format=ndjson|csv для выгрузки всех подходящих лидов без пагинации,
+                  view=stats&groupBy=utm_source,utm_medium,utm_campaign,device,day для агрегатов)
           context - объект с request_id и другими атрибутами
-    Returns: HTTP response dict с массивом лидов
+    Returns: HTTP response dict с массивом лидов и nextCursor следующей страницы;
+             ETag по версии таблицы, 304 на совпавший If-None-Match
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -18,7 +206,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -36,6 +224,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    params: Dict[str, str] = event.get('queryStringParameters') or {}
+    try:
+        with span('validate'):
+            limit = parse_limit(params.get('limit'))
+            cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+            filters = parse_filters(params)
+            export_format = params.get('format')
+            if export_format and export_format not in EXPORT_CONTENT_TYPES:
+                raise BadRequest('format must be ndjson or csv')
+            view = params.get('view') or 'leads'
+            if view not in ('leads', 'stats'):
+                raise BadRequest('view must be leads or stats')
+            group_by = parse_group_by(params.get('groupBy')) if view == 'stats' else []
+    except BadRequest as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    
     try:
         dsn = os.environ.get('DATABASE_URL')
         if not dsn:
@@ -50,58 +262,115 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        print(f'Connecting to database...')
-        conn = psycopg2.connect(dsn)
+        # psycopg2 грузится только здесь: OPTIONS и ошибки параметров обходятся без него
+        from db_pool import get_pool
+        from compression import choose_encoding, compress_response, open_compressed
+        pool = get_pool(dsn)
+        encoding = choose_encoding(get_header(event, 'Accept-Encoding'))
+        cache_key: CacheKey = tuple(sorted((name, value) for name, value in params.items() if value))
+        version = pool.run(read_leads_version)
+        etag = make_etag(version, cache_key)
         
-        try:
-            with conn.cursor() as cur:
-                print('Executing SELECT query...')
-                cur.execute('''
-                    SELECT 
-                        id, timestamp, date, name, contact, niche, goal,
-                        utm_source, utm_medium, utm_campaign, utm_content, utm_term,
-                        page_depth, time_on_page, device, referrer
-                    FROM leads
-                    ORDER BY timestamp DESC
-                ''')
-                
-                rows = cur.fetchall()
-                print(f'Found {len(rows)} leads')
-                leads: List[Dict[str, Any]] = []
-                
-                for row in rows:
-                    leads.append({
-                        'id': row[0],
-                        'timestamp': row[1],
-                        'date': row[2],
-                        'name': row[3],
-                        'contact': row[4],
-                        'niche': row[5],
-                        'goal': row[6],
-                        'utmSource': row[7] or '',
-                        'utmMedium': row[8] or '',
-                        'utmCampaign': row[9] or '',
-                        'utmContent': row[10] or '',
-                        'utmTerm': row[11] or '',
-                        'pageDepth': row[12],
-                        'timeOnPage': row[13],
-                        'device': row[14],
-                        'referrer': row[15] or ''
-                    })
-            
-            print(f'Returning {len(leads)} leads')
+        if etag_matches(get_header(event, 'If-None-Match'), etag):
+            annotate(result='not_modified', version=version)
             return {
-                'statusCode': 200,
+                'statusCode': 304,
                 'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
+                    'ETag': etag,
+                    'Cache-Control': 'no-cache',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'ETag',
+                    'Vary': 'Accept-Encoding'
                 },
-                'body': json.dumps({'leads': leads}),
+                'body': '',
                 'isBase64Encoded': False
             }
-        finally:
-            conn.close()
-            print('Database connection closed')
+        
+        if export_format:
+            # Выгрузка сжимается потоком по мере записи строк, без порога:
+            # размер заранее неизвестен, а маленькой она бывает редко.
+            # Буфер создаётся заново на каждую попытку: повтор pool.run после
+            # обрыва соединения не должен дописывать строки к первой попытке
+            def export(conn: Any) -> Tuple[io.BytesIO, TextIO, int]:
+                buffer = io.BytesIO()
+                out = io.TextIOWrapper(open_compressed(buffer, encoding) if encoding else buffer,
+                                       encoding='utf-8', newline='')
+                return buffer, out, export_leads(conn, export_format, filters, out)
+            
+            buffer, out, exported = pool.run(export)
+            if encoding:
+                # close() дописывает конец сжатого потока, buffer остаётся открытым
+                out.close()
+                with span('serialize'):
+                    body = base64.b64encode(buffer.getvalue()).decode('ascii')
+            else:
+                out.flush()
+                with span('serialize'):
+                    body = buffer.getvalue().decode('utf-8')
+            annotate(result='export', format=export_format, rows=exported, encoding=encoding,
+                     version=version, db_pool=pool.stats())
+            headers = {
+                'Content-Type': EXPORT_CONTENT_TYPES[export_format],
+                'Content-Disposition': f'attachment; filename="leads.{export_format}"',
+                'ETag': etag,
+                'Cache-Control': 'no-cache',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag',
+                'Vary': 'Accept-Encoding'
+            }
+            if encoding:
+                headers['Content-Encoding'] = encoding
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': body,
+                'isBase64Encoded': bool(encoding)
+            }
+        
+        cached = _response_cache.get(cache_key)
+        if cached and cached[0] == version:
+            _response_cache.move_to_end(cache_key)
+            body, encoded = cached[1], cached[2]
+            annotate(result=view, cache='hit', version=version)
+        elif view == 'stats':
+            stats = pool.run(lambda conn: fetch_stats(conn, group_by, filters))
+            with span('serialize'):
+                body = json.dumps(stats)
+            encoded = {}
+            _response_cache[cache_key] = (version, body, encoded)
+            _response_cache.move_to_end(cache_key)
+            while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+            annotate(result=view, cache='miss', groups=len(stats['groups']), version=version, db_pool=pool.stats())
+        else:
+            if JSON_IN_DB:
+                leads_json, rows, next_cursor = pool.run(lambda conn: fetch_leads_json(conn, limit, cursor, filters))
+                with span('serialize'):
+                    body = f'{{"leads": {leads_json}, "nextCursor": {json.dumps(next_cursor)}}}'
+            else:
+                leads, next_cursor = pool.run(lambda conn: fetch_leads(conn, limit, cursor, filters))
+                rows = len(leads)
+                with span('serialize'):
+                    body = json.dumps({'leads': leads, 'nextCursor': next_cursor})
+            encoded = {}
+            _response_cache[cache_key] = (version, body, encoded)
+            _response_cache.move_to_end(cache_key)
+            while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+            annotate(result=view, cache='miss', rows=rows, json_in_db=JSON_IN_DB, version=version, db_pool=pool.stats())
+        
+        return compress_response({
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'ETag': etag,
+                'Cache-Control': 'no-cache',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag'
+            },
+            'body': body,
+            'isBase64Encoded': False
+        }, encoding, encoded)
     except Exception as e:
         print(f'ERROR in get-leads: {str(e)}')
         import traceback
@@ -114,4 +383,254 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             },
             'body': json.dumps({'error': 'Failed to fetch leads', 'details': str(e)}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+
+def build_page_query(limit: int, cursor: Optional[Tuple[int, str]],
+                     filters: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    '''
+    Keyset-пагинация по (timestamp, id): страница после курсора читается
+    диапазоном по индексу на timestamp, без OFFSET и без чтения всей таблицы.
+    Фильтры уходят в WHERE и обслуживаются составными индексами из V0004.
+    Запрашивается limit + 1 строка, чтобы понять, есть ли следующая страница
+    '''
+    where, query_params = build_where(filters, cursor)
+    query_params['limit'] = limit + 1
+    query = f'''
+        {LEAD_SELECT}
+        {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT %(limit)s
+    '''
+    return query, query_params
+
+
+def fetch_leads(conn: Any, limit: int, cursor: Optional[Tuple[int, str]],
+                filters: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    '''
+    Returns: лиды страницы и курсор следующей страницы (None, если она последняя)
+    '''
+    query, query_params = build_page_query(limit, cursor, filters)
+    
+    with conn.cursor() as cur:
+        cur.execute(query, query_params)
+        
+        rows = cur.fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        leads = [row_to_lead(row) for row in rows]
+    conn.rollback()
+    return leads, next_cursor
+
+
+def fetch_leads_json(conn: Any, limit: int, cursor: Optional[Tuple[int, str]],
+                     filters: Dict[str, Any]) -> Tuple[str, int, Optional[str]]:
+    '''
+    Та же страница, что у fetch_leads, но массив лидов собирает json_agg
+    в Postgres: в Python приходит одна строка JSON без разбора по полям.
+    Лишняя (limit + 1) строка только сообщает о следующей странице
+    Returns: JSON-массив лидов текстом, число лидов в нём и курсор следующей страницы
+    '''
+    query, query_params = build_page_query(limit, cursor, filters)
+    query_params['page_size'] = limit
+    
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            WITH page AS ({query}),
+            numbered AS (
+                SELECT page.*, row_number() OVER (ORDER BY timestamp DESC, id DESC) AS n
+                FROM page
+            )
+            SELECT
+                COALESCE(json_agg({LEAD_JSON} ORDER BY n) FILTER (WHERE n <= %(page_size)s), '[]')::text,
+                COUNT(*) FILTER (WHERE n <= %(page_size)s),
+                COUNT(*) > %(page_size)s,
+                MAX(timestamp) FILTER (WHERE n = %(page_size)s),
+                MAX(id) FILTER (WHERE n = %(page_size)s)
+            FROM numbered
+        ''', query_params)
+        leads_json, rows, has_more, last_timestamp, last_id = cur.fetchone()
+    conn.rollback()
+    next_cursor = encode_cursor(last_timestamp, last_id) if has_more else None
+    return leads_json, rows, next_cursor
+
+
+def row_to_lead(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'timestamp': row[1],
+        'date': row[2],
+        'name': row[3],
+        'contact': row[4],
+        'niche': row[5],
+        'goal': row[6],
+        'utmSource': row[7] or '',
+        'utmMedium': row[8] or '',
+        'utmCampaign': row[9] or '',
+        'utmContent': row[10] or '',
+        'utmTerm': row[11] or '',
+        'pageDepth': row[12],
+        'timeOnPage': row[13],
+        'device': row[14],
+        'referrer': row[15] or ''
+    }
+
+
+def export_leads(conn: Any, export_format: str, filters: Dict[str, Any], out: TextIO,
+                 json_in_db: Optional[bool] = None) -> int:
+    '''
+    Выгрузка всех подходящих лидов через серверный (именованный) курсор:
+    строки приходят пачками по EXPORT_BATCH_SIZE и сразу сериализуются в out,
+    так что в памяти одновременно держится не больше одной пачки строк.
+    NDJSON при json_in_db (по умолчанию JSON_IN_DB) приходит из Postgres
+    готовыми строками JSON
+    Returns: количество выгруженных лидов
+    '''
+    where, query_params = build_where(filters, None)
+    select = LEAD_SELECT
+    if export_format == 'csv':
+        write_batch = write_csv_batch
+        csv.writer(out).writerow(LEAD_FIELDS)
+    elif JSON_IN_DB if json_in_db is None else json_in_db:
+        write_batch = write_json_batch
+        select = f'SELECT {LEAD_JSON}::text FROM leads'
+    else:
+        write_batch = write_ndjson_batch
+    
+    exported = 0
+    with conn.cursor(name='leads_export') as cur:
+        cur.execute(f'''
+            {select}
+            {where}
+            ORDER BY timestamp DESC, id DESC
+        ''', query_params)
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            write_batch(rows, out.write)
+            exported += len(rows)
+    conn.rollback()
+    return exported
+
+
+def write_ndjson_batch(rows: List[Tuple[Any, ...]], write: Callable[[str], Any]) -> None:
+    write(''.join(json.dumps(row_to_lead(row), ensure_ascii=False) + '\n' for row in rows))
+
+
+def write_json_batch(rows: List[Tuple[str]], write: Callable[[str], Any]) -> None:
+    write(''.join(row[0] + '\n' for row in rows))
+
+
+def write_csv_batch(rows: List[Tuple[Any, ...]], write: Callable[[str], Any]) -> None:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        lead = row_to_lead(row)
+        writer.writerow([lead[field] for field in LEAD_FIELDS])
+    write(buffer.getvalue())
+
+
+def rollup_day_range(filters: Dict[str, Any]) -> Optional[Tuple[Optional[date], Optional[date]]]:
+    '''
+    Роллап хранит целые дни по Москве, поэтому он годится, только если
+    фильтр не трогает niche, а границы dateFrom/dateTo попадают на полночь
+    Returns: (первый день, последний день) или None, если нужен запрос по leads
+    '''
+    if any(name not in ROLLUP_FILTERS + ('dateFrom', 'dateTo') for name in filters):
+        return None
+    
+    day_from = day_to = None
+    if 'dateFrom' in filters:
+        start = datetime.fromtimestamp(filters['dateFrom'] / 1000, STATS_ZONE)
+        if start.timetz().replace(tzinfo=None) != time(0):
+            return None
+        day_from = start.date()
+    if 'dateTo' in filters:
+        end = datetime.fromtimestamp((filters['dateTo'] + 1) / 1000, STATS_ZONE)
+        if end.timetz().replace(tzinfo=None) != time(0):
+            return None
+        day_to = end.date() - timedelta(days=1)
+    return day_from, day_to
+
+
+def fetch_stats(conn: Any, group_by: List[str], filters: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Агрегаты считаются в Postgres одним GROUP BY GROUPING SETS:
+    строки по выбранным измерениям плюс общий итог. Если фильтры это
+    позволяют, запрос идёт по дневному роллапу lead_daily_stats (V0006)
+    и стоит O(дней), иначе - по самой таблице leads
+    Returns: {'groupBy': [...], 'groups': [...], 'total': {...}, 'source': ...}
+    '''
+    day_range = rollup_day_range(filters)
+    if day_range is None:
+        source = 'leads'
+        where, query_params = build_where(filters, None)
+        expressions = [STATS_DIMENSIONS[name][1] for name in group_by]
+        # NULL считается нулём, как в роллапе (SUM(COALESCE(...)) / count):
+        # ответ не должен зависеть от того, какой путь его посчитал
+        metrics = '''
+            COUNT(*),
+            ROUND(AVG(COALESCE(page_depth, 0))::numeric, 1),
+            ROUND(AVG(COALESCE(time_on_page, 0))::numeric, 1)
+        '''
+    else:
+        source = 'rollup'
+        clauses: List[str] = []
+        query_params = {}
+        if day_range[0]:
+            clauses.append('day >= %(day_from)s')
+            query_params['day_from'] = day_range[0]
+        if day_range[1]:
+            clauses.append('day <= %(day_to)s')
+            query_params['day_to'] = day_range[1]
+        for name in ROLLUP_FILTERS:
+            if name in filters:
+                clauses.append(f'{name} = %({name})s')
+                query_params[name] = filters[name]
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+        expressions = [STATS_DIMENSIONS[name][2] for name in group_by]
+        metrics = '''
+            COALESCE(SUM(leads_count), 0),
+            ROUND(SUM(page_depth_sum)::numeric / NULLIF(SUM(leads_count), 0), 1),
+            ROUND(SUM(time_on_page_sum)::numeric / NULLIF(SUM(leads_count), 0), 1)
+        '''
+    
+    select_dimensions = ''.join(f'{expression}, ' for expression in expressions)
+    positions = ', '.join(str(i) for i in range(1, len(expressions) + 1))
+    grouping = f"GROUP BY GROUPING SETS (({', '.join(expressions)}), ())" if expressions else ''
+    is_total = f"GROUPING({', '.join(expressions)}) <> 0" if expressions else 'TRUE'
+    
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT
+                {select_dimensions}
+                {is_total} AS is_total,
+                {metrics}
+            FROM {'lead_daily_stats' if source == 'rollup' else 'leads'}
+            {where}
+            {grouping}
+            ORDER BY {positions + ', ' if positions else ''}is_total
+        ''', query_params)
+        rows = cur.fetchall()
+    conn.rollback()
+    
+    groups: List[Dict[str, Any]] = []
+    total = {'leads': 0, 'avgPageDepth': 0.0, 'avgTimeOnPage': 0.0}
+    for row in rows:
+        dimensions, (row_is_total, count, avg_depth, avg_time) = row[:len(group_by)], row[len(group_by):]
+        metrics_row = {
+            'leads': int(count),
+            'avgPageDepth': float(avg_depth or 0),
+            'avgTimeOnPage': float(avg_time or 0)
+        }
+        if row_is_total:
+            total = metrics_row
+        else:
+            group = {STATS_DIMENSIONS[name][0]: value for name, value in zip(group_by, dimensions)}
+            group.update(metrics_row)
+            groups.append(group)
+    
+    return {'groupBy': group_by, 'groups': groups, 'total': total, 'source': source}
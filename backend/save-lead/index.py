@@ -1,31 +1,71 @@
 import json
-import os
-import psycopg2
-from typing import Dict, Any
-from pydantic import BaseModel, Field, ValidationError
-
-class LeadData(BaseModel):
-    id: str = Field(..., min_length=1)
-    timestamp: int = Field(..., gt=0)
-    date: str = Field(..., min_length=1)
-    name: str = Field(..., min_length=1)
-    contact: str = Field(..., min_length=1)
-    niche: str = ''
-    goal: str = ''
-    utm_source: str = ''
-    utm_medium: str = ''
-    utm_campaign: str = ''
-    utm_content: str = ''
-    utm_term: str = ''
-    page_depth: int = Field(default=0, ge=0, le=100)
-    time_on_page: int = Field(default=0, ge=0)
-    device: str = Field(default='desktop', pattern='^(mobile|desktop)$')
-    referrer: str = ''
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 
+from tracing import annotate, span, traced
+
+# pydantic и psycopg2 импортируются внутри путей, которые пишут лид:
+# preflight OPTIONS и 405 на холодном старте обходятся без них
+_lead_model: Any = None
+
+
+def get_lead_model() -> Any:
+    '''
+    Модель LeadData: строится один раз на контейнер, pydantic компилирует
+    валидатор при создании класса, дальше вызовы только используют его
+    '''
+    global _lead_model
+    if _lead_model is None:
+        from pydantic import BaseModel, Field
+        
+        class LeadData(BaseModel):
+            id: str = Field(..., min_length=1)
+            timestamp: int = Field(..., gt=0)
+            date: str = Field(..., min_length=1)
+            name: str = Field(..., min_length=1)
+            contact: str = Field(..., min_length=1)
+            niche: str = ''
+            goal: str = ''
+            utm_source: str = ''
+            utm_medium: str = ''
+            utm_campaign: str = ''
+            utm_content: str = ''
+            utm_term: str = ''
+            page_depth: int = Field(default=0, ge=0, le=100)
+            time_on_page: int = Field(default=0, ge=0)
+            device: str = Field(default='desktop', pattern='^(mobile|desktop)$')
+            referrer: str = ''
+        
+        _lead_model = LeadData
+    return _lead_model
+
+DUPLICATE_WINDOW_MS = 60000
+MAX_BATCH_SIZE = 1000
+
+# Недавно принятые лиды тёплого контейнера: повторы запроса при плохой сети
+# и двойной клик отвечаются дублем без обращения к БД
+RECENT_LEADS_SIZE = 4096
+RECENT_LEADS_TTL = 300
+
+_recent_lock = threading.Lock()
+# id лида -> когда запомнен (time.monotonic)
+_recent_ids: 'OrderedDict[str, float]' = OrderedDict()
+# контакт -> (наибольший timestamp принятого с него лида, когда запомнен)
+_recent_contacts: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()
+
+LEAD_COLUMNS = (
+    'id', 'timestamp', 'date', 'name', 'contact', 'niche', 'goal',
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_content', 'utm_term',
+    'page_depth', 'time_on_page', 'device', 'referrer'
+)
+
+@traced('save-lead')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Сохранение лида в базу данных PostgreSQL
-    Args: event - dict с httpMethod, body
+    Args: event - dict с httpMethod, body (один лид или массив лидов)
           context - объект с request_id и другими атрибутами
     Returns: HTTP response dict
     '''
@@ -55,55 +95,246 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    body_data = json.loads(event.get('body', '{}'))
-    lead = LeadData(**body_data)
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    
-    try:
-        with conn.cursor() as cur:
-            cur.execute('''
-                SELECT id FROM leads 
-                WHERE contact = %s 
-                AND timestamp > %s
-                LIMIT 1
-            ''', (lead.contact, lead.timestamp - 60000))
-            
-            if cur.fetchone():
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'success': True, 'duplicate': True, 'id': lead.id}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute('''
-                INSERT INTO leads (
-                    id, timestamp, date, name, contact, niche, goal,
-                    utm_source, utm_medium, utm_campaign, utm_content, utm_term,
-                    page_depth, time_on_page, device, referrer
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO NOTHING
-            ''', (
-                lead.id, lead.timestamp, lead.date, lead.name, lead.contact,
-                lead.niche, lead.goal, lead.utm_source, lead.utm_medium,
-                lead.utm_campaign, lead.utm_content, lead.utm_term,
-                lead.page_depth, lead.time_on_page, lead.device, lead.referrer
-            ))
-        conn.commit()
-        
+    with span('validate'):
+        body_data = json.loads(event.get('body', '{}'))
+    
+    if isinstance(body_data, list):
+        return save_batch(body_data)
+    
+    lead_model = get_lead_model()
+    with span('validate'):
+        lead = lead_model.model_validate(body_data)
+    
+    if is_recent_duplicate(lead):
+        duplicate = True
+        annotate(leads=1, duplicate=True, recent='hit')
+    else:
+        from db_pool import get_pool
+        pool = get_pool()
+        duplicate = pool.run(lambda conn: insert_leads(conn, [lead], notify=True))[0]
+        remember_lead(lead, inserted=not duplicate)
+        annotate(leads=1, duplicate=duplicate, recent='miss', db_pool=pool.stats())
+    
+    if duplicate:
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'success': True, 'id': lead.id}),
+            'body': json.dumps({'success': True, 'duplicate': True, 'id': lead.id}),
             'isBase64Encoded': False
         }
-    finally:
-        conn.close()
\ No newline at end of file
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({'success': True, 'id': lead.id}),
+        'isBase64Encoded': False
+    }
+
+
+def expire_recent(now: float) -> None:
+    '''
+    Снимает с головы LRU записи старше RECENT_LEADS_TTL и лишние сверх
+    RECENT_LEADS_SIZE. Вызывается под _recent_lock
+    '''
+    expired = now - RECENT_LEADS_TTL
+    while _recent_ids and (len(_recent_ids) > RECENT_LEADS_SIZE or next(iter(_recent_ids.values())) <= expired):
+        _recent_ids.popitem(last=False)
+    while _recent_contacts and (len(_recent_contacts) > RECENT_LEADS_SIZE
+                                or next(iter(_recent_contacts.values()))[1] <= expired):
+        _recent_contacts.popitem(last=False)
+
+
+def is_recent_duplicate(lead: Any) -> bool:
+    '''
+    Очевидный дубль без БД: этот id уже принимался, или с того же контакта
+    недавно принят лид в пределах DUPLICATE_WINDOW_MS. Условие то же, что
+    в insert_leads, а лиды из таблицы не удаляются, так что БД ответила бы
+    так же. Промах ничего не решает: лид идёт в insert_leads как обычно
+    '''
+    now = time.monotonic()
+    with _recent_lock:
+        expire_recent(now)
+        if lead.id in _recent_ids:
+            _recent_ids[lead.id] = now
+            _recent_ids.move_to_end(lead.id)
+            return True
+        recent = _recent_contacts.get(lead.contact)
+        if recent is not None and recent[0] > lead.timestamp - DUPLICATE_WINDOW_MS:
+            _recent_contacts[lead.contact] = (recent[0], now)
+            _recent_contacts.move_to_end(lead.contact)
+            return True
+    return False
+
+
+def remember_lead(lead: Any, inserted: bool) -> None:
+    '''
+    Запоминает ответ БД. id запоминается и для дубля: повтор того же лида
+    БД снова признает дублем. Контакт - только для вставленного лида,
+    у дубля по контакту timestamp записанного лида неизвестен
+    '''
+    now = time.monotonic()
+    with _recent_lock:
+        _recent_ids[lead.id] = now
+        _recent_ids.move_to_end(lead.id)
+        if inserted:
+            recent = _recent_contacts.get(lead.contact)
+            timestamp = max(recent[0], lead.timestamp) if recent else lead.timestamp
+            _recent_contacts[lead.contact] = (timestamp, now)
+            _recent_contacts.move_to_end(lead.contact)
+        expire_recent(now)
+
+
+def save_batch(items: List[Any]) -> Dict[str, Any]:
+    '''
+    Пакетное сохранение: валидация за один проход, одна транзакция
+    и один многострочный INSERT на весь массив
+    Returns: HTTP response с результатом по каждому элементу
+    '''
+    if len(items) > MAX_BATCH_SIZE:
+        return {
+            'statusCode': 413,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': f'Batch too large, max {MAX_BATCH_SIZE} leads'}),
+            'isBase64Encoded': False
+        }
+    
+    from pydantic import ValidationError
+    
+    lead_model = get_lead_model()
+    results: List[Dict[str, Any]] = []
+    valid: List[Tuple[int, Any]] = []
+    
+    with span('validate'):
+        for index, item in enumerate(items):
+            try:
+                lead = lead_model.model_validate(item)
+            except ValidationError as e:
+                results.append({
+                    'index': index,
+                    'id': item.get('id') if isinstance(item, dict) else None,
+                    'status': 'invalid',
+                    'errors': [
+                        {'field': '.'.join(str(part) for part in err['loc']), 'message': err['msg']}
+                        for err in e.errors()
+                    ]
+                })
+                continue
+            results.append({'index': index, 'id': lead.id, 'status': 'inserted'})
+            valid.append((index, lead))
+    
+    if valid:
+        from db_pool import get_pool
+        pool = get_pool()
+        duplicates = pool.run(lambda conn: insert_leads(conn, [lead for _, lead in valid]))
+        annotate(db_pool=pool.stats())
+        for (index, lead), duplicate in zip(valid, duplicates):
+            if duplicate:
+                results[index]['status'] = 'duplicate'
+    
+    summary = {'inserted': 0, 'duplicate': 0, 'invalid': 0}
+    for result in results:
+        summary[result['status']] += 1
+    annotate(leads=len(items), summary=summary)
+    
+    with span('serialize'):
+        body = json.dumps({'success': True, 'summary': summary, 'results': results})
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def insert_leads(conn: Any, leads: List[Any], notify: bool = False) -> List[bool]:
+    '''
+    Вставляет лиды с 60-секундной защитой от дублей по контакту за один
+    запрос к БД: advisory-блокировки по контактам и INSERT ... WHERE NOT EXISTS
+    уходят одной пачкой. Блокировки сериализуют параллельные заявки с одного
+    контакта, а INSERT берёт свежий снимок уже после них, поэтому гонки нет.
+    Дубли внутри самой пачки отсекаются до обращения к БД.
+    leads секционирована по месяцам (V0009): нижняя граница по timestamp
+    подставлена константой, поэтому проверка дублей читает только секции
+    последней минуты, а не все месяцы. Уникальность id держит триггер
+    из V0011: лид с уже занятым id пропускается и отвечается дублем.
+    С notify=True вставленные лиды тем же запросом ставятся в outbox
+    lead_notifications, откуда их отправляет в Telegram диспетчер telegram-lead.
+    Пакетный импорт (save_batch) уведомлений не создаёт.
+    Returns: для каждого лида True, если он оказался дублем
+    '''
+    duplicates = [False] * len(leads)
+    
+    seen_ids = set()
+    latest: Dict[str, int] = {}
+    order = sorted(range(len(leads)), key=lambda i: (leads[i].contact, leads[i].timestamp))
+    for i in order:
+        lead = leads[i]
+        previous: Optional[int] = latest.get(lead.contact)
+        if lead.id in seen_ids or (previous is not None and previous > lead.timestamp - DUPLICATE_WINDOW_MS):
+            duplicates[i] = True
+            continue
+        seen_ids.add(lead.id)
+        latest[lead.contact] = lead.timestamp
+    
+    rows = [
+        tuple(getattr(lead, column) for column in LEAD_COLUMNS)
+        for lead, duplicate in zip(leads, duplicates) if not duplicate
+    ]
+    if not rows:
+        return duplicates
+    
+    from psycopg2.extras import execute_values
+    
+    oldest = min(row[LEAD_COLUMNS.index('timestamp')] for row in rows) - DUPLICATE_WINDOW_MS
+    with conn.cursor() as cur:
+        lock_sql = cur.mogrify('''
+            SELECT pg_advisory_xact_lock(hashtextextended(contact, 0))
+            FROM (SELECT DISTINCT unnest(%s::text[]) AS contact ORDER BY 1) AS contacts
+        ''', (sorted(latest),)).decode('utf-8').replace('%', '%%')
+        columns = ', '.join(LEAD_COLUMNS)
+        inserted = execute_values(
+            cur,
+            f'''
+                {lock_sql};
+                WITH inserted AS (
+                    INSERT INTO leads ({columns})
+                    SELECT {columns} FROM (VALUES %s) AS new_leads ({columns})
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM leads
+                        WHERE leads.contact = new_leads.contact
+                        AND leads.timestamp > new_leads.timestamp - {DUPLICATE_WINDOW_MS}
+                        AND leads.timestamp > {oldest}
+                    )
+                    ON CONFLICT (id, timestamp) DO NOTHING
+                    RETURNING {columns}
+                ), queued AS (
+                    INSERT INTO lead_notifications (lead_id, payload)
+                    SELECT id, to_jsonb(inserted) FROM inserted
+                    WHERE {'TRUE' if notify else 'FALSE'}
+                )
+                SELECT id FROM inserted
+            ''',
+            rows,
+            page_size=len(rows),
+            fetch=True
+        )
+    conn.commit()
+    
+    inserted_ids = {row[0] for row in inserted}
+    for i, lead in enumerate(leads):
+        if not duplicates[i] and lead.id not in inserted_ids:
+            duplicates[i] = True
+    return duplicates
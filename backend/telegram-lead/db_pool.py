@@ -0,0 +1,194 @@
+'''
+Пул соединений с PostgreSQL, общий для тёплых вызовов функции
+Копия живёт в каждой функции, которой нужна БД: save-lead, get-leads, ga4-weekly-report, telegram-lead
+'''
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple, TypeVar
+
+import psycopg2
+import psycopg2.extensions
+
+from tracing import span
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '5'))
+HEALTHCHECK_AFTER_IDLE = float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30'))
+
+T = TypeVar('T')
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+# Остановка сервера и отказ в подключении: вместе с классом 08
+# (connection exception) это SQLSTATE, после которых соединение не годится
+DISCONNECT_SQLSTATES = ('57P01', '57P02', '57P03')
+
+
+def is_disconnect(conn: Any, error: Exception) -> bool:
+    '''
+    Оборвалось ли соединение. DeadlockDetected, QueryCanceled,
+    LockNotAvailable - тоже OperationalError, но соединение после них
+    живое: после отката его можно вернуть в пул
+    '''
+    if conn.closed or isinstance(error, psycopg2.InterfaceError):
+        return True
+    pgcode = getattr(error, 'pgcode', None)
+    return pgcode is None or pgcode.startswith('08') or pgcode in DISCONNECT_SQLSTATES
+
+
+class ConnectionPool:
+    '''
+    Ограниченный пул: не больше max_size открытых соединений.
+    Соединение, простоявшее дольше healthcheck_after секунд, проверяется
+    через SELECT 1 и переоткрывается, если сервер его уже закрыл.
+    '''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE,
+                 acquire_timeout: float = POOL_ACQUIRE_TIMEOUT,
+                 healthcheck_after: float = HEALTHCHECK_AFTER_IDLE):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.healthcheck_after = healthcheck_after
+        self._idle: List[Tuple[Any, float]] = []
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'reused': 0, 'reconnected': 0, 'discarded': 0}
+
+    def _open(self) -> Any:
+        with span('connect'):
+            conn = psycopg2.connect(self.dsn)
+        with self._lock:
+            self._stats['opened'] += 1
+        return conn
+
+    def _is_alive(self, conn: Any) -> bool:
+        if conn.closed:
+            return False
+        try:
+            with span('connect'), conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _discard(self, conn: Any) -> None:
+        with self._lock:
+            self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self, fresh: bool = False) -> Any:
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise PoolExhausted(f'No free DB connection in {self.acquire_timeout}s (max {self.max_size})')
+        try:
+            with self._lock:
+                idle = self._idle.pop() if self._idle and not fresh else None
+            if idle is None:
+                return self._open()
+
+            conn, released_at = idle
+            stale = time.monotonic() - released_at > self.healthcheck_after
+            if conn.closed or (stale and not self._is_alive(conn)):
+                self._discard(conn)
+                with self._lock:
+                    self._stats['reconnected'] += 1
+                return self._open()
+
+            with self._lock:
+                self._stats['reused'] += 1
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn: Any, broken: bool = False) -> None:
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+                return
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    self._discard(conn)
+                    return
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, fresh: bool = False) -> Iterator[Any]:
+        conn = self.getconn(fresh=fresh)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            broken = is_disconnect(conn, e)
+            raise
+        finally:
+            self.putconn(conn, broken=broken or conn.closed != 0)
+
+    def run(self, work: Callable[[Any], T], retry: bool = True) -> T:
+        '''
+        Выполняет work(conn); если соединение оборвалось на полпути,
+        один раз повторяет на заново открытом соединении. Ошибки самого
+        запроса (дедлок, отмена, lock_timeout) не повторяются.
+        retry=False - для работы, которую нельзя выполнить дважды
+        (отправка уведомлений, выгрузка в уже начатый ответ)
+        '''
+        conn = None
+        try:
+            with self.connection() as conn, span('query'):
+                return work(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            if not retry or (conn is not None and not is_disconnect(conn, e)):
+                raise
+            with self._lock:
+                self._stats['reconnected'] += 1
+            with self.connection(fresh=True) as conn, span('query'):
+                return work(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            result = dict(self._stats)
+            result['idle'] = len(self._idle)
+        result['max_size'] = self.max_size
+        return result
+
+    def closeall(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(dsn: Optional[str] = None) -> ConnectionPool:
+    '''
+    Пул создаётся один раз на контейнер и переживает тёплые вызовы
+    '''
+    global _pool
+    dsn = dsn or os.environ.get('DATABASE_URL')
+    with _pool_lock:
+        if _pool is None or _pool.dsn != dsn:
+            if _pool is not None:
+                _pool.closeall()
+            _pool = ConnectionPool(dsn)
+        return _pool
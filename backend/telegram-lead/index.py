@@ -1,17 +1,82 @@
 import json
 import os
-import urllib.request
-import urllib.parse
-from typing import Dict, Any
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Any, List, Optional
 
+from tracing import annotate, traced
+
+# Ключ pg_try_advisory_lock: одновременно работает только один диспетчер,
+# поэтому лимит Telegram соблюдается одним token bucket на процесс
+DISPATCH_LOCK_KEY = 0x7e1e1ead
+DISPATCH_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+# Сколько секунд диспетчер может работать за один запуск по расписанию
+DISPATCH_TIME_BUDGET = float(os.environ.get('OUTBOX_TIME_BUDGET', '25'))
+# Заявки, пришедшие в пределах окна, склеиваются в одно сообщение
+COALESCE_WINDOW = timedelta(seconds=int(os.environ.get('OUTBOX_COALESCE_WINDOW', '60')))
+MAX_LEADS_PER_MESSAGE = 10
+TELEGRAM_MESSAGE_LIMIT = 4096
+MAX_ATTEMPTS = 8
+MAX_RETRY_DELAY = 3600
+
+# Telegram держит около одного сообщения в секунду на чат
+TELEGRAM_RATE = float(os.environ.get('TELEGRAM_RATE_PER_SEC', '1'))
+TELEGRAM_BURST = int(os.environ.get('TELEGRAM_BURST', '3'))
+
+# pg_cron нет: секции leads вперёд (V0009) создаёт и журнал leads_changes
+# (V0010) сжимает этот же запуск по расписанию, не чаще раза в интервал на контейнер
+PARTITION_CHECK_INTERVAL = int(os.environ.get('LEADS_PARTITION_CHECK_INTERVAL', '21600'))
+LEADS_PARTITIONS_AHEAD = 3
+_partitions_checked_at: Optional[float] = None
+
+
+class TokenBucket:
+    '''
+    Не больше rate сообщений в секунду в среднем и burst подряд
+    '''
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, deadline: float) -> bool:
+        '''
+        Ждёт токен не дольше deadline (time.monotonic); False, если не дождались
+        '''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+# Переживает тёплые вызовы контейнера
+_bucket = TokenBucket(TELEGRAM_RATE, TELEGRAM_BURST)
+
+
+@traced('telegram-lead')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Отправка уведомлений о новых лидах в Telegram
+    Диспетчер уведомлений о новых лидах в Telegram
+    Запускается по расписанию (schedule.json) или POST {"action": "dispatch"}
+    и отправляет накопившееся в outbox lead_notifications, куда лиды ставит save-lead
     '''
+    is_scheduled = event.get('messages') is not None or event.get('trigger') is not None
     method: str = event.get('httpMethod', 'POST')
     
     # CORS OPTIONS
-    if method == 'OPTIONS':
+    if method == 'OPTIONS' and not is_scheduled:
         return {
             'statusCode': 200,
             'headers': {
@@ -24,7 +89,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    if method != 'POST':
+    if method != 'POST' and not is_scheduled:
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -33,10 +98,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        # Получаем данные
-        body_data = json.loads(event.get('body', '{}'))
+        body_data = {} if is_scheduled else json.loads(event.get('body') or '{}')
+        
+        # Старые клиенты присылают сюда сам лид: он уже поставлен в outbox
+        # через save-lead, поэтому повторно ничего не отправляем
+        if not is_scheduled and body_data.get('action') != 'dispatch':
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'message': 'Notification is queued by save-lead'}),
+                'isBase64Encoded': False
+            }
         
-        # Отправляем в Telegram
         bot_token = os.environ.get('TELEGRAM_BOT_TOKEN', '').strip()
         chat_id = os.environ.get('TELEGRAM_CHAT_ID', '').strip()
         
@@ -54,56 +127,249 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
-        # Формируем сообщение
-        message = f"""🎯 Новая заявка с сайта!
-
-👤 Имя: {body_data.get('name', 'Не указано')}
-📱 Контакт: {body_data.get('contact', 'Не указан')}
-🎨 Ниша: {body_data.get('niche', 'Не указана')}
-🎯 Цель: {body_data.get('goal', 'Не указана')}
-
-📊 Аналитика:
-• Скролл: {body_data.get('pageDepth', 0)}%
-• Время: {body_data.get('timeOnPage', 0)} сек
-• Устройство: {body_data.get('device', 'Неизвестно')}
-
-🔗 UTM-метки:
-• Source: {body_data.get('utmSource', '-')}
-• Medium: {body_data.get('utmMedium', '-')}
-• Campaign: {body_data.get('utmCampaign', '-')}
-• Content: {body_data.get('utmContent', '-')}
-• Term: {body_data.get('utmTerm', '-')}
-
-📍 Реферер: {body_data.get('referrer', 'Прямой переход')}
-"""
-        
-        url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-        payload = {
-            'chat_id': chat_id,
-            'text': message
-        }
-        
-        data = json.dumps(payload).encode('utf-8')
-        req = urllib.request.Request(url, data=data, method='POST')
-        req.add_header('Content-Type', 'application/json')
+        # БД и клиент Telegram нужны только диспетчеру, не preflight
+        from db_pool import get_pool
+        from telegram_client import get_client
         
-        with urllib.request.urlopen(req, timeout=10) as response:
-            response_data = json.loads(response.read().decode('utf-8'))
-            
-            if not response_data.get('ok'):
-                raise Exception(f"Telegram API error: {response_data.get('description', 'Unknown error')}")
+        pool = get_pool()
+        stats = pool.run(lambda conn: dispatch(conn, bot_token, chat_id), retry=False)
+        if is_scheduled:
+            maintain_leads(pool)
+        annotate(outbox=stats, db_pool=pool.stats(), telegram=get_client().stats())
         
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'success': True, 'message': 'Notification sent'}),
+            'body': json.dumps({'success': True, 'stats': stats}),
             'isBase64Encoded': False
         }
-        
+    
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+
+def dispatch(conn: Any, bot_token: str, chat_id: str) -> Dict[str, Any]:
+    '''
+    Выбирает ожидающие уведомления пачками, склеивает близкие по времени
+    и отправляет с учётом token bucket. Каждое сообщение фиксируется отдельной
+    транзакцией, так что сбой посреди пачки не приводит к повторной отправке
+    уже доставленного. На 429 вся очередь откладывается на retry_after.
+    Если доставка неизвестна (обрыв после отправки), уведомления получают
+    конечный статус unknown и повторно не отправляются.
+    '''
+    stats = {'messages': 0, 'leads': 0, 'errors': 0, 'unknown': 0, 'rate_limited': False, 'skipped': False}
+    
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_try_advisory_lock(%s)', (DISPATCH_LOCK_KEY,))
+        locked = cur.fetchone()[0]
+    conn.commit()
+    if not locked:
+        stats['skipped'] = True
+        return stats
+    
+    from telegram_client import TelegramDeliveryUnknown, TelegramRateLimited, get_client
+    
+    client = get_client()
+    deadline = time.monotonic() + DISPATCH_TIME_BUDGET
+    try:
+        while time.monotonic() < deadline:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    SELECT id, payload, created_at FROM lead_notifications
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY id
+                    LIMIT %s
+                ''', (DISPATCH_BATCH_SIZE,))
+                rows = cur.fetchall()
+            conn.commit()
+            if not rows:
+                break
+            
+            for group in group_notifications(rows):
+                if not _bucket.acquire(deadline):
+                    return stats
+                
+                ids = [row[0] for row in group]
+                try:
+                    client.send_message(bot_token, chat_id, format_message([row[1] for row in group]))
+                except TelegramRateLimited as e:
+                    postpone_pending(conn, e.retry_after)
+                    stats['rate_limited'] = True
+                    return stats
+                except TelegramDeliveryUnknown as e:
+                    mark_delivery_unknown(conn, ids, str(e))
+                    stats['unknown'] += 1
+                    continue
+                except Exception as e:
+                    mark_failed_attempt(conn, ids, str(e))
+                    stats['errors'] += 1
+                    continue
+                
+                with conn.cursor() as cur:
+                    cur.execute('''
+                        UPDATE lead_notifications
+                        SET status = 'sent', sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                        WHERE id = ANY(%s)
+                    ''', (ids,))
+                conn.commit()
+                stats['messages'] += 1
+                stats['leads'] += len(ids)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_unlock(%s)', (DISPATCH_LOCK_KEY,))
+        conn.commit()
+    
+    return stats
+
+
+def maintain_leads(pool: Any) -> None:
+    '''
+    Раз в PARTITION_CHECK_INTERVAL сжимает журнал версий и досоздаёт секции
+    leads. Сбой не мешает рассылке: до следующей проверки журнал просто
+    подрастёт, а новые лиды лягут в leads_default
+    '''
+    global _partitions_checked_at
+    now = time.monotonic()
+    if _partitions_checked_at is not None and now - _partitions_checked_at < PARTITION_CHECK_INTERVAL:
+        return
+    try:
+        annotate(changes_compacted=pool.run(compact_changes))
+        created = pool.run(ensure_partitions)
+    except Exception as e:
+        print(f"Leads partition check failed: {type(e).__name__}: {e}")
+        return
+    if created is not None:
+        _partitions_checked_at = now
+        annotate(partitions_created=created)
+
+
+def compact_changes(conn: Any) -> int:
+    with conn.cursor() as cur:
+        cur.execute('SELECT compact_leads_changes()')
+        removed = cur.fetchone()[0]
+    conn.commit()
+    return removed
+
+
+def ensure_partitions(conn: Any) -> Optional[int]:
+    '''
+    ensure_leads_partitions() с коротким lock_timeout: создание секции
+    ненадолго блокирует leads_default, и ждать за долгим запросом
+    выгрузки незачем, проще повторить на следующем запуске
+    Returns: сколько секций создано или None, если блокировку не дождались
+    '''
+    from psycopg2 import errors
+    
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL lock_timeout = '2s'")
+            cur.execute('SELECT ensure_leads_partitions(%s)', (LEADS_PARTITIONS_AHEAD,))
+            created = cur.fetchone()[0]
+        conn.commit()
+    except errors.LockNotAvailable:
+        conn.rollback()
+        return None
+    return created
+
+
+def group_notifications(rows: List[Any]) -> List[List[Any]]:
+    '''
+    Соседние по очереди уведомления, созданные в пределах COALESCE_WINDOW
+    от первого в группе, уходят одним сообщением
+    '''
+    groups: List[List[Any]] = []
+    for row in rows:
+        group = groups[-1] if groups else None
+        if (
+            group is not None
+            and len(group) < MAX_LEADS_PER_MESSAGE
+            and row[2] - group[0][2] <= COALESCE_WINDOW
+            and len(format_message([item[1] for item in group + [row]])) <= TELEGRAM_MESSAGE_LIMIT
+        ):
+            group.append(row)
+        else:
+            groups.append([row])
+    return groups
+
+
+def format_message(leads: List[Dict[str, Any]]) -> str:
+    if len(leads) == 1:
+        return format_lead(leads[0])
+    
+    blocks = [f'🎯 Новые заявки с сайта: {len(leads)}']
+    for i, lead in enumerate(leads, 1):
+        blocks.append(
+            f"{i}. 👤 {lead.get('name') or 'Не указано'} — 📱 {lead.get('contact') or 'Не указан'}\n"
+            f"🎨 {lead.get('niche') or 'Не указана'} · 🎯 {lead.get('goal') or 'Не указана'}\n"
+            f"🔗 {lead.get('utm_source') or '-'} / {lead.get('utm_medium') or '-'} / {lead.get('utm_campaign') or '-'}"
+            f" · {lead.get('device') or 'Неизвестно'}"
+        )
+    return '\n\n'.join(blocks)
+
+
+def format_lead(lead: Dict[str, Any]) -> str:
+    return f"""🎯 Новая заявка с сайта!
+
+👤 Имя: {lead.get('name') or 'Не указано'}
+📱 Контакт: {lead.get('contact') or 'Не указан'}
+🎨 Ниша: {lead.get('niche') or 'Не указана'}
+🎯 Цель: {lead.get('goal') or 'Не указана'}
+
+📊 Аналитика:
+• Скролл: {lead.get('page_depth', 0)}%
+• Время: {lead.get('time_on_page', 0)} сек
+• Устройство: {lead.get('device') or 'Неизвестно'}
+
+🔗 UTM-метки:
+• Source: {lead.get('utm_source') or '-'}
+• Medium: {lead.get('utm_medium') or '-'}
+• Campaign: {lead.get('utm_campaign') or '-'}
+• Content: {lead.get('utm_content') or '-'}
+• Term: {lead.get('utm_term') or '-'}
+
+📍 Реферер: {lead.get('referrer') or 'Прямой переход'}
+"""
+
+
+def postpone_pending(conn: Any, retry_after: int) -> None:
+    with conn.cursor() as cur:
+        cur.execute('''
+            UPDATE lead_notifications
+            SET next_attempt_at = GREATEST(next_attempt_at, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            WHERE status = 'pending'
+        ''', (retry_after,))
+    conn.commit()
+
+
+def mark_delivery_unknown(conn: Any, ids: List[int], error: str) -> None:
+    '''
+    Сообщение могло дойти: в очередь не возвращаем, чтобы не продублировать
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+            UPDATE lead_notifications
+            SET status = 'unknown', attempts = attempts + 1, last_error = %s
+            WHERE id = ANY(%s)
+        ''', (error[:1000], ids))
+    conn.commit()
+
+
+def mark_failed_attempt(conn: Any, ids: List[int], error: str) -> None:
+    '''
+    Экспоненциальная пауза до следующей попытки; после MAX_ATTEMPTS - failed
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+            UPDATE lead_notifications
+            SET attempts = attempts + 1,
+                last_error = %s,
+                status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE 'pending' END,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => LEAST(%s, 30 * power(2, attempts)))
+            WHERE id = ANY(%s)
+        ''', (error[:1000], MAX_ATTEMPTS, MAX_RETRY_DELAY, ids))
+    conn.commit()
@@ -0,0 +1,151 @@
+'''
+Замер фаз вызова функции: validate, connect, query, http, serialize, compress
+На каждый вызов - одна JSON-строка в лог и заголовок Server-Timing
+Копия живёт в каждой функции: save-lead, get-leads, ga4-weekly-report, telegram-lead
+'''
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Подробные отладочные дампы (тела запросов, ответы) печатаются только с DEBUG=1
+DEBUG = os.environ.get('DEBUG', '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+# Порядок фаз в Server-Timing; прочие имена (wait - пауза перед повтором
+# запроса) идут следом по алфавиту
+PHASES = ('validate', 'connect', 'query', 'http', 'serialize', 'compress')
+
+_current: contextvars.ContextVar[Optional['Trace']] = contextvars.ContextVar('trace', default=None)
+_local = threading.local()
+_noop = contextlib.nullcontext()
+
+
+class Trace:
+    '''
+    Время фаз одного вызова. Фазы исключающие: время вложенной фазы
+    не входит в объемлющую, поэтому их сумма не больше total. Фазы из
+    потоков пула (in_context) складываются и могут превысить total
+    '''
+
+    def __init__(self, function: str, request_id: Optional[str]):
+        self.function = function
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.phases: Dict[str, List[float]] = {}
+        self.fields: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            phase = self.phases.setdefault(name, [0.0, 0])
+            phase[0] += seconds
+            phase[1] += 1
+
+    def ordered_phases(self) -> List[str]:
+        return sorted(self.phases, key=lambda name: (PHASES.index(name) if name in PHASES else len(PHASES), name))
+
+    def finish(self, event: Dict[str, Any], response: Any) -> None:
+        total_ms = (time.perf_counter() - self.started) * 1000
+        names = self.ordered_phases()
+
+        if isinstance(response, dict):
+            headers = response.setdefault('headers', {})
+            headers['Server-Timing'] = ', '.join(
+                [f'{name};dur={self.phases[name][0] * 1000:.1f}' for name in names] + [f'total;dur={total_ms:.1f}']
+            )
+            headers['Timing-Allow-Origin'] = '*'
+            exposed = headers.get('Access-Control-Expose-Headers')
+            headers['Access-Control-Expose-Headers'] = f'{exposed}, Server-Timing' if exposed else 'Server-Timing'
+
+        record = {
+            'fn': self.function,
+            'request_id': self.request_id,
+            'method': event.get('httpMethod') or 'SCHEDULED',
+            'status': response.get('statusCode') if isinstance(response, dict) else 'exception',
+            'total_ms': round(total_ms, 1),
+            'phases': {
+                name: {'ms': round(self.phases[name][0] * 1000, 1), 'n': int(self.phases[name][1])}
+                for name in names
+            }
+        }
+        record.update(self.fields)
+        print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class Span:
+    __slots__ = ('name', 'trace', 'started', 'children')
+
+    def __init__(self, name: str, trace: Trace):
+        self.name = name
+        self.trace = trace
+        self.children = 0.0
+
+    def __enter__(self) -> 'Span':
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> bool:
+        elapsed = time.perf_counter() - self.started
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.trace.add(self.name, elapsed - self.children)
+        return False
+
+
+def span(name: str) -> Any:
+    '''
+    with span('query'): ... - ничего не стоит вне трассируемого вызова
+    '''
+    trace = _current.get()
+    return Span(name, trace) if trace is not None else _noop
+
+
+def annotate(**fields: Any) -> None:
+    '''
+    Дополнительные поля строки лога текущего вызова
+    '''
+    trace = _current.get()
+    if trace is not None:
+        with trace._lock:
+            trace.fields.update(fields)
+
+
+def debug(*args: Any) -> None:
+    if DEBUG:
+        print(*args)
+
+
+def in_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    '''
+    Для пулов потоков: fn выполнится в копии текущего контекста
+    и запишет свои фазы в трассу вызова
+    '''
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def traced(function: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @functools.wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            trace = Trace(function, getattr(context, 'request_id', None))
+            token = _current.set(trace)
+            response = None
+            try:
+                response = handler(event, context)
+                return response
+            finally:
+                _current.reset(token)
+                trace.finish(event, response)
+        return wrapper
+    return decorate
@@ -0,0 +1,2 @@
+-- Составной индекс для проверки дублей: заявки с того же контакта за последние 60 секунд
+CREATE INDEX IF NOT EXISTS idx_leads_contact_timestamp ON leads(contact, timestamp DESC);
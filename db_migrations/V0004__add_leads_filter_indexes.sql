@@ -0,0 +1,12 @@
+-- Индексы под серверные фильтры get-leads. Во всех в конце идут timestamp
+-- и id, чтобы выборка с фильтром сразу читалась в порядке keyset-пагинации (timestamp DESC, id DESC)
+CREATE INDEX IF NOT EXISTS idx_leads_source_timestamp ON leads(utm_source, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_leads_source_medium_timestamp ON leads(utm_source, utm_medium, timestamp DESC, id DESC);
+-- Кампания самая селективная метка, поэтому любые сочетания с ней идут через этот индекс
+CREATE INDEX IF NOT EXISTS idx_leads_campaign_timestamp ON leads(utm_campaign, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_leads_device_timestamp ON leads(device, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_leads_niche_timestamp ON leads(niche, timestamp DESC, id DESC);
+
+-- Одноколоночные индексы из V0001 покрываются составными выше
+DROP INDEX IF EXISTS idx_leads_device;
+DROP INDEX IF EXISTS idx_leads_utm_source;
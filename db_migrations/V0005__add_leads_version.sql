@@ -0,0 +1,22 @@
+-- Счётчик версии таблицы leads для ETag в get-leads.
+-- Меняется в той же транзакции, что и сами лиды, поэтому новая версия
+-- становится видна читателям только вместе с новыми строками
+CREATE TABLE IF NOT EXISTS leads_version (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO leads_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_leads_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE leads_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_leads_version ON leads;
+CREATE TRIGGER trg_leads_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON leads
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_leads_version();
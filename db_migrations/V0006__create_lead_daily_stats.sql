@@ -0,0 +1,136 @@
+-- Дневной роллап лидов: день × источник × канал × кампания × устройство.
+-- Поддерживается триггерами на leads в той же транзакции, что и запись лида,
+-- поэтому дашборды и отчёты читают O(дней), а не O(лидов).
+-- Пересчёт с нуля: SELECT rebuild_lead_daily_stats();
+
+-- День лида по московскому времени, как у еженедельного отчёта
+CREATE OR REPLACE FUNCTION lead_day(ts BIGINT) RETURNS DATE AS $$
+    SELECT (to_timestamp(ts / 1000.0) AT TIME ZONE 'Europe/Moscow')::date
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE TABLE IF NOT EXISTS lead_daily_stats (
+    day DATE NOT NULL,
+    utm_source TEXT NOT NULL DEFAULT '',
+    utm_medium TEXT NOT NULL DEFAULT '',
+    utm_campaign TEXT NOT NULL DEFAULT '',
+    device TEXT NOT NULL DEFAULT '',
+    leads_count BIGINT NOT NULL DEFAULT 0,
+    page_depth_sum BIGINT NOT NULL DEFAULT 0,
+    time_on_page_sum BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, utm_source, utm_medium, utm_campaign, device)
+);
+
+CREATE OR REPLACE FUNCTION apply_lead_daily_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE lead_daily_stats AS s SET
+            leads_count = s.leads_count - d.leads_count,
+            page_depth_sum = s.page_depth_sum - d.page_depth_sum,
+            time_on_page_sum = s.time_on_page_sum - d.time_on_page_sum
+        FROM (
+            SELECT
+                lead_day(timestamp) AS day,
+                COALESCE(utm_source, '') AS utm_source,
+                COALESCE(utm_medium, '') AS utm_medium,
+                COALESCE(utm_campaign, '') AS utm_campaign,
+                COALESCE(device, '') AS device,
+                COUNT(*) AS leads_count,
+                SUM(COALESCE(page_depth, 0)) AS page_depth_sum,
+                SUM(COALESCE(time_on_page, 0)) AS time_on_page_sum
+            FROM old_leads
+            GROUP BY 1, 2, 3, 4, 5
+        ) AS d
+        WHERE s.day = d.day AND s.utm_source = d.utm_source AND s.utm_medium = d.utm_medium
+            AND s.utm_campaign = d.utm_campaign AND s.device = d.device;
+
+        DELETE FROM lead_daily_stats WHERE leads_count <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO lead_daily_stats AS s (
+            day, utm_source, utm_medium, utm_campaign, device,
+            leads_count, page_depth_sum, time_on_page_sum
+        )
+        SELECT
+            lead_day(timestamp),
+            COALESCE(utm_source, ''),
+            COALESCE(utm_medium, ''),
+            COALESCE(utm_campaign, ''),
+            COALESCE(device, ''),
+            COUNT(*),
+            SUM(COALESCE(page_depth, 0)),
+            SUM(COALESCE(time_on_page, 0))
+        FROM new_leads
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (day, utm_source, utm_medium, utm_campaign, device) DO UPDATE SET
+            leads_count = s.leads_count + EXCLUDED.leads_count,
+            page_depth_sum = s.page_depth_sum + EXCLUDED.page_depth_sum,
+            time_on_page_sum = s.time_on_page_sum + EXCLUDED.time_on_page_sum;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION truncate_lead_daily_stats() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM lead_daily_stats;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры с таблицами переходов не могут слушать несколько событий сразу
+DROP TRIGGER IF EXISTS trg_lead_daily_stats_insert ON leads;
+CREATE TRIGGER trg_lead_daily_stats_insert
+    AFTER INSERT ON leads
+    REFERENCING NEW TABLE AS new_leads
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_lead_daily_stats();
+
+DROP TRIGGER IF EXISTS trg_lead_daily_stats_update ON leads;
+CREATE TRIGGER trg_lead_daily_stats_update
+    AFTER UPDATE ON leads
+    REFERENCING OLD TABLE AS old_leads NEW TABLE AS new_leads
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_lead_daily_stats();
+
+DROP TRIGGER IF EXISTS trg_lead_daily_stats_delete ON leads;
+CREATE TRIGGER trg_lead_daily_stats_delete
+    AFTER DELETE ON leads
+    REFERENCING OLD TABLE AS old_leads
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_lead_daily_stats();
+
+DROP TRIGGER IF EXISTS trg_lead_daily_stats_truncate ON leads;
+CREATE TRIGGER trg_lead_daily_stats_truncate
+    AFTER TRUNCATE ON leads
+    FOR EACH STATEMENT EXECUTE FUNCTION truncate_lead_daily_stats();
+
+-- Полный пересчёт роллапа из leads. Запись лидов на время пересчёта блокируется
+CREATE OR REPLACE FUNCTION rebuild_lead_daily_stats() RETURNS BIGINT AS $$
+DECLARE
+    rebuilt BIGINT;
+BEGIN
+    LOCK TABLE leads IN SHARE MODE;
+    DELETE FROM lead_daily_stats;
+
+    INSERT INTO lead_daily_stats (
+        day, utm_source, utm_medium, utm_campaign, device,
+        leads_count, page_depth_sum, time_on_page_sum
+    )
+    SELECT
+        lead_day(timestamp),
+        COALESCE(utm_source, ''),
+        COALESCE(utm_medium, ''),
+        COALESCE(utm_campaign, ''),
+        COALESCE(device, ''),
+        COUNT(*),
+        SUM(COALESCE(page_depth, 0)),
+        SUM(COALESCE(time_on_page, 0))
+    FROM leads
+    GROUP BY 1, 2, 3, 4, 5;
+
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+    RETURN rebuilt;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Бэкфилл существующих лидов
+SELECT rebuild_lead_daily_stats();
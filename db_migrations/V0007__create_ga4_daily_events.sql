@@ -0,0 +1,22 @@
+-- Локальный снимок GA4: события по дням × источник × канал × кампания.
+-- ga4-weekly-report дозапрашивает из GA4 только отсутствующие дни и дни,
+-- которые ещё «дозревают» (задержка обработки GA4 24-48 часов),
+-- а отчёт за любой период считается из этих таблиц.
+CREATE TABLE IF NOT EXISTS ga4_daily_events (
+    property_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    event_name TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    medium TEXT NOT NULL DEFAULT '',
+    campaign TEXT NOT NULL DEFAULT '',
+    event_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (property_id, day, event_name, source, medium, campaign)
+);
+
+-- Какие дни уже загружены и когда: день без событий тоже считается загруженным
+CREATE TABLE IF NOT EXISTS ga4_fetched_days (
+    property_id TEXT NOT NULL,
+    day DATE NOT NULL,
+    fetched_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (property_id, day)
+);
@@ -0,0 +1,20 @@
+-- Outbox уведомлений о лидах для telegram-lead.
+-- save-lead пишет сюда в той же транзакции, что и сам лид, а диспетчер
+-- telegram-lead по расписанию отправляет накопившееся пачками, склеивая
+-- близкие по времени заявки в одно сообщение. Заявка на сайте больше
+-- не ждёт ответа Telegram.
+CREATE TABLE IF NOT EXISTS lead_notifications (
+    id BIGSERIAL PRIMARY KEY,
+    lead_id VARCHAR(255),
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+-- Диспетчер читает только ожидающие отправки, поэтому индекс частичный
+CREATE INDEX IF NOT EXISTS idx_lead_notifications_pending
+    ON lead_notifications (next_attempt_at, id) WHERE status = 'pending';
@@ -0,0 +1,165 @@
+-- Помесячное секционирование leads по timestamp.
+-- V0001 и V0002 создавали leads с разными типами (VARCHAR/NOT NULL против
+-- TEXT/NULL), и обе - одной кучей, индексы которой растут без конца.
+-- Здесь leads пересоздаётся со схемой V0002, секционированной по диапазонам
+-- timestamp (мс с эпохи, границы - начало месяца по UTC):
+--   leads_YYYY_MM - секция месяца,
+--   leads_default - всё, чему секции ещё нет (часы клиента убежали вперёд,
+--                   импорт старых лидов); ensure_leads_partitions() разносит
+--                   такие строки по секциям прошедших месяцев.
+-- Первичный ключ обязан включать ключ секционирования, поэтому он (id, timestamp);
+-- id клиент собирает из того же timestamp (lead_<timestamp>_<random>).
+-- Секции на months_ahead месяцев вперёд создаёт ensure_leads_partitions(),
+-- её по расписанию вызывает telegram-lead. Старые секции отсоединяет
+-- и выгружает в сжатые файлы scripts/archive_leads.py.
+
+-- Создаёт секцию месяца month и переносит в неё строки этого месяца из leads_default
+-- Returns: TRUE, если секция создана, FALSE, если она уже была
+CREATE OR REPLACE FUNCTION create_leads_partition(month DATE) RETURNS BOOLEAN AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', month::timestamp);
+    partition_name TEXT := 'leads_' || to_char(month_start, 'YYYY_MM');
+    range_start BIGINT := (extract(epoch FROM month_start AT TIME ZONE 'UTC') * 1000)::bigint;
+    range_end BIGINT := (extract(epoch FROM (month_start + interval '1 month') AT TIME ZONE 'UTC') * 1000)::bigint;
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    -- Пока строки переезжают, в leads_default никто не пишет: иначе
+    -- ATTACH нашёл бы там строки нового месяца и откатился
+    LOCK TABLE leads_default IN ACCESS EXCLUSIVE MODE;
+    EXECUTE format('CREATE TABLE %I (LIKE leads INCLUDING DEFAULTS)', partition_name);
+    -- Прямо в секциях, минуя leads: триггеры роллапа и версии не срабатывают,
+    -- лиды ведь не меняются
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM leads_default WHERE timestamp >= $1 AND timestamp < $2 RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        partition_name
+    ) USING range_start, range_end;
+    EXECUTE format(
+        'ALTER TABLE leads ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)',
+        partition_name, range_start, range_end
+    );
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции с текущего месяца на months_ahead вперёд и для прошедших месяцев,
+-- строки которых лежат в leads_default
+-- Returns: сколько секций создано
+CREATE OR REPLACE FUNCTION ensure_leads_partitions(months_ahead INTEGER DEFAULT 3) RETURNS INTEGER AS $$
+DECLARE
+    current_month DATE := date_trunc('month', now() AT TIME ZONE 'UTC')::date;
+    window_end BIGINT := (extract(epoch FROM (current_month + make_interval(months => months_ahead + 1))::timestamp
+                          AT TIME ZONE 'UTC') * 1000)::bigint;
+    month DATE;
+    created INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_leads_partitions'));
+    FOR month IN
+        SELECT generate_series(current_month, current_month + make_interval(months => months_ahead), interval '1 month')::date
+        UNION
+        SELECT DISTINCT date_trunc('month', to_timestamp(timestamp / 1000.0) AT TIME ZONE 'UTC')::date
+        FROM leads_default
+        WHERE timestamp < window_end
+        ORDER BY 1
+    LOOP
+        IF create_leads_partition(month) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('leads')) = 'p' THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE leads RENAME TO leads_unpartitioned;
+
+    CREATE TABLE leads (
+        id TEXT NOT NULL,
+        timestamp BIGINT NOT NULL,
+        date TEXT NOT NULL,
+        name TEXT NOT NULL,
+        contact TEXT NOT NULL,
+        niche TEXT,
+        goal TEXT,
+        utm_source TEXT,
+        utm_medium TEXT,
+        utm_campaign TEXT,
+        utm_content TEXT,
+        utm_term TEXT,
+        page_depth INTEGER,
+        time_on_page INTEGER,
+        device TEXT,
+        referrer TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) PARTITION BY RANGE (timestamp);
+    CREATE TABLE leads_default PARTITION OF leads DEFAULT;
+
+    -- Секции под уже накопленные месяцы заранее, чтобы строки легли в них сразу
+    FOR month IN
+        SELECT DISTINCT date_trunc('month', to_timestamp(timestamp / 1000.0) AT TIME ZONE 'UTC')::date
+        FROM leads_unpartitioned
+        WHERE timestamp < extract(epoch FROM (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '4 months')
+                                  AT TIME ZONE 'UTC') * 1000
+    LOOP
+        PERFORM create_leads_partition(month);
+    END LOOP;
+
+    -- Триггеров на новой leads ещё нет: роллап и версия остаются как были
+    INSERT INTO leads (
+        id, timestamp, date, name, contact, niche, goal,
+        utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+        page_depth, time_on_page, device, referrer, created_at
+    )
+    SELECT
+        id, timestamp, date, name, contact, niche, goal,
+        utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+        page_depth, time_on_page, device, referrer, created_at
+    FROM leads_unpartitioned;
+
+    DROP TABLE leads_unpartitioned;
+
+    -- Индексы V0002-V0004, теперь секционированные: у каждой секции свои
+    -- и небольшие, у старых месяцев они уже не меняются
+    ALTER TABLE leads ADD PRIMARY KEY (id, timestamp);
+    CREATE INDEX idx_leads_timestamp ON leads (timestamp DESC);
+    CREATE INDEX idx_leads_contact_timestamp ON leads (contact, timestamp DESC);
+    CREATE INDEX idx_leads_source_timestamp ON leads (utm_source, timestamp DESC, id DESC);
+    CREATE INDEX idx_leads_source_medium_timestamp ON leads (utm_source, utm_medium, timestamp DESC, id DESC);
+    CREATE INDEX idx_leads_campaign_timestamp ON leads (utm_campaign, timestamp DESC, id DESC);
+    CREATE INDEX idx_leads_device_timestamp ON leads (device, timestamp DESC, id DESC);
+    CREATE INDEX idx_leads_niche_timestamp ON leads (niche, timestamp DESC, id DESC);
+
+    -- Триггеры V0005 и V0006 ушли вместе со старой таблицей
+    CREATE TRIGGER trg_leads_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON leads
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_leads_version();
+    CREATE TRIGGER trg_lead_daily_stats_insert
+        AFTER INSERT ON leads
+        REFERENCING NEW TABLE AS new_leads
+        FOR EACH STATEMENT EXECUTE FUNCTION apply_lead_daily_stats();
+    CREATE TRIGGER trg_lead_daily_stats_update
+        AFTER UPDATE ON leads
+        REFERENCING OLD TABLE AS old_leads NEW TABLE AS new_leads
+        FOR EACH STATEMENT EXECUTE FUNCTION apply_lead_daily_stats();
+    CREATE TRIGGER trg_lead_daily_stats_delete
+        AFTER DELETE ON leads
+        REFERENCING OLD TABLE AS old_leads
+        FOR EACH STATEMENT EXECUTE FUNCTION apply_lead_daily_stats();
+    CREATE TRIGGER trg_lead_daily_stats_truncate
+        AFTER TRUNCATE ON leads
+        FOR EACH STATEMENT EXECUTE FUNCTION truncate_lead_daily_stats();
+END
+$$;
+
+SELECT ensure_leads_partitions();
+ANALYZE leads;
@@ -0,0 +1,40 @@
+-- Версия leads для ETag без общей строки.
+-- UPDATE leads_version из V0005 держал блокировку единственной строки до
+-- конца транзакции записи, и все save-lead выстраивались за ней в очередь
+-- независимо от контакта. Теперь каждая пишущая команда добавляет свою
+-- строку в leads_changes: вставки друг друга не ждут.
+-- Версия для читателя - (max(id), count(*)) по закоммиченным строкам.
+-- Одного max(id) мало: транзакция с меньшим id может закоммититься позже
+-- соседней, max не изменится, а новые лиды появятся; count(*) растёт на
+-- каждом коммите. Как и раньше, строка журнала видна только вместе с лидами.
+-- Журнал сжимает compact_leads_changes(), её по расписанию вызывает telegram-lead.
+
+CREATE TABLE IF NOT EXISTS leads_changes (
+    id BIGSERIAL PRIMARY KEY,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_leads_version() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO leads_changes DEFAULT VALUES;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Оставляет одну новую строку вместо всех прежних. Её id больше любого уже
+-- выданного, поэтому пара (max, count) не повторит ни одну прежнюю, даже
+-- если позже закоммитятся строки с меньшими id
+-- Returns: сколько строк удалено
+CREATE OR REPLACE FUNCTION compact_leads_changes() RETURNS INTEGER AS $$
+DECLARE
+    newest BIGINT;
+    removed INTEGER;
+BEGIN
+    INSERT INTO leads_changes DEFAULT VALUES RETURNING id INTO newest;
+    DELETE FROM leads_changes WHERE id < newest;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TABLE IF EXISTS leads_version;
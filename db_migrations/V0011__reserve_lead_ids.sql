@@ -0,0 +1,33 @@
+-- Уникальность id лида поверх секционирования.
+-- С V0009 первичный ключ leads - (id, timestamp): уникальный индекс
+-- секционированной таблицы обязан включать ключ секционирования, и тот же
+-- id с другим timestamp вставлялся новой строкой. Несекционированная
+-- lead_ids держит все id; триггер перед вставкой в leads резервирует id
+-- и молча пропускает строку, если он уже занят. Для save-lead это то же,
+-- что ON CONFLICT DO NOTHING: пропущенный лид не попадает в RETURNING
+-- и отвечается дублем.
+-- Цена - ещё одна вставка в индекс на лид; индекс узкий и один на таблицу,
+-- а не по индексу на секцию. scripts/archive_leads.py вместе с секцией
+-- освобождает её id: иначе вернуть архив в leads было бы нельзя, зато id
+-- архивных лидов снова свободны.
+
+CREATE TABLE IF NOT EXISTS lead_ids (
+    id TEXT PRIMARY KEY
+);
+
+INSERT INTO lead_ids (id) SELECT id FROM leads ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION reserve_lead_id() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO lead_ids (id) VALUES (NEW.id) ON CONFLICT (id) DO NOTHING;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_leads_reserve_id ON leads;
+CREATE TRIGGER trg_leads_reserve_id
+    BEFORE INSERT ON leads
+    FOR EACH ROW EXECUTE FUNCTION reserve_lead_id();
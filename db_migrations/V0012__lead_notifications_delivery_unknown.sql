@@ -0,0 +1,9 @@
+-- Конечный статус unknown для уведомлений, чья доставка неизвестна:
+-- соединение с Telegram оборвалось уже после отправки sendMessage,
+-- и сообщение могло дойти. Такие уведомления не возвращаются в очередь,
+-- чтобы следующий запуск диспетчера не продублировал их в чате;
+-- last_error хранит причину, проверять их остаётся вручную.
+
+ALTER TABLE lead_notifications DROP CONSTRAINT IF EXISTS lead_notifications_status_check;
+ALTER TABLE lead_notifications ADD CONSTRAINT lead_notifications_status_check
+    CHECK (status IN ('pending', 'sent', 'failed', 'unknown'));
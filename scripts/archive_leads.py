@@ -0,0 +1,164 @@
+"""
+Архивация старых месяцев leads: секции leads_YYYY_MM, целиком лежащие
+раньше начала месяца (текущий - N), отсоединяются от leads, выгружаются
+в сжатый CSV и удаляются.
+
+Для каждой секции:
+  1. DETACH PARTITION и запись в журнал leads_changes одной транзакцией, чтобы
+     get-leads сбросил ETag и кэш ответов;
+  2. COPY в <out>/leads_YYYY_MM.csv.gz (с заголовком, UTF-8);
+  3. чтение файла обратно и сверка числа строк с count(*);
+  4. DROP TABLE и освобождение id секции в lead_ids (V0011), чтобы архив
+     можно было вернуть.
+Если прошлый запуск оборвался между шагами, отсоединённая, но не удалённая
+таблица подбирается следующим запуском. lead_daily_stats архивные месяцы
+не теряет: триггеры роллапа на DETACH не срабатывают. Поэтому после
+архивации не вызывайте rebuild_lead_daily_stats() - он пересчитает роллап
+только по оставшимся лидам.
+
+Вернуть месяц обратно (роллап уже учитывает эти лиды, а COPY прямо
+в секцию триггеры leads не вызывает):
+  SELECT create_leads_partition('2024-01-01');
+  gunzip -c leads_2024_01.csv.gz | psql "$DATABASE_URL" \\
+      -c "\\copy leads_2024_01 FROM STDIN WITH (FORMAT csv, HEADER)"
+  INSERT INTO leads_changes DEFAULT VALUES;
+
+Запуск: DATABASE_URL=postgresql://... python scripts/archive_leads.py
+        [--older-than-months 12] [--out archive] [--dry-run]
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import re
+import sys
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import psycopg2
+from psycopg2 import sql
+
+PARTITION_NAME = re.compile(r'^leads_(\d{4})_(\d{2})$')
+
+
+def cutoff_month(months: int) -> date:
+    '''
+    Начало месяца, отстоящего от текущего (по UTC) на months назад
+    '''
+    today = datetime.now(timezone.utc).date()
+    index = today.year * 12 + today.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def old_partitions(conn: Any, cutoff: date) -> List[Tuple[str, bool]]:
+    '''
+    Секции месяцев раньше cutoff: (имя, подключена ли ещё к leads).
+    Неподключённые - остатки оборванного запуска
+    '''
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT relname, relispartition FROM pg_class
+            WHERE relkind = 'r' AND relname ~ '^leads_[0-9]{4}_[0-9]{2}$'
+            AND pg_table_is_visible(oid)
+            ORDER BY relname
+        ''')
+        rows = cur.fetchall()
+    conn.commit()
+    result = []
+    for name, attached in rows:
+        match = PARTITION_NAME.match(name)
+        if date(int(match.group(1)), int(match.group(2)), 1) < cutoff:
+            result.append((name, attached))
+    return result
+
+
+def archive_path(out: Path, name: str) -> Path:
+    path = out / f'{name}.csv.gz'
+    suffix = 1
+    while path.exists():
+        path = out / f'{name}.{suffix}.csv.gz'
+        suffix += 1
+    return path
+
+
+def detach(conn: Any, name: str) -> None:
+    with conn.cursor() as cur:
+        # DETACH берёт ACCESS EXCLUSIVE на leads: не ждём за долгой выгрузкой
+        cur.execute("SET LOCAL lock_timeout = '5s'")
+        cur.execute(sql.SQL('ALTER TABLE leads DETACH PARTITION {}').format(sql.Identifier(name)))
+        # DETACH триггеры leads не вызывает: версию для get-leads сдвигаем сами
+        cur.execute('INSERT INTO leads_changes DEFAULT VALUES')
+    conn.commit()
+
+
+def export(conn: Any, name: str, path: Path) -> int:
+    '''
+    Выгружает таблицу в path и сверяет файл с таблицей
+    Returns: число выгруженных строк
+    '''
+    table = sql.Identifier(name)
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL('SELECT count(*) FROM {}').format(table))
+        expected = cur.fetchone()[0]
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as out:
+            cur.copy_expert(sql.SQL('COPY {} TO STDOUT WITH (FORMAT csv, HEADER)').format(table).as_string(conn), out)
+    conn.commit()
+
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as archived:
+        written = sum(1 for _ in csv.reader(archived)) - 1
+    if written != expected:
+        raise RuntimeError(f'{path}: {written} rows in archive, {expected} in {name}')
+    return written
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--older-than-months', type=int, default=12)
+    parser.add_argument('--out', default='archive')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    if args.older_than_months < 1:
+        parser.error('--older-than-months must be at least 1')
+
+    cutoff = cutoff_month(args.older_than_months)
+    out = Path(args.out)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        partitions = old_partitions(conn, cutoff)
+        if not partitions:
+            print(f'Nothing to archive before {cutoff:%Y-%m}')
+        for name, attached in partitions:
+            if args.dry_run:
+                print(f"would archive {name}{'' if attached else ' (already detached)'}")
+                continue
+            if attached:
+                detach(conn, name)
+            out.mkdir(parents=True, exist_ok=True)
+            path = archive_path(out, name)
+            rows = export(conn, name, path)
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL('''
+                    DELETE FROM lead_ids USING {table} archived
+                    WHERE lead_ids.id = archived.id
+                    AND NOT EXISTS (SELECT 1 FROM leads WHERE leads.id = archived.id)
+                ''').format(table=sql.Identifier(name)))
+                cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(name)))
+            conn.commit()
+            print(f'{name}: {rows} leads -> {path}')
+
+        if not args.dry_run:
+            with conn.cursor() as cur:
+                cur.execute('SELECT ensure_leads_partitions()')
+                created = cur.fetchone()[0]
+            conn.commit()
+            if created:
+                print(f'Created {created} partition(s) ahead')
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Бенчмарк сжатия ответов get-leads: размер против времени CPU на разных
+уровнях gzip и brotli.
+
+Тела ответов берутся из самого handler без Accept-Encoding (страницы,
+агрегаты, выгрузки NDJSON и CSV) по лидам во временной схеме; для каждого
+уровня печатаются размер сжатого тела и его base64 (так оно уходит в ответ),
+степень сжатия, медианное время сжатия и распаковки. Каждый результат
+проверяется обратной распаковкой.
+
+Запуск: DATABASE_URL=postgresql://... python scripts/bench_compression.py
+        [--rows 50000] [--levels gzip:1,gzip:6,br:4,br:5] [--repeat 5]
+"""
+
+import argparse
+import base64
+import gzip
+import importlib.util
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+SCHEMA = 'bench_compression'
+BASE_TIMESTAMP = 1700000000000
+DEFAULT_LEVELS = 'gzip:1,gzip:4,gzip:6,gzip:9,br:1,br:4,br:5,br:6,br:9,br:11'
+
+
+def load_get_leads() -> Any:
+    module_dir = ROOT / 'backend' / 'get-leads'
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location('get_leads_index', module_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def seed(dsn: str, rows: int) -> None:
+    '''
+    Лиды с разнообразием как у настоящих: случайные имена и контакты,
+    повторяющиеся UTM, устройства, ниши и реферреры
+    '''
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        for migration in sorted((ROOT / 'db_migrations').glob('V*.sql')):
+            cur.execute(migration.read_text(encoding='utf-8'))
+        cur.execute('''
+            INSERT INTO leads (
+                id, timestamp, date, name, contact, niche, goal,
+                utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+                page_depth, time_on_page, device, referrer
+            )
+            SELECT
+                'lead_' || substr(md5(i::text), 1, 12), %s + i * 37000,
+                to_char(to_timestamp((%s + i * 37000) / 1000), 'DD.MM.YYYY, HH24:MI:SS'),
+                (ARRAY['Анна', 'Иван', 'Мария', 'Олег', 'Ксения', 'Дмитрий'])[1 + i %% 6] || ' ' || substr(md5('n' || i), 1, 6),
+                CASE WHEN i %% 3 = 0 THEN '+7 9' || lpad((i * 7919 %% 1000000000)::text, 9, '0')
+                     ELSE '@' || substr(md5('c' || i), 1, 10) END,
+                (ARRAY['Онлайн-школа', 'Ремонт квартир', 'Стоматология', 'Фитнес', 'Юристы'])[1 + i %% 5],
+                (ARRAY['Больше заявок', 'Снизить стоимость лида', 'Запустить рекламу'])[1 + i %% 3],
+                (ARRAY['google', 'yandex', 'vk', 'telegram', NULL])[1 + i %% 5],
+                (ARRAY['cpc', 'organic', 'social', NULL])[1 + i %% 4],
+                'campaign_' || (i %% 40), CASE WHEN i %% 2 = 0 THEN 'banner_' || (i %% 12) END, NULL,
+                i %% 17, (i * 13) %% 900, (ARRAY['mobile', 'desktop'])[1 + i %% 2],
+                (ARRAY['https://www.google.com/', 'https://yandex.ru/', '', 'https://t.me/'])[1 + i %% 4]
+            FROM generate_series(1, %s) AS i
+        ''', (BASE_TIMESTAMP, BASE_TIMESTAMP, rows))
+        cur.execute('ANALYZE leads')
+    conn.close()
+
+
+def drop(dsn: str) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    conn.close()
+
+
+def payloads(get_leads: Any, rows: int) -> List[Tuple[str, bytes]]:
+    cases = [
+        ('page-50', {'limit': '50'}),
+        ('page-1000', {'limit': '1000'}),
+        ('stats-utm-day', {'view': 'stats', 'groupBy': 'utm_source,utm_medium,day'}),
+        (f'ndjson-{rows // 1000}k', {'format': 'ndjson'}),
+        (f'csv-{rows // 1000}k', {'format': 'csv'}),
+    ]
+    result = []
+    for name, params in cases:
+        response = get_leads.handler({'httpMethod': 'GET', 'queryStringParameters': params}, None)
+        if response['statusCode'] != 200 or response['isBase64Encoded']:
+            raise RuntimeError(f'{name}: unexpected response {response["statusCode"]}')
+        result.append((name, response['body'].encode('utf-8')))
+    return result
+
+
+def codec(name: str, level: int) -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    if name == 'gzip':
+        return lambda data: gzip.compress(data, compresslevel=level, mtime=0), gzip.decompress
+    import brotli
+    return lambda data: brotli.compress(data, quality=level), brotli.decompress
+
+
+def timed(fn: Callable[[bytes], bytes], data: bytes, repeat: int) -> Tuple[bytes, float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        result = fn(data)
+        samples.append(time.process_time() - started)
+    return result, statistics.median(samples) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--levels', default=DEFAULT_LEVELS)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    levels = []
+    for item in args.levels.split(','):
+        name, _, level = item.partition(':')
+        if name not in ('gzip', 'br') or not level.isdigit():
+            parser.error(f'bad level {item}, expected gzip:N or br:N')
+        levels.append((name, int(level)))
+
+    dsn = os.environ['DATABASE_URL']
+    print(f'Seeding {args.rows} synthetic leads...')
+    seed(dsn, args.rows)
+    os.environ['DATABASE_URL'] = f"{dsn}{'&' if '?' in dsn else '?'}options=-csearch_path%3D{SCHEMA}"
+    try:
+        bodies = payloads(load_get_leads(), args.rows)
+    finally:
+        drop(dsn)
+
+    print(f"{'payload':<15} {'raw KB':>9} {'codec':>8} {'KB':>8} {'base64 KB':>10} {'ratio':>6}"
+          f" {'cpu ms':>8} {'MB/s':>7} {'unpack ms':>10}")
+    for payload, data in bodies:
+        for name, level in levels:
+            compress, decompress = codec(name, level)
+            # brotli 10-11 на десятках мегабайт идёт минутами: хватит одного замера
+            repeat = 1 if level >= 10 and len(data) > 4 * 1024 * 1024 else args.repeat
+            packed, cpu_ms = timed(compress, data, repeat)
+            unpacked, unpack_ms = timed(decompress, packed, repeat)
+            if unpacked != data:
+                raise RuntimeError(f'{payload} {name}:{level}: round trip mismatch')
+            print(f'{payload:<15} {len(data) / 1024:>9.1f} {name + ":" + str(level):>8} {len(packed) / 1024:>8.1f}'
+                  f' {len(base64.b64encode(packed)) / 1024:>10.1f} {len(data) / len(packed):>6.1f}'
+                  f' {cpu_ms:>8.2f} {len(data) / 1024 / 1024 / max(cpu_ms / 1000, 1e-9):>7.0f} {unpack_ms:>10.2f}')
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Бенчмарк и проверка воронки ga4-weekly-report на синтетических строках GA4:
+  legacy - прежний ReportAggregator: цикл по строкам со словарями событий и источников
+  funnel - EventTable (страницы сворачиваются в итоги группировок отчёта) + Funnel
+           из backend/ga4-weekly-report/funnel.py
+
+Отдельно замеряются разбор страниц GA4 (ingest) и расчёт цифр отчёта (aggr).
+Перед замером для нескольких наборов данных (с нулями, ничьими, пустыми
+периодами) проверяется, что все цифры отчёта совпадают с прежним расчётом
+точно, включая порядок ТОП-3 источников. Код прежнего расчёта заморожен ниже.
+
+Запуск: python scripts/bench_ga4_funnel.py [--rows 1000000]
+"""
+
+import argparse
+import importlib.util
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGE_SIZE = 10000
+PERIODS = ('current', 'previous_week', 'previous_year')
+
+
+def load_report():
+    module_dir = ROOT / 'backend' / 'ga4-weekly-report'
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location('ga4_report_index', module_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_pages(rows: int, seed: int, events: List[str], sources: int = 40, campaigns: int = 300,
+                    zero_share: float = 0.0, skip_periods: tuple = ()) -> Iterator[Dict[str, Any]]:
+    r = random.Random(seed)
+    periods = [p for p in PERIODS if p not in skip_periods]
+    headers = [{'name': name} for name in ('eventName', 'sessionSource', 'sessionMedium', 'sessionCampaignName', 'dateRange')]
+    page = []
+    for _ in range(rows):
+        count = 0 if r.random() < zero_share else r.randint(1, 50)
+        page.append({
+            'dimensionValues': [
+                {'value': r.choice(events)},
+                {'value': f'src{r.randrange(sources)}'},
+                {'value': r.choice(('cpc', 'organic', '(none)'))},
+                {'value': f'camp{r.randrange(campaigns)}'},
+                {'value': r.choice(periods)}
+            ],
+            'metricValues': [{'value': str(count)}]
+        })
+        if len(page) == PAGE_SIZE:
+            yield {'dimensionHeaders': headers, 'rows': page}
+            page = []
+    if page:
+        yield {'dimensionHeaders': headers, 'rows': page}
+
+
+class LegacyAggregator:
+    """
+    Прежний расчёт отчёта без изменений
+    """
+
+    def __init__(self, events: List[str]):
+        self.periods = {
+            name: {'events': {event: 0 for event in events}, 'sources': {}}
+            for name in PERIODS
+        }
+
+    def add_page(self, dimension_headers, rows) -> None:
+        headers = [header['name'] for header in dimension_headers]
+        range_index = headers.index('dateRange') if 'dateRange' in headers else None
+        for row in rows:
+            values = row['dimensionValues']
+            event_name = values[0]['value']
+            source = values[1]['value']
+            medium = values[2]['value']
+            period = values[range_index]['value'] if range_index is not None else 'current'
+            count = int(row['metricValues'][0]['value'])
+            if period not in self.periods:
+                continue
+            events_count = self.periods[period]['events']
+            utm_sources = self.periods[period]['sources']
+            if event_name in events_count:
+                events_count[event_name] += count
+            if event_name in ['begin_checkout', 'generate_lead']:
+                utm_key = f"{source} / {medium}"
+                if utm_key not in utm_sources:
+                    utm_sources[utm_key] = 0
+                utm_sources[utm_key] += count
+
+    def numbers(self) -> Dict[str, Any]:
+        events_count = self.periods['current']['events']
+        utm_sources = self.periods['current']['sources']
+        page_views = events_count['page_view']
+        engaged = events_count['engaged_scroll']
+        viewed_form = events_count['view_item']
+        bot_opens = events_count['begin_checkout']
+        form_submits = events_count['generate_lead']
+        total_conversions = bot_opens + form_submits
+        return {
+            'events': dict(events_count),
+            'previous_week_events': dict(self.periods['previous_week']['events']),
+            'previous_year_events': dict(self.periods['previous_year']['events']),
+            'total_conversions': total_conversions,
+            'cr_overall': round((total_conversions / page_views * 100), 2) if page_views > 0 else 0,
+            'cr_form': round((form_submits / viewed_form * 100), 2) if viewed_form > 0 else 0,
+            'cr_bot': round((bot_opens / page_views * 100), 2) if page_views > 0 else 0,
+            'dropoff_engagement': round(((page_views - engaged) / page_views * 100), 2) if page_views > 0 else 0,
+            'dropoff_form_view': round(((engaged - viewed_form) / engaged * 100), 2) if engaged > 0 else 0,
+            'dropoff_conversion': round(((viewed_form - total_conversions) / viewed_form * 100), 2) if viewed_form > 0 else 0,
+            'engaged_pct': (engaged/page_views*100) if page_views > 0 else 0,
+            'viewed_form_pct': (viewed_form/page_views*100) if page_views > 0 else 0,
+            'form_submits_pct': (form_submits/total_conversions*100) if total_conversions > 0 else 0,
+            'bot_opens_pct': (bot_opens/total_conversions*100) if total_conversions > 0 else 0,
+            'best_source': max(utm_sources.items(), key=lambda x: x[1]) if utm_sources else ('N/A', 0),
+            'top_sources': [
+                (source, count, self.periods['previous_week']['sources'].get(source, 0))
+                for source, count in sorted(utm_sources.items(), key=lambda x: x[1], reverse=True)[:3]
+            ]
+        }
+
+
+def ingest_legacy(report, pages) -> LegacyAggregator:
+    aggregator = LegacyAggregator(report.FUNNEL_EVENTS)
+    for page in pages:
+        aggregator.add_page(page['dimensionHeaders'], page['rows'])
+    return aggregator
+
+
+def ingest_funnel(report, pages):
+    table = report.EventTable(report.REPORT_GROUPINGS)
+    for page in pages:
+        report.add_report_page(table, page['dimensionHeaders'], page['rows'])
+    return table
+
+
+def run_legacy(report, pages) -> Dict[str, Any]:
+    return ingest_legacy(report, pages).numbers()
+
+
+def run_funnel(report, pages) -> Dict[str, Any]:
+    return report.report_numbers(ingest_funnel(report, pages))
+
+
+def check_equivalence(report) -> int:
+    events = report.FUNNEL_EVENTS
+    cases = [
+        ('mixed', dict(rows=50000, seed=1, events=events)),
+        ('few sources, ties', dict(rows=20000, seed=2, events=events, sources=3, campaigns=2)),
+        ('zero counts', dict(rows=5000, seed=3, events=events, zero_share=0.5)),
+        ('no conversions', dict(rows=5000, seed=4, events=['page_view', 'engaged_scroll', 'view_item'])),
+        ('no previous periods', dict(rows=5000, seed=5, events=events, skip_periods=('previous_week', 'previous_year'))),
+        ('empty', dict(rows=0, seed=6, events=events)),
+    ]
+    failures = 0
+    for name, params in cases:
+        legacy = run_legacy(report, synthetic_pages(**params))
+        funnel = run_funnel(report, synthetic_pages(**params))
+        ok = legacy == funnel
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            for key in legacy:
+                if legacy[key] != funnel.get(key):
+                    print(f'     {key}: legacy={legacy[key]!r} funnel={funnel.get(key)!r}')
+    return failures
+
+
+def measure(report, mode: str, rows: int) -> Dict[str, Any]:
+    pages = list(synthetic_pages(rows, 7, report.FUNNEL_EVENTS))
+    ingest = ingest_legacy if mode == 'legacy' else ingest_funnel
+    summarize = (lambda state: state.numbers()) if mode == 'legacy' else report.report_numbers
+
+    started = time.perf_counter()
+    state = ingest(report, pages)
+    ingested = time.perf_counter()
+    numbers = summarize(state)
+    finished = time.perf_counter()
+
+    # Отдельный прогон под tracemalloc, чтобы трассировка не искажала время
+    del state
+    tracemalloc.start()
+    state = ingest(report, pages)
+    summarize(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'mode': mode,
+        'ingest': round(ingested - started, 2),
+        'aggregate': round(finished - ingested, 2),
+        'seconds': round(finished - started, 2),
+        'peak_mb': round(peak / 1024 / 1024, 1),
+        'numbers': numbers
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    report = load_report()
+    if check_equivalence(report):
+        return 1
+
+    print(f"\n{args.rows} rows in pages of {PAGE_SIZE}")
+    print(f"{'mode':<8} {'ingest':>7} {'aggr':>7} {'total':>7} {'peak MB':>9}")
+    results = [measure(report, mode, args.rows) for mode in ('legacy', 'funnel')]
+    for r in results:
+        print(f"{r['mode']:<8} {r['ingest']:>7} {r['aggregate']:>7} {r['seconds']:>7} {r['peak_mb']:>9}")
+    if results[0]['numbers'] != results[1]['numbers']:
+        print(f'FAIL numbers differ on {args.rows} rows')
+        return 1
+    print(f'OK   numbers identical on {args.rows} rows')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Бенчмарк выгрузки get-leads: пиковый RSS и время для
+  legacy - fetchall + список dict + один json.dumps (как было до format=)
+  legacy-db - тот же массив, собранный json_agg в Postgres одной строкой
+  ndjson/csv - export_leads через именованный курсор в «пустой» приёмник,
+               NDJSON построчно через row_to_lead + json.dumps
+  ndjson-db - NDJSON, строки которого собирает Postgres (JSON_IN_DB)
+  ndjson-body, ndjson-body-db - то же в буфер UTF-8 с декодированием в str,
+               как в ответе функции
+  page, page-db - страницы по MAX_PAGE_SIZE через курсоры, как листает клиент
+cpu sec - процессорное время самого Python: работа Postgres в него не входит.
+
+Каждый замер идёт в отдельном процессе, чтобы ru_maxrss не смешивался.
+Лиды генерируются во временной схеме, после прогона она удаляется.
+
+Запуск: DATABASE_URL=postgresql://... python scripts/bench_get_leads_export.py
+        [--sizes 10000,100000,1000000] [--modes legacy,legacy-db]
+"""
+
+import argparse
+import importlib.util
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+SCHEMA = 'bench_export'
+BASE_TIMESTAMP = 1700000000000
+MODES = ('legacy', 'legacy-db', 'ndjson', 'ndjson-db', 'csv', 'ndjson-body', 'ndjson-body-db', 'page', 'page-db')
+
+
+class CountingSink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, chunk: str) -> int:
+        self.size += len(chunk)
+        return len(chunk)
+
+
+def load_get_leads():
+    module_dir = ROOT / 'backend' / 'get-leads'
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location('get_leads_index', module_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def seed(rows: int) -> None:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        for migration in sorted((ROOT / 'db_migrations').glob('V*.sql')):
+            cur.execute(migration.read_text(encoding='utf-8'))
+        cur.execute('''
+            INSERT INTO leads (
+                id, timestamp, date, name, contact, niche, goal,
+                utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+                page_depth, time_on_page, device, referrer
+            )
+            SELECT
+                'lead_' || i, %s + i * 1000, '12.12.2024, 10:00:00', 'Имя ' || i, '@user' || i,
+                'Ниша ' || (i %% 40), 'Цель заявки', (ARRAY['google', 'yandex', 'vk', 'telegram'])[1 + i %% 4],
+                (ARRAY['cpc', 'organic', 'social'])[1 + i %% 3], 'campaign_' || (i %% 25), 'content', 'term',
+                i %% 100, i %% 600, (ARRAY['mobile', 'desktop'])[1 + i %% 2], 'https://google.com'
+            FROM generate_series(1, %s) AS i
+        ''', (BASE_TIMESTAMP, rows))
+        cur.execute('ANALYZE leads')
+    conn.close()
+
+
+def drop() -> None:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    conn.close()
+
+
+def measure(mode: str, rows: int) -> None:
+    '''
+    Один замер внутри дочернего процесса, результат - строка JSON в stdout
+    '''
+    get_leads = load_get_leads()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], options=f'-c search_path={SCHEMA}')
+    filters = {'dateTo': BASE_TIMESTAMP + rows * 1000}
+    json_in_db = mode.endswith('-db')
+    mode_name = mode[:-len('-db')] if json_in_db else mode
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_started = usage.ru_utime + usage.ru_stime
+    started = time.perf_counter()
+
+    if mode == 'legacy':
+        where, params = get_leads.build_where(filters, None)
+        with conn.cursor() as cur:
+            cur.execute(f'{get_leads.LEAD_SELECT} {where} ORDER BY timestamp DESC', params)
+            leads = [get_leads.row_to_lead(row) for row in cur.fetchall()]
+        output_size = len(json.dumps({'leads': leads}))
+    elif mode == 'legacy-db':
+        where, params = get_leads.build_where(filters, None)
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                SELECT COALESCE(json_agg({get_leads.LEAD_JSON} ORDER BY timestamp DESC), '[]')::text
+                FROM leads {where}
+            ''', params)
+            output_size = len(f'{{"leads": {cur.fetchone()[0]}}}')
+    elif mode_name == 'page':
+        output_size = 0
+        cursor = None
+        while True:
+            if json_in_db:
+                leads_json, _, cursor = get_leads.fetch_leads_json(conn, get_leads.MAX_PAGE_SIZE, cursor, filters)
+                body = f'{{"leads": {leads_json}, "nextCursor": {json.dumps(cursor)}}}'
+            else:
+                leads, cursor = get_leads.fetch_leads(conn, get_leads.MAX_PAGE_SIZE, cursor, filters)
+                body = json.dumps({'leads': leads, 'nextCursor': cursor})
+            output_size += len(body)
+            if not cursor:
+                break
+            cursor = get_leads.decode_cursor(cursor)
+    elif mode_name == 'ndjson-body':
+        buffer = io.BytesIO()
+        out = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+        get_leads.export_leads(conn, 'ndjson', filters, out, json_in_db=json_in_db)
+        out.flush()
+        output_size = len(buffer.getvalue().decode('utf-8'))
+    else:
+        sink = CountingSink()
+        get_leads.export_leads(conn, mode_name, filters, sink, json_in_db=json_in_db)
+        output_size = sink.size
+
+    elapsed = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    peak = usage.ru_maxrss
+    print(json.dumps({
+        'mode': mode,
+        'rows': rows,
+        'seconds': round(elapsed, 2),
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime - cpu_started, 2),
+        'peak_rss_mb': round(peak / 1024, 1),
+        'growth_mb': round((peak - baseline) / 1024, 1),
+        'output_mb': round(output_size / 1024 / 1024, 1)
+    }))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--measure', choices=MODES)
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.limit)
+        return 0
+
+    sizes = sorted({int(size) for size in args.sizes.split(',')})
+    modes = [mode for mode in args.modes.split(',') if mode]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        parser.error(f"unknown mode: {', '.join(unknown)}")
+    print(f'Seeding {sizes[-1]} synthetic leads...')
+    seed(sizes[-1])
+    try:
+        print(f"{'mode':<15} {'rows':>9} {'sec':>7} {'cpu sec':>8} {'peak RSS MB':>12} {'growth MB':>10} {'output MB':>10}")
+        for mode in modes:
+            for size in sizes:
+                result = subprocess.run(
+                    [sys.executable, __file__, '--measure', mode, '--limit', str(size)],
+                    capture_output=True, text=True, check=True
+                )
+                r = json.loads(result.stdout.strip().splitlines()[-1])
+                print(f"{r['mode']:<15} {r['rows']:>9} {r['seconds']:>7} {r['cpu_seconds']:>8} {r['peak_rss_mb']:>12}"
+                      f" {r['growth_mb']:>10} {r['output_mb']:>10}")
+    finally:
+        drop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
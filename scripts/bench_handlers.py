@@ -0,0 +1,365 @@
+"""
+Нагрузочный стенд для всех функций backend/*: handler из index.py
+вызывается напрямую синтетическими событиями, внешние сервисы
+(Google OAuth, GA4, Telegram) подменяются локальной подделкой
+из fake_services.py, БД - временная схема с накатанными миграциями.
+
+Для каждого сценария:
+  cold   - импорт index.py и первый вызов в свежем процессе (медиана по --cold прогонам)
+  warm   - p50/p95/p99 последовательных вызовов после прогрева
+  conc   - пропускная способность и p95 при --concurrency одновременных вызовах
+  alloc  - пик памяти на вызов (tracemalloc) и сколько памяти остаётся после вызова
+
+--save results.json сохраняет результат, --compare results.json сравнивает
+с сохранённым и завершается с кодом 1, если warm p95, cold или alloc выросли
+больше чем на --tolerance.
+
+Запуск: DATABASE_URL=postgresql://... python scripts/bench_handlers.py [--only save-lead] [--calls 200]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SCHEMA = 'bench_handlers'
+SEED_LEADS = 20000
+BASE_TIMESTAMP = 1700000000000
+
+# Функциям не нужно ждать настоящий лимит Telegram и склеивать уведомления
+BENCH_ENV = {
+    'TELEGRAM_RATE_PER_SEC': '100000',
+    'TELEGRAM_BURST': '100000',
+    'OUTBOX_COALESCE_WINDOW': '0',
+}
+
+
+class Scenario:
+    def __init__(self, function: str, name: str, make_event: Callable[[int], Dict[str, Any]],
+                 expect_status: int = 200, calls_scale: float = 1.0):
+        self.function = function
+        self.name = name
+        self.make_event = make_event
+        self.expect_status = expect_status
+        self.calls_scale = calls_scale
+
+    @property
+    def key(self) -> str:
+        return f'{self.function}/{self.name}'
+
+
+# Уникальный номер на процесс, чтобы лиды разных прогонов не считались дублями
+_sequence = itertools.count(int(time.time() * 1000) % 10 ** 9 * 1000)
+
+
+def synthetic_lead(i: int) -> Dict[str, Any]:
+    n = next(_sequence)
+    return {
+        'id': f'bench_{n}', 'timestamp': BASE_TIMESTAMP + n, 'date': '12.12.2024, 10:00:00',
+        'name': f'Имя {i}', 'contact': f'@bench{n}', 'niche': f'Ниша {i % 40}', 'goal': 'Цель заявки',
+        'utm_source': ('google', 'yandex', 'vk')[i % 3], 'utm_medium': 'cpc', 'utm_campaign': f'campaign_{i % 25}',
+        'utm_content': '', 'utm_term': '', 'page_depth': i % 100, 'time_on_page': i % 600,
+        'device': ('mobile', 'desktop')[i % 2], 'referrer': 'https://google.com'
+    }
+
+
+_retried: Dict[int, str] = {}
+
+
+def retried_lead(i: int) -> str:
+    '''
+    Каждый лид отправляется дважды подряд, как при повторе запроса фронтендом
+    '''
+    return _retried.setdefault(i // 2, json.dumps(synthetic_lead(i)))
+
+
+SCENARIOS = [
+    Scenario('save-lead', 'single', lambda i: {'httpMethod': 'POST', 'body': json.dumps(synthetic_lead(i))}),
+    Scenario('save-lead', 'retry', lambda i: {'httpMethod': 'POST', 'body': retried_lead(i)}),
+    Scenario('save-lead', 'batch-50', lambda i: {
+        'httpMethod': 'POST', 'body': json.dumps([synthetic_lead(i * 50 + j) for j in range(50)])
+    }, calls_scale=0.25),
+    Scenario('get-leads', 'page-50', lambda i: {'httpMethod': 'GET', 'queryStringParameters': {'limit': '50'}}),
+    Scenario('get-leads', 'filtered', lambda i: {
+        'httpMethod': 'GET', 'queryStringParameters': {'limit': '50', 'utm_source': ('google', 'yandex', 'vk')[i % 3]}
+    }),
+    Scenario('get-leads', 'stats', lambda i: {
+        'httpMethod': 'GET', 'queryStringParameters': {'view': 'stats', 'groupBy': 'day,utm_source'}
+    }),
+    Scenario('telegram-lead', 'dispatch', lambda i: {'httpMethod': 'POST', 'body': json.dumps({'action': 'dispatch'})}),
+    Scenario('ga4-weekly-report', 'cron', lambda i: {'trigger': 'cron'}, calls_scale=0.1),
+]
+
+
+def database_url() -> str:
+    '''
+    DATABASE_URL, в котором все запросы функций идут во временную схему
+    '''
+    url = os.environ['DATABASE_URL']
+    options = urllib.parse.quote(f'-c search_path={SCHEMA}')
+    return f"{url}{'&' if '?' in url else '?'}options={options}"
+
+
+def prepare_schema() -> None:
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        for migration in sorted((ROOT / 'db_migrations').glob('V*.sql')):
+            cur.execute(migration.read_text(encoding='utf-8'))
+        cur.execute('''
+            INSERT INTO leads (
+                id, timestamp, date, name, contact, niche, goal,
+                utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+                page_depth, time_on_page, device, referrer
+            )
+            SELECT
+                'seed_' || i, %s + i * 1000, '12.12.2024, 10:00:00', 'Имя ' || i, '@seed' || i,
+                'Ниша ' || (i %% 40), 'Цель заявки', (ARRAY['google', 'yandex', 'vk'])[1 + i %% 3],
+                'cpc', 'campaign_' || (i %% 25), '', '',
+                i %% 100, i %% 600, (ARRAY['mobile', 'desktop'])[1 + i %% 2], 'https://google.com'
+            FROM generate_series(1, %s) AS i
+        ''', (BASE_TIMESTAMP, SEED_LEADS))
+        cur.execute('ANALYZE')
+    conn.close()
+
+
+def drop_schema() -> None:
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    conn.close()
+
+
+def load_handler(function: str) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    '''
+    Каждая функция несёт свои копии db_pool.py и прочих модулей под
+    одинаковыми именами, поэтому перед импортом они выгружаются из sys.modules.
+    Каталог функции остаётся в sys.path: часть модулей импортируется
+    лениво, уже при вызове handler
+    '''
+    module_dir = ROOT / 'backend' / function
+    backend_dirs = {str(path) for path in (ROOT / 'backend').iterdir()}
+    sys.path[:] = [path for path in sys.path if path not in backend_dirs]
+    for path in (ROOT / 'backend').glob('*/*.py'):
+        sys.modules.pop(path.stem, None)
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location(f"{function.replace('-', '_')}_index", module_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.handler
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)] if ordered else 0.0
+
+
+def call(handler: Callable, scenario: Scenario, i: int) -> float:
+    event = scenario.make_event(i)
+    started = time.perf_counter()
+    response = handler(event, None)
+    elapsed = (time.perf_counter() - started) * 1000
+    if response['statusCode'] != scenario.expect_status:
+        raise RuntimeError(f"{scenario.key}: status {response['statusCode']}: {str(response.get('body'))[:300]}")
+    return elapsed
+
+
+def measure_cold(scenario: Scenario) -> None:
+    '''
+    Внутри дочернего процесса: импорт и первый вызов, результат - строка JSON в stdout
+    '''
+    out = sys.stdout
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        started = time.perf_counter()
+        handler = load_handler(scenario.function)
+        imported = time.perf_counter()
+        first_call = call(handler, scenario, 0)
+    out.write(json.dumps({'import_ms': (imported - started) * 1000, 'first_call_ms': first_call}) + '\n')
+
+
+def run_cold(scenario: Scenario, runs: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, __file__, '--cold-child', scenario.key],
+            capture_output=True, text=True, env=os.environ.copy()
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f'{scenario.key}: cold run failed\n{result.stderr[-2000:]}')
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        'import_ms': percentile([s['import_ms'] for s in samples], 50),
+        'first_call_ms': percentile([s['first_call_ms'] for s in samples], 50),
+        'total_ms': percentile([s['import_ms'] + s['first_call_ms'] for s in samples], 50)
+    }
+
+
+def run_warm(handler: Callable, scenario: Scenario, calls: int) -> Dict[str, float]:
+    call(handler, scenario, 0)
+    latencies = [call(handler, scenario, i) for i in range(1, calls + 1)]
+    return {
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies)
+    }
+
+
+def run_concurrent(handler: Callable, scenario: Scenario, calls: int, concurrency: int) -> Dict[str, float]:
+    counter = itertools.count(1)
+    counter_lock = threading.Lock()
+
+    def worker(_: int) -> List[float]:
+        latencies = []
+        while True:
+            with counter_lock:
+                i = next(counter)
+            if i > calls:
+                return latencies
+            latencies.append(call(handler, scenario, i))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = [value for chunk in executor.map(worker, range(concurrency)) for value in chunk]
+    elapsed = time.perf_counter() - started
+    return {'rps': calls / elapsed, 'p95_ms': percentile(latencies, 95)}
+
+
+def run_alloc(handler: Callable, scenario: Scenario, calls: int) -> Dict[str, float]:
+    '''
+    Пик сверх базового уровня на каждый вызов и прирост памяти за все вызовы
+    (кэши и пулы к этому моменту уже прогреты, так что рост - это утечка)
+    '''
+    call(handler, scenario, 0)
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        peaks = []
+        for i in range(1, calls + 1):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            call(handler, scenario, i)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'peak_kb': percentile(peaks, 50) / 1024, 'retained_kb_per_call': (retained - baseline) / 1024 / calls}
+
+
+def run_scenario(scenario: Scenario, args: argparse.Namespace) -> Dict[str, Any]:
+    calls = max(int(args.calls * scenario.calls_scale), 5)
+    result: Dict[str, Any] = {'cold': run_cold(scenario, args.cold)}
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        handler = load_handler(scenario.function)
+        result['warm'] = run_warm(handler, scenario, calls)
+        result['concurrent'] = run_concurrent(handler, scenario, calls, args.concurrency)
+        result['alloc'] = run_alloc(handler, scenario, max(calls // 4, 5))
+    return result
+
+
+def print_row(key: str, r: Dict[str, Any]) -> None:
+    print(
+        f"{key:<30} {r['cold']['import_ms']:>8.0f} {r['cold']['first_call_ms']:>8.1f}"
+        f" {r['warm']['p50_ms']:>7.2f} {r['warm']['p95_ms']:>7.2f} {r['warm']['p99_ms']:>7.2f}"
+        f" {r['concurrent']['rps']:>8.0f} {r['concurrent']['p95_ms']:>8.2f}"
+        f" {r['alloc']['peak_kb']:>8.1f} {r['alloc']['retained_kb_per_call']:>8.2f}"
+    )
+
+
+# Что сравнивается с сохранённым прогоном: (группа, метрика)
+COMPARED = [('cold', 'total_ms'), ('warm', 'p95_ms'), ('alloc', 'peak_kb')]
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> int:
+    regressions = 0
+    for key, r in results.items():
+        if key not in baseline:
+            continue
+        for group, metric in COMPARED:
+            old, new = baseline[key][group][metric], r[group][metric]
+            if old > 0 and new > old * (1 + tolerance):
+                regressions += 1
+                print(f'REGRESSION {key} {group}.{metric}: {old:.2f} -> {new:.2f} (+{(new / old - 1) * 100:.0f}%)')
+    if not regressions:
+        print(f'OK   no regressions above {tolerance * 100:.0f}% against baseline')
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', action='append', help='function or function/scenario, can repeat')
+    parser.add_argument('--calls', type=int, default=200, help='warm calls per scenario before calls_scale')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--cold', type=int, default=5, help='fresh processes per scenario')
+    parser.add_argument('--save')
+    parser.add_argument('--compare')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--cold-child')
+    args = parser.parse_args()
+
+    if args.cold_child:
+        measure_cold(next(s for s in SCENARIOS if s.key == args.cold_child))
+        return 0
+
+    # psycopg2 и cryptography импортируются только здесь, иначе дочерний
+    # процесс холодного замера получил бы их уже загруженными
+    sys.path.insert(0, str(ROOT / 'scripts'))
+    from fake_services import FakeServices
+
+    scenarios = [
+        s for s in SCENARIOS
+        if not args.only or s.function in args.only or s.key in args.only
+    ]
+    services = FakeServices().start()
+    os.environ.update(services.env())
+    os.environ.update(BENCH_ENV)
+    prepare_schema()
+    original_url = os.environ['DATABASE_URL']
+    os.environ['DATABASE_URL'] = database_url()
+
+    results: Dict[str, Any] = {}
+    try:
+        print(f"Warm calls {args.calls}, concurrency {args.concurrency}, cold runs {args.cold}, {SEED_LEADS} seeded leads")
+        print(
+            f"{'scenario':<30} {'import':>8} {'1st ms':>8} {'p50':>7} {'p95':>7} {'p99':>7}"
+            f" {'conc rps':>8} {'conc p95':>8} {'peak KB':>8} {'KB kept':>8}"
+        )
+        for scenario in scenarios:
+            results[scenario.key] = run_scenario(scenario, args)
+            print_row(scenario.key, results[scenario.key])
+    finally:
+        os.environ['DATABASE_URL'] = original_url
+        drop_schema()
+        services.stop()
+    print(f'Fake services: {services.counts}')
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2), encoding='utf-8')
+    if args.compare:
+        return 1 if compare(results, json.loads(Path(args.compare).read_text(encoding='utf-8')), args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Проверка кэша OAuth-токена ga4-weekly-report против локальных подделок
+Google OAuth, GA4 Data API и Telegram (fake_services.py):
+  - несколько запусков в одном контейнере - ровно один обмен JWT на токен;
+  - 401 от GA4 - ровно один новый обмен, и отчёт всё равно уходит;
+  - 401 и после обновления - отчёт не уходит, обмен всё равно один;
+  - токен, которому до истечения меньше TOKEN_REFRESH_MARGIN, обменивается заново.
+Завершается с кодом 1, если число обменов не совпало.
+
+Запуск: python scripts/check_ga4_token_cache.py
+"""
+
+import importlib.util
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from fake_services import FakeServices
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class TokenFakeServices(FakeServices):
+    '''
+    Подделка, которая отвечает 401 на следующие unauthorized запросов runReport
+    и выдаёт токены со сроком expires_in
+    '''
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.unauthorized = 0
+        self.expires_in = 3600
+
+    def route(self, path: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        if path == '/token':
+            self._count('token')
+            return 200, {'access_token': f"fake-access-token-{self.counts['token']}",
+                         'expires_in': self.expires_in, 'token_type': 'Bearer'}
+        if path.endswith(':runReport') and self.unauthorized:
+            self.unauthorized -= 1
+            self._count('runReport')
+            return 401, {'error': {'code': 401, 'message': 'Request had invalid authentication credentials.'}}
+        return super().route(path, body)
+
+
+def load_ga4() -> Any:
+    module_dir = ROOT / 'backend' / 'ga4-weekly-report'
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location('ga4_index', module_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main() -> int:
+    services = TokenFakeServices(rows=200).start()
+    os.environ.update(services.env())
+    # Без БД отчёт идёт прямо в GA4 API: каждый запуск делает runReport
+    os.environ.pop('DATABASE_URL', None)
+    os.environ.pop('GA4_REPORTS', None)
+    ga4 = load_ga4()
+    failures = 0
+
+    def check(name: str, runs: int, expected_exchanges: int, expected_sent: bool) -> None:
+        nonlocal failures
+        before = services.counts['token']
+        sent = []
+        for _ in range(runs):
+            response = ga4.handler({'trigger': 'cron'}, None)
+            sent.append(json.loads(response['body'])['reports'][0]['status'] == 'sent')
+        exchanges = services.counts['token'] - before
+        ok = exchanges == expected_exchanges and all(status == expected_sent for status in sent)
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {exchanges} token exchange(s) in {runs} run(s),"
+              f" expected {expected_exchanges}; reports sent: {sent}")
+
+    try:
+        check('warm runs reuse one token', 3, 1, True)
+        services.unauthorized = 1
+        check('401 refreshes the token once', 1, 1, True)
+        check('refreshed token is reused', 2, 0, True)
+        # Обновлённый здесь токен истекает внутри TOKEN_REFRESH_MARGIN
+        services.expires_in = ga4.TOKEN_REFRESH_MARGIN - 1
+        services.unauthorized = 2
+        check('401 after refresh fails without a second refresh', 1, 1, False)
+        check('token about to expire is exchanged every run', 2, 2, True)
+    finally:
+        services.stop()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+Проверка, что сборка JSON в Postgres (JSON_IN_DB) и построчная сборка
+в Python (row_to_lead + json.dumps) дают в get-leads одинаковые ответы.
+
+Лиды с кириллицей, эмодзи, кавычками, обратными слешами, управляющими
+символами и NULL в необязательных колонках пишутся во временную схему.
+Для набора запросов (страницы с курсором и фильтрами, NDJSON-выгрузка)
+ответ обоими путями разбирается json.loads и сравнивается целиком,
+включая порядок ключей у каждого лида. Завершается с кодом 1 при расхождении.
+
+Запуск: DATABASE_URL=postgresql://... python scripts/check_get_leads_json.py
+"""
+
+import importlib.util
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+SCHEMA = 'check_leads_json'
+BASE_TIMESTAMP = 1700000000000
+
+TRICKY_TEXT = (
+    'Имя "в кавычках"',
+    'back\\slash / slash',
+    'tab\there\nnew line\r\x01\x1f',
+    'эмодзи 🚀 и   разделитель',
+    '</script><b>html</b>',
+    '',
+)
+
+
+def load_get_leads() -> Any:
+    module_dir = ROOT / 'backend' / 'get-leads'
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location('get_leads_index', module_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def seed(dsn: str) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        for migration in sorted((ROOT / 'db_migrations').glob('V*.sql')):
+            cur.execute(migration.read_text(encoding='utf-8'))
+        for i in range(60):
+            text = TRICKY_TEXT[i % len(TRICKY_TEXT)]
+            optional = None if i % 3 == 0 else f'{text} {i}'
+            cur.execute('''
+                INSERT INTO leads (
+                    id, timestamp, date, name, contact, niche, goal,
+                    utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+                    page_depth, time_on_page, device, referrer
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ''', (
+                f'lead_{i:03d}', BASE_TIMESTAMP + (i // 2) * 1000, '12.12.2024, 10:00:00', text or 'x',
+                f'@user{i}', text, text, optional, optional and 'cpc', optional, optional, optional,
+                i % 100, i * 7, ('mobile', 'desktop')[i % 2], optional
+            ))
+    conn.close()
+
+
+def drop(dsn: str) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    conn.close()
+
+
+def call(get_leads: Any, params: Dict[str, str], json_in_db: bool) -> Dict[str, Any]:
+    get_leads.JSON_IN_DB = json_in_db
+    get_leads._response_cache.clear()
+    response = get_leads.handler({'httpMethod': 'GET', 'queryStringParameters': params}, None)
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"{params}: status {response['statusCode']}: {response['body']}")
+    return response
+
+
+def parse(response: Dict[str, Any], export: bool) -> Any:
+    if export:
+        # Только \n: splitlines() резал бы и по U+2028 внутри строк JSON
+        return [json.loads(line) for line in response['body'].split('\n') if line]
+    return json.loads(response['body'])
+
+
+def key_orders(leads: List[Dict[str, Any]]) -> set:
+    return {tuple(lead) for lead in leads}
+
+
+def main() -> int:
+    dsn = os.environ['DATABASE_URL']
+    seed(dsn)
+    os.environ['DATABASE_URL'] = f"{dsn}{'&' if '?' in dsn else '?'}options=-csearch_path%3D{SCHEMA}"
+    failures = 0
+    try:
+        get_leads = load_get_leads()
+        cases = [
+            {},
+            {'limit': '7'},
+            {'limit': '1'},
+            {'limit': '1000'},
+            {'limit': '5', 'device': 'mobile'},
+            {'limit': '10', 'dateFrom': str(BASE_TIMESTAMP + 5000), 'dateTo': str(BASE_TIMESTAMP + 20000)},
+            {'limit': '3', 'utm_source': 'nothing-matches'},
+            {'format': 'ndjson'},
+            {'format': 'ndjson', 'device': 'desktop'},
+        ]
+        for params in cases:
+            export = 'format' in params
+            pages = leads_total = case_failures = 0
+            first = params
+            while True:
+                python = parse(call(get_leads, params, json_in_db=False), export)
+                database = parse(call(get_leads, params, json_in_db=True), export)
+                leads = python if export else python['leads']
+                db_leads = database if export else database['leads']
+                same = python == database and key_orders(db_leads) <= {tuple(get_leads.LEAD_FIELDS)}
+                case_failures += not same
+                pages += 1
+                leads_total += len(leads)
+                if not same:
+                    print(f'  differs: {json.dumps(params)} page {pages}')
+                    for expected, actual in zip(leads, db_leads):
+                        if expected != actual or list(expected) != list(actual):
+                            print(f'  python: {json.dumps(expected, ensure_ascii=False)}')
+                            print(f'  db:     {json.dumps(actual, ensure_ascii=False)}')
+                            break
+                if export or not python['nextCursor']:
+                    break
+                params = dict(params, cursor=python['nextCursor'])
+            failures += case_failures
+            print(f"{'FAIL' if case_failures else 'OK  '} {json.dumps(first)}: {pages} page(s), {leads_total} leads")
+    finally:
+        drop(dsn)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Проверка планов запросов get-leads: EXPLAIN каждого типового фильтра
+должен использовать ожидаемый индекс из db_migrations/
+
+leads секционирована по месяцам, и в плане стоят индексы секций
+(leads_2023_11_timestamp_idx...): они сводятся к родительским через pg_inherits.
+
+Все миграции накатываются во временную схему, туда же пишутся
+синтетические лиды, после проверки схема удаляется.
+
+Запуск: DATABASE_URL=postgresql://... python scripts/check_get_leads_plans.py
+"""
+
+import importlib.util
+import os
+import re
+import sys
+from pathlib import Path
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+SCHEMA = 'plan_check'
+ROWS = 200000
+
+CASES = [
+    ({}, 'idx_leads_timestamp'),
+    ({'dateFrom': 1700050000000, 'dateTo': 1700060000000}, 'idx_leads_timestamp'),
+    ({'utm_source': 'src3'}, 'idx_leads_source_timestamp'),
+    ({'utm_source': 'src3', 'utm_medium': 'cpc'}, 'idx_leads_source_medium_timestamp'),
+    ({'utm_source': 'src3', 'utm_medium': 'cpc', 'utm_campaign': 'camp103'}, 'idx_leads_campaign_timestamp'),
+    ({'utm_campaign': 'camp103'}, 'idx_leads_campaign_timestamp'),
+    ({'device': 'tablet'}, 'idx_leads_device_timestamp'),
+    ({'niche': 'niche11'}, 'idx_leads_niche_timestamp'),
+    ({'niche': 'niche11', 'dateFrom': 1700050000000}, 'idx_leads_niche_timestamp'),
+]
+
+
+def load_get_leads():
+    module_dir = ROOT / 'backend' / 'get-leads'
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location('get_leads_index', module_dir / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main() -> int:
+    get_leads = load_get_leads()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    failures = 0
+
+    with conn.cursor() as cur:
+        cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        cur.execute(f'CREATE SCHEMA {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        try:
+            for migration in sorted((ROOT / 'db_migrations').glob('V*.sql')):
+                cur.execute(migration.read_text(encoding='utf-8'))
+
+            # Распределения ближе к реальным: 50 источников, 200 кампаний, 100 ниш,
+            # 1/50 лидов с планшетов. На слабоселективных фильтрах планировщик
+            # законно предпочитает idx_leads_timestamp, поэтому они не проверяются
+            cur.execute('''
+                INSERT INTO leads (
+                    id, timestamp, date, name, contact, niche, goal,
+                    utm_source, utm_medium, utm_campaign, utm_content, utm_term,
+                    page_depth, time_on_page, device, referrer
+                )
+                SELECT
+                    'lead_' || i, 1700000000000 + i * 1000, 'date', 'name', 'contact' || (i %% 5000),
+                    'niche' || (i %% 100), 'goal', 'src' || (i %% 50),
+                    (ARRAY['cpc', 'organic', 'social'])[1 + i %% 3], 'camp' || (i %% 200), '', '',
+                    i %% 100, i %% 300, CASE WHEN i %% 50 = 0 THEN 'tablet' WHEN i %% 2 = 0 THEN 'mobile' ELSE 'desktop' END, ''
+                FROM generate_series(1, %s) AS i
+            ''', (ROWS,))
+            # Лиды ноября 2023 легли в leads_default: секция их месяца
+            cur.execute('SELECT ensure_leads_partitions()')
+            cur.execute('ANALYZE leads')
+            cur.execute('''
+                SELECT child.relname, parent.relname
+                FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                WHERE child.relkind = 'i'
+            ''')
+            parent_index = dict(cur.fetchall())
+
+            for filters, expected_index in CASES:
+                query, params = get_leads.build_page_query(get_leads.DEFAULT_PAGE_SIZE, None, filters)
+                cur.execute('EXPLAIN ' + query, params)
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+                used = {parent_index.get(name, name) for name in re.findall(r'using (\S+)', plan)}
+                ok = expected_index in used
+                failures += not ok
+                print(f"{'OK  ' if ok else 'FAIL'} {filters or 'no filters'} -> {expected_index}")
+                if not ok:
+                    print(plan)
+        finally:
+            cur.execute('RESET search_path')
+            cur.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+
+    conn.close()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Время холодного старта функций backend/*: импорт index.py и preflight OPTIONS
+в свежем процессе.
+
+Проверка (по умолчанию):
+  - после импорта index.py и вызова OPTIONS не загружен ни один модуль из
+    HEAVY_MODULES: драйвер БД, pydantic, jwt/cryptography, urllib.request и
+    клиент Telegram нужны только путям, которые реально ходят в БД и сеть
+  - медиана времени импорта по --runs прогонам не выше IMPORT_BUDGET_MS
+Завершается с кодом 1 при нарушении.
+
+--profile печатает для каждой функции самые дорогие модули по данным
+python -X importtime (собственное и накопленное время).
+
+Запуск: python scripts/check_import_budget.py [--profile] [--only save-lead] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+FUNCTIONS = ('save-lead', 'get-leads', 'telegram-lead', 'ga4-weekly-report')
+
+# Медиана импорта index.py в миллисекундах; с запасом на медленные раннеры
+IMPORT_BUDGET_MS = {
+    'save-lead': 40,
+    'get-leads': 60,
+    'telegram-lead': 40,
+    'ga4-weekly-report': 70,
+}
+
+HEAVY_MODULES = (
+    'psycopg2', 'pydantic', 'pydantic_core', 'jwt', 'cryptography',
+    'urllib.request', 'http.client', 'ssl', 'telegram_client', 'db_pool', 'ga4_store'
+)
+
+# Выполняется в дочернем процессе с cwd = каталог функции
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, '.')
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+response = index.handler({'httpMethod': 'OPTIONS'}, None)
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'options_ms': (finished - imported) * 1000,
+    'status': response['statusCode'],
+    'modules': sorted(sys.modules)
+}))
+'''
+
+
+def run_child(function: str, importtime: bool = False) -> Tuple[Dict[str, Any], str]:
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD]
+    result = subprocess.run(command, cwd=ROOT / 'backend' / function, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'{function}: import failed\n{result.stderr[-2000:]}')
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    '''
+    Строки "import time: self [us] | cumulative | imported package"
+    '''
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def profile(function: str, top: int) -> None:
+    run_child(function)
+    _, stderr = run_child(function, importtime=True)
+    entries = parse_importtime(stderr)
+    # Прямые импорты самого index.py - с отступом в одну ступень
+    top_level = [e for e in entries if not e[0].startswith('   ')]
+    total_us = sum(cumulative for _, _, cumulative in top_level)
+    print(f'\n{function}: {total_us / 1000:.1f} ms in {len(entries)} modules')
+    print(f"  {'self ms':>8} {'cumul ms':>9}  module")
+    for name, self_us, cumulative_us in sorted(entries, key=lambda e: e[2], reverse=True)[:top]:
+        print(f'  {self_us / 1000:>8.1f} {cumulative_us / 1000:>9.1f}  {name}')
+
+
+def check(function: str, runs: int) -> int:
+    # Первый прогон только обновляет __pycache__ после правок, в замер не идёт
+    run_child(function)
+    samples = [run_child(function)[0] for _ in range(runs)]
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    options_ms = statistics.median(s['options_ms'] for s in samples)
+    budget = IMPORT_BUDGET_MS[function]
+    heavy = sorted({
+        name for sample in samples for name in sample['modules']
+        if name in HEAVY_MODULES or name.split('.')[0] in HEAVY_MODULES
+    })
+    failures = 0
+
+    ok = import_ms <= budget
+    failures += not ok
+    print(f"{'OK  ' if ok else 'FAIL'} {function}: import {import_ms:.1f} ms (budget {budget} ms), OPTIONS {options_ms:.2f} ms")
+
+    ok = not heavy and all(s['status'] == 200 for s in samples)
+    failures += not ok
+    if not ok:
+        print(f"FAIL {function}: loaded before they are needed: {', '.join(heavy) or '-'};"
+              f" OPTIONS status {samples[0]['status']}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--only', action='append', choices=FUNCTIONS)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    functions = args.only or FUNCTIONS
+    if args.profile:
+        for function in functions:
+            profile(function, args.top)
+        return 0
+    return 1 if sum(check(function, args.runs) for function in functions) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
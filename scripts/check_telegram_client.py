@@ -0,0 +1,210 @@
+"""
+Проверка telegram_client.py против локального фейкового Telegram:
+keep-alive, 429 с retry_after, 5xx, обрывы соединения посреди запроса,
+закрытие простаивающего соединения сервером и параллельные вызовы
+
+Фейковый сервер отвечает по сценарию из очереди: ok, 429:<retry_after>,
+500, 400, drop (закрыть сокет, не ответив), close (ответить ok и закрыть
+соединение без Connection: close), slow (ok через SLOW_SECONDS).
+Пустая очередь - ok.
+
+Запуск: python scripts/check_telegram_client.py
+"""
+
+import importlib.util
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SLOW_SECONDS = 0.3
+
+
+class FakeTelegram:
+    script = []
+    lock = threading.Lock()
+    connections = 0
+    requests = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # Заголовки и тело уходят отдельными write: без TCP_NODELAY Nagle
+        # добавляет к каждому ответу фейка ~40 мс задержки ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        FakeTelegram.connections += 1
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with FakeTelegram.lock:
+            FakeTelegram.requests += 1
+            action = FakeTelegram.script.pop(0) if FakeTelegram.script else 'ok'
+
+        if action == 'drop':
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+        elif action.startswith('429:'):
+            retry_after = int(action.split(':')[1])
+            self._send(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                             'parameters': {'retry_after': retry_after}}, {'Retry-After': str(retry_after)})
+        elif action == '500':
+            self._send(500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+        elif action == '400':
+            self._send(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'})
+        else:
+            if action == 'slow':
+                time.sleep(SLOW_SECONDS)
+            self._send(200, {'ok': True, 'result': {'message_id': FakeTelegram.requests}})
+            if action == 'close':
+                self.close_connection = True
+
+
+def load_client_module():
+    module_dir = ROOT / 'backend' / 'telegram-lead'
+    sys.path.insert(0, str(module_dir))
+    spec = importlib.util.spec_from_file_location('telegram_client', module_dir / 'telegram_client.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    telegram_client = load_client_module()
+    telegram_client.BACKOFF_BASE = 0.05
+    failures = 0
+
+    def check(name, script, expect, max_retries=4, max_wait=2.0, url=base_url):
+        nonlocal failures
+        FakeTelegram.script = list(script)
+        FakeTelegram.connections = 0
+        FakeTelegram.requests = 0
+        client = telegram_client.TelegramClient(url, timeout=2, max_retries=max_retries, max_wait=max_wait)
+        started = time.perf_counter()
+        try:
+            outcome = expect(client)
+        except Exception as e:
+            outcome = f'unexpected {type(e).__name__}: {e}'
+        elapsed = time.perf_counter() - started
+        ok = outcome is True
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {name} ({elapsed:.2f}s, {FakeTelegram.connections} conn, {client.stats()})")
+        if not ok:
+            print(f'     {outcome}')
+        client.close()
+
+    def send(client):
+        return client.send_message('TOKEN', '1', 'text')
+
+    def keep_alive(client):
+        for _ in range(5):
+            send(client)
+        return FakeTelegram.connections == 1 or f'{FakeTelegram.connections} connections for 5 calls'
+
+    def get_me(client):
+        return client.call('TOKEN', 'getMe', {})
+
+    def retried(expected_retries, min_seconds=0.0, call=send):
+        def run(client):
+            started = time.perf_counter()
+            call(client)
+            elapsed = time.perf_counter() - started
+            if client.last_call['retries'] != expected_retries:
+                return f"retries={client.last_call['retries']}, expected {expected_retries}"
+            return elapsed >= min_seconds or f'waited {elapsed:.2f}s, expected >= {min_seconds}s'
+        return run
+
+    def raises(exception_name, max_seconds, call=send, requests=None):
+        def run(client):
+            started = time.perf_counter()
+            try:
+                call(client)
+            except Exception as e:
+                elapsed = time.perf_counter() - started
+                if type(e).__name__ != exception_name:
+                    return f'raised {type(e).__name__}: {e}'
+                if requests is not None and FakeTelegram.requests != requests:
+                    return f'{FakeTelegram.requests} requests reached the server, expected {requests}'
+                return elapsed <= max_seconds or f'took {elapsed:.2f}s'
+            return 'no exception'
+        return run
+
+    def idle_close(client):
+        # Сервер закрывает keep-alive соединение после ответа, пока оно простаивает
+        FakeTelegram.script = ['close']
+        send(client)
+        time.sleep(0.05)
+        started = time.perf_counter()
+        send(client)
+        elapsed = time.perf_counter() - started
+        if client.stats()['reconnects'] != 1 or client.last_call['retries'] != 0:
+            return f"reconnects={client.stats()['reconnects']}, retries={client.last_call['retries']}"
+        return (elapsed < 0.05 and FakeTelegram.connections == 2) or f'reconnect took {elapsed:.2f}s'
+
+    def parallel(client):
+        # Четыре медленных ответа параллельно: блокировка не держится на время запроса
+        FakeTelegram.script = ['slow'] * 4
+        started = time.perf_counter()
+        threads = [threading.Thread(target=send, args=(client,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if FakeTelegram.requests != 4:
+            return f'{FakeTelegram.requests} requests'
+        connections = FakeTelegram.connections
+        for _ in range(4):
+            send(client)
+        if FakeTelegram.connections != connections:
+            return f'{FakeTelegram.connections - connections} new connection(s) after the pool was warm'
+        return elapsed < 2 * SLOW_SECONDS or f'4 parallel calls took {elapsed:.2f}s'
+
+    # Порт, на котором никто не слушает: соединение не устанавливается,
+    # запрос не уходит, и sendMessage можно повторять
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        refused_url = f'http://127.0.0.1:{probe.getsockname()[1]}'
+
+    check('keep-alive: 5 calls over one connection', [], keep_alive)
+    check('429 retry_after=1 is honoured', ['429:1'], retried(1, min_seconds=1.0))
+    check('429 retry_after above max_wait is raised', ['429:60'], raises('TelegramRateLimited', 0.5))
+    check('500 twice, then ok', ['500', '500'], retried(2))
+    check('sendMessage dropped after sending is not retried', ['drop'], raises('TelegramDeliveryUnknown', 0.5, requests=1))
+    check('getMe dropped after sending is retried', ['drop'], retried(1, call=get_me))
+    check('idle keep-alive closed by server', [], idle_close)
+    check('parallel calls do not wait for each other', [], parallel)
+    check('400 is not retried', ['400'], raises('TelegramError', 0.5))
+    check('gives up after max_retries', ['drop'] * 10, raises('TelegramError', 5, call=get_me, requests=4), max_retries=3)
+    check('refused connection is retried, then raised', [], raises('TelegramError', 5), max_retries=2, url=refused_url)
+    check('429 on every retry is raised', ['429:1'] * 10, raises('TelegramRateLimited', 5), max_retries=2)
+
+    server.shutdown()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
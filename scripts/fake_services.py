@@ -0,0 +1,137 @@
+"""
+Локальные подделки внешних сервисов для бенчмарков: Google OAuth (/token),
+GA4 Data API (runReport с limit/offset, именованными dateRanges и измерением
+date) и Telegram Bot API (sendMessage). Один HTTP-сервер на все три.
+
+    services = FakeServices(rows=2000).start()
+    os.environ.update(services.env())
+"""
+
+import json
+import random
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+EVENTS = ('page_view', 'engaged_scroll', 'view_item', 'begin_checkout', 'generate_lead')
+
+
+class FakeServices:
+    def __init__(self, rows: int = 2000, seed: int = 1):
+        r = random.Random(seed)
+        # (event, source, medium, campaign, count); как и в GA4, сочетание
+        # измерений в ответе уникально, иначе ga4_store получит дубли ключа
+        combos = {}
+        while len(combos) < rows:
+            combos.setdefault(
+                (r.choice(EVENTS), f'src{r.randrange(30)}', r.choice(('cpc', 'organic', '(none)')), f'camp{r.randrange(200)}'),
+                r.randint(1, 500)
+            )
+        self.rows = [key + (count,) for key, count in combos.items()]
+        self.counts = {'token': 0, 'runReport': 0, 'sendMessage': 0}
+        self._lock = threading.Lock()
+        self._server = None
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.credentials = json.dumps({
+            'client_email': 'bench@fake.iam.gserviceaccount.com',
+            'private_key': key.private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+            ).decode('utf-8')
+        })
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self) -> 'FakeServices':
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status, payload = services.route(self.path, body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def env(self) -> Dict[str, str]:
+        """
+        Переменные окружения, которые направляют функции на подделку
+        """
+        return {
+            'GOOGLE_TOKEN_URL': f'{self.base_url}/token',
+            'GA4_API_URL': self.base_url,
+            'TELEGRAM_API_URL': self.base_url,
+            'GA4_CREDENTIALS_JSON': self.credentials,
+            'GA4_PROPERTY_ID': '100000001',
+            'TELEGRAM_BOT_TOKEN': '1000000000:fake-bench-token',
+            'TELEGRAM_CHAT_ID': '1'
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def route(self, path: str, body: bytes):
+        if path == '/token':
+            self._count('token')
+            return 200, {'access_token': 'fake-access-token', 'expires_in': 3600, 'token_type': 'Bearer'}
+        if path.endswith(':runReport'):
+            self._count('runReport')
+            return 200, self.run_report(json.loads(body))
+        if path.endswith('/sendMessage'):
+            self._count('sendMessage')
+            return 200, {'ok': True, 'result': {'message_id': self.counts['sendMessage']}}
+        return 404, {'error': {'code': 404, 'message': f'Unknown path {path}'}}
+
+    def run_report(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        dimensions = [dimension['name'] for dimension in request['dimensions']]
+        date_ranges = request['dateRanges']
+        named = len(date_ranges) > 1 or any(date_range.get('name') for date_range in date_ranges)
+        rows: List[Dict[str, Any]] = []
+
+        for index, date_range in enumerate(date_ranges):
+            start = date.fromisoformat(date_range['startDate'])
+            days = (date.fromisoformat(date_range['endDate']) - start).days + 1
+            for i, (event_name, source, medium, campaign, count) in enumerate(self.rows):
+                by_name = {
+                    'eventName': event_name,
+                    'sessionSource': source,
+                    'sessionMedium': medium,
+                    'sessionCampaignName': campaign,
+                    'date': (start + timedelta(days=i % days)).strftime('%Y%m%d')
+                }
+                values = [by_name.get(name, '(not set)') for name in dimensions]
+                if named:
+                    values.append(date_range.get('name') or f'date_range_{index}')
+                rows.append({
+                    'dimensionValues': [{'value': value} for value in values],
+                    'metricValues': [{'value': str(count)}]
+                })
+
+        headers = [{'name': name} for name in dimensions] + ([{'name': 'dateRange'}] if named else [])
+        offset = int(request.get('offset', 0))
+        limit = int(request.get('limit', 10000))
+        return {'dimensionHeaders': headers, 'rows': rows[offset:offset + limit], 'rowCount': len(rows)}
@@ -3,7 +3,7 @@ import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import { analytics } from '@/utils/analytics';
-import { getLeads, exportLeadsToJSON, exportLeadsToCSV, clearLeads } from '@/services/leadsStorage';
+import { getLeadStats, exportLeadsToJSON, exportLeadsToCSV, clearLeads } from '@/services/leadsStorage';
 
 export const AnalyticsDashboard = () => {
   const [isVisible, setIsVisible] = useState(false);
@@ -24,12 +24,17 @@ export const AnalyticsDashboard = () => {
   useEffect(() => {
     const interval = setInterval(() => {
       setStats(analytics.getEngagementStats());
-      setLeadsCount(getLeads().length);
     }, 1000);
 
     return () => clearInterval(interval);
   }, []);
 
+  // Число лидов - из агрегата get-leads, без загрузки самих лидов
+  useEffect(() => {
+    if (!isOpen) return;
+    getLeadStats(['device']).then(leadStats => setLeadsCount(leadStats?.total.leads ?? 0));
+  }, [isOpen]);
+
   useEffect(() => {
     let sequence = '';
     const SECRET_CODE = 'admin';
@@ -208,7 +213,7 @@ export const AnalyticsDashboard = () => {
             <Button
               variant="default"
               size="sm"
-              onClick={exportLeadsToJSON}
+              onClick={() => exportLeadsToJSON()}
               className="w-full text-xs bg-gradient-to-r from-blue-500 to-cyan-500"
               disabled={leadsCount === 0}
             >
@@ -219,7 +224,7 @@ export const AnalyticsDashboard = () => {
             <Button
               variant="default"
               size="sm"
-              onClick={exportLeadsToCSV}
+              onClick={() => exportLeadsToCSV()}
               className="w-full text-xs bg-gradient-to-r from-green-500 to-emerald-500"
               disabled={leadsCount === 0}
             >
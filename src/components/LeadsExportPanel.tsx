@@ -1,18 +1,76 @@
-import { useState, useEffect, useMemo } from 'react';
+import { useState, useEffect, useMemo, useRef } from 'react';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
-import { type Lead } from '@/services/leadsStorage';
+import {
+  type Lead,
+  type LeadsQuery,
+  type LeadStats,
+  getLeadsPage,
+  getLeadsForExport,
+  getLeadStats,
+} from '@/services/leadsStorage';
 import { LeadsFilterControls, type Filters } from './leads-export/LeadsFilterControls';
 import { LeadsPreviewTable } from './leads-export/LeadsPreviewTable';
 import { LeadsExportButtons } from './leads-export/LeadsExportButtons';
 import { isAdminAuthorized, setupAdminKeyListener } from '@/utils/adminAuth';
-import { getLeads as getLocalLeads } from '@/services/leadsStorage';
+
+const uniqueOf = (values: (string | number)[]): string[] =>
+  [...new Set(values.map(String).filter(Boolean))];
+
+// Период, устройство и utm source/medium/campaign фильтруются в get-leads;
+// content, term, скролл и поиск - по уже загруженным лидам
+const toLeadsQuery = (filters: Filters): LeadsQuery => {
+  const query: LeadsQuery = {};
+  const today = new Date();
+  today.setHours(0, 0, 0, 0);
+  const daysAgo = (days: number): number => {
+    const date = new Date(today);
+    date.setDate(date.getDate() - days);
+    return date.getTime();
+  };
+
+  switch (filters.dateFilter) {
+    case 'today':
+      query.dateFrom = today.getTime();
+      break;
+    case 'yesterday':
+      query.dateFrom = daysAgo(1);
+      query.dateTo = today.getTime() - 1;
+      break;
+    case 'last7':
+      query.dateFrom = daysAgo(7);
+      break;
+    case 'last30':
+      query.dateFrom = daysAgo(30);
+      break;
+    case 'month':
+      query.dateFrom = new Date(today.getFullYear(), today.getMonth(), 1).getTime();
+      break;
+    case 'custom':
+      if (filters.customDateFrom && filters.customDateTo) {
+        const to = new Date(filters.customDateTo);
+        to.setHours(23, 59, 59, 999);
+        query.dateFrom = new Date(filters.customDateFrom).getTime();
+        query.dateTo = to.getTime();
+      }
+      break;
+  }
+
+  if (filters.device !== 'all') query.device = filters.device;
+  if (filters.utmSource !== 'all') query.utm_source = filters.utmSource;
+  if (filters.utmMedium !== 'all') query.utm_medium = filters.utmMedium;
+  if (filters.utmCampaign !== 'all') query.utm_campaign = filters.utmCampaign;
+  return query;
+};
 
 export const LeadsExportPanel = () => {
   const [isOpen, setIsOpen] = useState(false);
   const [searchQuery, setSearchQuery] = useState('');
   const [leads, setLeads] = useState<Lead[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [allStats, setAllStats] = useState<LeadStats | null>(null);
+  const [matchingStats, setMatchingStats] = useState<LeadStats | null>(null);
   const [isAuthorized, setIsAuthorized] = useState(false);
   const [filters, setFilters] = useState<Filters>({
     dateFilter: 'all',
@@ -30,21 +88,47 @@ export const LeadsExportPanel = () => {
 
   const [isLoading, setIsLoading] = useState(false);
 
-  const fetchLeads = async () => {
-    if (isLoading) return;
-    
+  const leadsQuery = useMemo(() => toLeadsQuery(filters), [filters]);
+  const leadsQueryKey = JSON.stringify(leadsQuery);
+  // Ответ на устаревший запрос (фильтры сменились, пока он шёл) отбрасывается
+  const requestRef = useRef(0);
+
+  const fetchLeads = async (cursor: string | null = null) => {
+    const request = ++requestRef.current;
     setIsLoading(true);
     try {
-      const fetchedLeads = await getLocalLeads();
-      setLeads(fetchedLeads);
+      const page = await getLeadsPage(cursor, undefined, leadsQuery);
+      if (request !== requestRef.current) return;
+      setLeads(current => cursor ? [...current, ...page.leads] : page.leads);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Failed to fetch leads:', error);
-      setLeads([]);
+      if (request !== requestRef.current) return;
+      if (!cursor) setLeads([]);
+      setNextCursor(null);
     } finally {
-      setIsLoading(false);
+      if (request === requestRef.current) setIsLoading(false);
     }
   };
 
+  const statsRequestRef = useRef(0);
+
+  const fetchStats = async () => {
+    const request = ++statsRequestRef.current;
+    const [all, matching] = await Promise.all([
+      getLeadStats(['utm_source', 'utm_medium', 'utm_campaign']),
+      getLeadStats(['device'], leadsQuery),
+    ]);
+    if (request !== statsRequestRef.current) return;
+    setAllStats(all);
+    setMatchingStats(matching);
+  };
+
+  const refresh = () => {
+    fetchLeads();
+    fetchStats();
+  };
+
   useEffect(() => {
     setIsAuthorized(isAdminAuthorized());
     
@@ -69,54 +153,21 @@ export const LeadsExportPanel = () => {
   }, []);
 
   useEffect(() => {
-    if (isOpen && isAuthorized && !isLoading && leads.length === 0) {
-      fetchLeads();
+    if (isOpen && isAuthorized) {
+      refresh();
     }
-  }, [isOpen, isAuthorized]);
+  }, [isOpen, isAuthorized, leadsQueryKey]);
 
   const uniqueValues = useMemo(() => {
+    const groups = allStats?.groups ?? [];
     return {
-      sources: [...new Set(leads.map(l => l.utmSource).filter(Boolean))],
-      mediums: [...new Set(leads.map(l => l.utmMedium).filter(Boolean))],
-      campaigns: [...new Set(leads.map(l => l.utmCampaign).filter(Boolean))],
-      contents: [...new Set(leads.map(l => l.utmContent).filter(Boolean))],
-      terms: [...new Set(leads.map(l => l.utmTerm).filter(Boolean))],
+      sources: uniqueOf(groups.map(g => g.utmSource)),
+      mediums: uniqueOf(groups.map(g => g.utmMedium)),
+      campaigns: uniqueOf(groups.map(g => g.utmCampaign)),
+      contents: uniqueOf(leads.map(l => l.utmContent)),
+      terms: uniqueOf(leads.map(l => l.utmTerm)),
     };
-  }, [leads]);
-
-  const filterByDate = (lead: Lead): boolean => {
-    const leadDate = new Date(lead.timestamp);
-    const today = new Date();
-    today.setHours(0, 0, 0, 0);
-
-    switch (filters.dateFilter) {
-      case 'today':
-        return leadDate >= today;
-      case 'yesterday':
-        const yesterday = new Date(today);
-        yesterday.setDate(yesterday.getDate() - 1);
-        return leadDate >= yesterday && leadDate < today;
-      case 'last7':
-        const last7 = new Date(today);
-        last7.setDate(last7.getDate() - 7);
-        return leadDate >= last7;
-      case 'last30':
-        const last30 = new Date(today);
-        last30.setDate(last30.getDate() - 30);
-        return leadDate >= last30;
-      case 'month':
-        const monthStart = new Date(today.getFullYear(), today.getMonth(), 1);
-        return leadDate >= monthStart;
-      case 'custom':
-        if (!filters.customDateFrom || !filters.customDateTo) return true;
-        const from = new Date(filters.customDateFrom);
-        const to = new Date(filters.customDateTo);
-        to.setHours(23, 59, 59, 999);
-        return leadDate >= from && leadDate <= to;
-      default:
-        return true;
-    }
-  };
+  }, [allStats, leads]);
 
   const filterByScroll = (lead: Lead): boolean => {
     if (filters.scrollFilter === 'all') return true;
@@ -130,14 +181,12 @@ export const LeadsExportPanel = () => {
     }
   };
 
-  const filteredLeads = useMemo(() => {
-    let result = leads.filter(lead => {
-      if (!filterByDate(lead)) return false;
+  const hasLocalFilters = filters.utmContent !== 'all' || filters.utmTerm !== 'all'
+    || filters.scrollFilter !== 'all' || searchQuery.trim() !== '';
+
+  const applyLocalFilters = (source: Lead[]): Lead[] => {
+    let result = source.filter(lead => {
       if (!filterByScroll(lead)) return false;
-      if (filters.device !== 'all' && lead.device !== filters.device) return false;
-      if (filters.utmSource !== 'all' && lead.utmSource !== filters.utmSource) return false;
-      if (filters.utmMedium !== 'all' && lead.utmMedium !== filters.utmMedium) return false;
-      if (filters.utmCampaign !== 'all' && lead.utmCampaign !== filters.utmCampaign) return false;
       if (filters.utmContent !== 'all' && lead.utmContent !== filters.utmContent) return false;
       if (filters.utmTerm !== 'all' && lead.utmTerm !== filters.utmTerm) return false;
       return true;
@@ -170,7 +219,14 @@ export const LeadsExportPanel = () => {
     }
 
     return result;
-  }, [leads, filters, searchQuery]);
+  };
+
+  // Сортировка, как и локальные фильтры, действует на загруженные страницы
+  const filteredLeads = useMemo(() => applyLocalFilters(leads), [leads, filters, searchQuery]);
+
+  const getExportLeads = async (): Promise<Lead[]> => applyLocalFilters(await getLeadsForExport(leadsQuery));
+
+  const matchingCount = matchingStats?.total.leads ?? 0;
 
   const resetFilters = () => {
     setFilters({
@@ -216,7 +272,7 @@ export const LeadsExportPanel = () => {
             <Button
               variant="ghost"
               size="sm"
-              onClick={fetchLeads}
+              onClick={refresh}
               className="h-8 w-8 p-0"
               title="Обновить"
             >
@@ -235,8 +291,8 @@ export const LeadsExportPanel = () => {
 
         <div className="mb-4 p-3 rounded-lg bg-gradient-to-r from-green-500/20 to-emerald-500/20 border border-green-500/30">
           <div className="text-center">
-            <div className="text-2xl font-bold text-green-400">{filteredLeads.length}</div>
-            <div className="text-xs text-muted-foreground">из {leads.length} лидов</div>
+            <div className="text-2xl font-bold text-green-400">{matchingCount}</div>
+            <div className="text-xs text-muted-foreground">из {allStats?.total.leads ?? 0} лидов</div>
           </div>
         </div>
 
@@ -251,10 +307,14 @@ export const LeadsExportPanel = () => {
           totalLeads={leads.length}
           searchQuery={searchQuery}
           setSearchQuery={setSearchQuery}
+          hasMore={nextCursor !== null}
+          isLoading={isLoading}
+          onLoadMore={() => fetchLeads(nextCursor)}
         />
 
         <LeadsExportButtons 
-          filteredLeads={filteredLeads}
+          getExportLeads={getExportLeads}
+          exportCount={hasLocalFilters ? null : matchingCount}
           resetFilters={resetFilters}
         />
       </Card>
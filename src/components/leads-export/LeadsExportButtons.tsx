@@ -1,15 +1,34 @@
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
+import { useState } from 'react';
 import { type Lead } from '@/services/leadsStorage';
 import { type Filters } from './LeadsFilterControls';
 
 interface LeadsExportButtonsProps {
-  filteredLeads: Lead[];
+  // Все лиды под текущими фильтрами, а не только загруженные страницы
+  getExportLeads: () => Promise<Lead[]>;
+  // null, если часть фильтров применяется в браузере и число заранее неизвестно
+  exportCount: number | null;
   resetFilters: () => void;
 }
 
-export const LeadsExportButtons = ({ filteredLeads, resetFilters }: LeadsExportButtonsProps) => {
-  const exportToJSON = () => {
+export const LeadsExportButtons = ({ getExportLeads, exportCount, resetFilters }: LeadsExportButtonsProps) => {
+  const [isExporting, setIsExporting] = useState(false);
+  const countLabel = exportCount === null ? '' : ` (${exportCount})`;
+
+  const withExportLeads = (write: (leads: Lead[]) => void) => async () => {
+    setIsExporting(true);
+    try {
+      write(await getExportLeads());
+    } catch (error) {
+      console.error('Failed to export leads:', error);
+      alert('Не удалось выгрузить лиды');
+    } finally {
+      setIsExporting(false);
+    }
+  };
+
+  const exportToJSON = withExportLeads((filteredLeads) => {
     if (filteredLeads.length === 0) {
       alert('Нет лидов для экспорта с текущими фильтрами');
       return;
@@ -25,9 +44,9 @@ export const LeadsExportButtons = ({ filteredLeads, resetFilters }: LeadsExportB
     link.click();
     document.body.removeChild(link);
     URL.revokeObjectURL(url);
-  };
+  });
 
-  const exportToCSV = () => {
+  const exportToCSV = withExportLeads((filteredLeads) => {
     if (!filteredLeads || filteredLeads.length === 0) {
       alert('Нет лидов для экспорта с текущими фильтрами');
       return;
@@ -98,26 +117,26 @@ export const LeadsExportButtons = ({ filteredLeads, resetFilters }: LeadsExportB
     link.click();
     document.body.removeChild(link);
     URL.revokeObjectURL(url);
-  };
+  });
 
   return (
     <div className="mt-6 space-y-2">
       <Button
         onClick={exportToJSON}
-        disabled={filteredLeads.length === 0}
+        disabled={exportCount === 0 || isExporting}
         className="w-full text-sm bg-gradient-to-r from-blue-500 to-cyan-500"
       >
         <Icon name="FileJson" size={16} className="mr-2" />
-        Скачать JSON ({filteredLeads.length})
+        Скачать JSON{countLabel}
       </Button>
 
       <Button
         onClick={exportToCSV}
-        disabled={filteredLeads.length === 0}
+        disabled={exportCount === 0 || isExporting}
         className="w-full text-sm bg-gradient-to-r from-green-500 to-emerald-500"
       >
         <Icon name="FileSpreadsheet" size={16} className="mr-2" />
-        Скачать CSV ({filteredLeads.length})
+        Скачать CSV{countLabel}
       </Button>
 
       <Button
@@ -8,13 +8,19 @@ interface LeadsPreviewTableProps {
   totalLeads: number;
   searchQuery: string;
   setSearchQuery: (query: string) => void;
+  hasMore: boolean;
+  isLoading: boolean;
+  onLoadMore: () => void;
 }
 
 export const LeadsPreviewTable = ({ 
   filteredLeads, 
   totalLeads, 
   searchQuery, 
-  setSearchQuery 
+  setSearchQuery,
+  hasMore,
+  isLoading,
+  onLoadMore
 }: LeadsPreviewTableProps) => {
   const [showPreview, setShowPreview] = useState(true);
 
@@ -159,6 +165,19 @@ export const LeadsPreviewTable = ({
               )}
             </div>
           )}
+
+          {hasMore && (
+            <Button
+              variant="ghost"
+              size="sm"
+              onClick={onLoadMore}
+              disabled={isLoading}
+              className="w-full mt-2 h-7 text-xs"
+            >
+              <Icon name={isLoading ? 'Loader2' : 'ChevronsDown'} size={14} className={`mr-1 ${isLoading ? 'animate-spin' : ''}`} />
+              Загрузить ещё
+            </Button>
+          )}
         </>
       )}
     </div>
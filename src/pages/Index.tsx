@@ -26,7 +26,6 @@ import { usePageTracking } from "@/hooks/usePageTracking";
 import { useExitIntent } from "@/hooks/useExitIntent";
 import { useConsultationSlots } from "@/hooks/useConsultationSlots";
 import { analytics } from "@/utils/analytics";
-import { sendTelegramNotification } from "@/services/telegramNotify";
 import { parseAndSaveUTM, getUTMParams, getReferrer } from "@/utils/utmTracking";
 import { getOrganizationSchema, getPersonSchema, getServiceSchema, getLocalBusinessSchema, getBreadcrumbSchema } from "@/utils/schemaOrg";
 import { pixelIntegration } from "@/utils/pixelIntegration";
@@ -137,8 +136,6 @@ const Index = () => {
         referrer: getReferrer(),
       });
       
-      await sendTelegramNotification(savedFormData, trackingData);
-      
       decreaseSlot();
       setFormData({ name: "", contact: "", niche: "", goal: "", pdnConsent: false });
       setIsModalOpen(true);
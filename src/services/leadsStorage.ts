@@ -1,5 +1,7 @@
 import func2url from '@/../backend/func2url.json';
 
+export const LEADS_PAGE_SIZE = 50;
+
 export interface Lead {
   id: string;
   timestamp: number;
@@ -56,35 +58,120 @@ export const saveLead = async (lead: Omit<Lead, 'id' | 'timestamp' | 'date'>): P
   }
 };
 
-export const getLeads = async (): Promise<Lead[]> => {
-  try {
-    const url = func2url['get-leads'];
-    if (!url) {
-      console.warn('get-leads URL not found in func2url.json');
-      return [];
-    }
+export interface LeadsQuery {
+  dateFrom?: number;
+  dateTo?: number;
+  device?: string;
+  utm_source?: string;
+  utm_medium?: string;
+  utm_campaign?: string;
+  niche?: string;
+}
+
+export interface LeadsPage {
+  leads: Lead[];
+  nextCursor: string | null;
+}
+
+const queryParams = (query: LeadsQuery, params = new URLSearchParams()): URLSearchParams => {
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined && value !== '') params.set(key, String(value));
+  });
+  return params;
+};
+
+export const getLeadsPage = async (
+  cursor?: string | null,
+  limit: number = LEADS_PAGE_SIZE,
+  query: LeadsQuery = {}
+): Promise<LeadsPage> => {
+  const url = func2url['get-leads'];
+  if (!url) {
+    console.warn('get-leads URL not found in func2url.json');
+    return { leads: [], nextCursor: null };
+  }
 
-    const response = await fetch(url, {
+  const params = queryParams(query);
+  if (cursor) params.set('cursor', cursor);
+  if (limit) params.set('limit', String(limit));
+  const search = params.toString();
+
+  const response = await fetch(search ? `${url}?${search}` : url, {
+    method: 'GET',
+    headers: { 'Content-Type': 'application/json' },
+  });
+  
+  if (!response.ok) {
+    throw new Error(`get-leads returned ${response.status}`);
+  }
+  
+  const contentType = response.headers.get('content-type');
+  if (!contentType || !contentType.includes('application/json')) {
+    throw new Error('get-leads response is not JSON');
+  }
+  
+  const data = await response.json();
+  return { leads: data.leads || [], nextCursor: data.nextCursor || null };
+};
+
+// Все подходящие лиды одним потоковым NDJSON-ответом - только для выгрузки файла.
+// Для просмотра есть getLeadsPage, для счётчиков - getLeadStats
+export const getLeadsForExport = async (query: LeadsQuery = {}): Promise<Lead[]> => {
+  const url = func2url['get-leads'];
+  if (!url) {
+    console.warn('get-leads URL not found in func2url.json');
+    return [];
+  }
+
+  const params = queryParams(query, new URLSearchParams({ format: 'ndjson' }));
+  const response = await fetch(`${url}?${params.toString()}`, { method: 'GET' });
+  if (!response.ok) {
+    throw new Error(`get-leads export returned ${response.status}`);
+  }
+
+  const body = await response.text();
+  return body.split('\n').filter(line => line.trim()).map(line => JSON.parse(line) as Lead);
+};
+
+export type LeadStatsDimension = 'utm_source' | 'utm_medium' | 'utm_campaign' | 'device' | 'day';
+
+export interface LeadStatsMetrics {
+  leads: number;
+  avgPageDepth: number;
+  avgTimeOnPage: number;
+}
+
+export interface LeadStats {
+  groupBy: LeadStatsDimension[];
+  groups: (LeadStatsMetrics & Record<string, string | number>)[];
+  total: LeadStatsMetrics;
+}
+
+export const getLeadStats = async (
+  groupBy: LeadStatsDimension[] = ['day'],
+  query: LeadsQuery = {}
+): Promise<LeadStats | null> => {
+  const url = func2url['get-leads'];
+  if (!url) {
+    console.warn('get-leads URL not found in func2url.json');
+    return null;
+  }
+
+  const params = queryParams(query, new URLSearchParams({ view: 'stats', groupBy: groupBy.join(',') }));
+
+  try {
+    const response = await fetch(`${url}?${params.toString()}`, {
       method: 'GET',
       headers: { 'Content-Type': 'application/json' },
     });
-    
     if (!response.ok) {
-      console.warn(`get-leads returned ${response.status}`);
-      return [];
+      console.warn(`get-leads stats returned ${response.status}`);
+      return null;
     }
-    
-    const contentType = response.headers.get('content-type');
-    if (!contentType || !contentType.includes('application/json')) {
-      console.warn('get-leads response is not JSON');
-      return [];
-    }
-    
-    const data = await response.json();
-    return data.leads || [];
+    return await response.json();
   } catch (error) {
-    console.warn('get-leads fetch failed:', error instanceof Error ? error.message : 'Unknown error');
-    return [];
+    console.warn('get-leads stats fetch failed:', error instanceof Error ? error.message : 'Unknown error');
+    return null;
   }
 };
 
@@ -92,8 +179,8 @@ export const clearLeads = (): void => {
   console.log('clearLeads is deprecated - leads are now in database');
 };
 
-export const exportLeadsToJSON = async (): Promise<void> => {
-  const leads = await getLeads();
+export const exportLeadsToJSON = async (query: LeadsQuery = {}): Promise<void> => {
+  const leads = await getLeadsForExport(query);
   const dataStr = JSON.stringify(leads, null, 2);
   const dataBlob = new Blob([dataStr], { type: 'application/json' });
   const url = URL.createObjectURL(dataBlob);
@@ -106,8 +193,8 @@ export const exportLeadsToJSON = async (): Promise<void> => {
   URL.revokeObjectURL(url);
 };
 
-export const exportLeadsToCSV = async (): Promise<void> => {
-  const leads = await getLeads();
+export const exportLeadsToCSV = async (query: LeadsQuery = {}): Promise<void> => {
+  const leads = await getLeadsForExport(query);
   
   if (leads.length === 0) {
     alert('Нет лидов для экспорта');
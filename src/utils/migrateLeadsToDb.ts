@@ -1,4 +1,7 @@
 import func2url from '@/../backend/func2url.json';
+import { type Lead } from '@/services/leadsStorage';
+
+const MIGRATION_BATCH_SIZE = 500;
 
 export const migrateLocalLeadsToDatabase = async (): Promise<void> => {
   try {
@@ -8,34 +11,38 @@ export const migrateLocalLeadsToDatabase = async (): Promise<void> => {
       return;
     }
 
-    const leads = JSON.parse(localLeads);
+    const leads: Lead[] = JSON.parse(localLeads);
     console.log(`Migrating ${leads.length} leads to database...`);
 
-    for (const lead of leads) {
-      const leadData = {
-        id: lead.id,
-        timestamp: lead.timestamp,
-        date: lead.date,
-        name: lead.name,
-        contact: lead.contact,
-        niche: lead.niche || '',
-        goal: lead.goal || '',
-        utm_source: lead.utmSource || '',
-        utm_medium: lead.utmMedium || '',
-        utm_campaign: lead.utmCampaign || '',
-        utm_content: lead.utmContent || '',
-        utm_term: lead.utmTerm || '',
-        page_depth: lead.pageDepth || 0,
-        time_on_page: lead.timeOnPage || 0,
-        device: lead.device || 'desktop',
-        referrer: lead.referrer || '',
-      };
+    const leadsData = leads.map((lead) => ({
+      id: lead.id,
+      timestamp: lead.timestamp,
+      date: lead.date,
+      name: lead.name,
+      contact: lead.contact,
+      niche: lead.niche || '',
+      goal: lead.goal || '',
+      utm_source: lead.utmSource || '',
+      utm_medium: lead.utmMedium || '',
+      utm_campaign: lead.utmCampaign || '',
+      utm_content: lead.utmContent || '',
+      utm_term: lead.utmTerm || '',
+      page_depth: lead.pageDepth || 0,
+      time_on_page: lead.timeOnPage || 0,
+      device: lead.device || 'desktop',
+      referrer: lead.referrer || '',
+    }));
 
-      await fetch(func2url['save-lead'], {
+    for (let i = 0; i < leadsData.length; i += MIGRATION_BATCH_SIZE) {
+      const response = await fetch(func2url['save-lead'], {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(leadData),
+        body: JSON.stringify(leadsData.slice(i, i + MIGRATION_BATCH_SIZE)),
       });
+
+      if (!response.ok) {
+        throw new Error(`Failed to migrate leads batch: ${response.status}`);
+      }
     }
 
     console.log('Migration completed successfully');